@@ -1,16 +1,164 @@
+"""Admin pages that stay cheap on tables with millions of rows.
+
+Changelists here never count, sort or LIKE-scan a whole table:
+
+* ``KeysetChangeList`` shows the newest rows first and pages with
+  ``?id__lt=<last id shown>`` instead of OFFSET. Its count is an estimate:
+  max(id) - min(id) + 1 for an unfiltered list, otherwise a count that
+  stops at ``COUNT_CAP`` rows.
+* Searches match a prefix of unique (so indexed) columns as a range on their
+  index, or an id; message text goes through the full-text index, limited
+  to the newest ``CHAT_SEARCH_MAX_CANDIDATES`` matches below the cursor.
+* Foreign keys are loaded with ``list_select_related`` and edited through
+  ``raw_id_fields``, so neither a list nor a form reads a related table.
+"""
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Member, AuthToken
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Max, Min, Q
+from django.db.models.expressions import RawSQL
+
+from .models import AuthToken, ChatRoom, Member, Message
+from .search import match_expression, query_terms
+
+# Filtered lists stop counting here and show "more than".
+COUNT_CAP = 10000
+MAX_ID = 2**63 - 1
+# Sorts after every other character, so [term, term + MAX_CHAR) is a prefix.
+MAX_CHAR = "\U0010ffff"
+
+
+def estimated_count(queryset):
+    """``(count, capped)`` of ``queryset`` without counting a whole table.
+
+    Ids are contiguous apart from deleted rows, so for an unfiltered table
+    the id range is close; SQLite answers min() and max() from the primary
+    key, one query each.
+    """
+    queryset = queryset.order_by()
+    if not queryset.query.where:
+        last = queryset.aggregate(last=Max("pk"))["last"]
+        if last is None:
+            return 0, False
+        return last - queryset.aggregate(first=Min("pk"))["first"] + 1, False
+    count = queryset[: COUNT_CAP + 1].count()
+    return min(count, COUNT_CAP), count > COUNT_CAP
+
+
+class KeysetChangeList(ChangeList):
+    def get_ordering(self, request, queryset):
+        # The only order every page can continue from with id__lt.
+        return ["-pk"]
+
+    def get_results(self, request):
+        rows = list(self.queryset[: self.list_per_page + 1])
+        self.result_list = rows[: self.list_per_page]
+        self.result_count, self.result_count_capped = estimated_count(self.queryset)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = None
+        cursor = f"{self.lookup_opts.pk.attname}__lt"
+        self.older_url = None
+        if len(rows) > self.list_per_page:
+            self.older_url = self.get_query_string({cursor: self.result_list[-1].pk})
+        self.newest_url = None
+        if cursor in self.params:
+            self.newest_url = self.get_query_string(remove=[cursor])
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    change_list_template = "admin/api/keyset_change_list.html"
+    sortable_by = ()
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    list_per_page = 100
+    # Unique columns, possibly across a relation, searched by prefix.
+    prefix_search_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_fields(self, request):
+        # Only decides whether the search box is shown.
+        return self.prefix_search_fields or ("pk",)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field in self.prefix_search_fields:
+            condition |= Q(**{f"{field}__gte": term, f"{field}__lt": term + MAX_CHAR})
+        if term.isdigit():
+            condition |= Q(pk=int(term))
+        if not condition:
+            return queryset.none(), False
+        return queryset.filter(condition), False
 
 
 @admin.register(Member)
-class MemberAdmin(admin.ModelAdmin):
+class MemberAdmin(KeysetAdmin):
     list_display = ("id", "nickname", "created_at", "updated_at")
-    search_fields = ("nickname",)
-    ordering = ("-created_at",)
+    prefix_search_fields = ("nickname",)
+    search_help_text = "Start of a nickname (case-sensitive), or a member id."
 
 
 @admin.register(AuthToken)
-class AuthTokenAdmin(admin.ModelAdmin):
-    list_display = ("key", "member", "created_at")
-    search_fields = ("key", "member__nickname")
-    ordering = ("-created_at",)
+class AuthTokenAdmin(KeysetAdmin):
+    list_display = ("key", "member", "created_at", "expires_at")
+    list_select_related = ("member",)
+    raw_id_fields = ("member",)
+    prefix_search_fields = ("key", "member__nickname")
+    search_help_text = "Start of a token key or of its member's nickname."
+
+
+@admin.register(ChatRoom)
+class ChatRoomAdmin(KeysetAdmin):
+    list_display = ("id", "name", "last_seq", "created_at")
+    prefix_search_fields = ("name",)
+    search_help_text = "Start of a room name (case-sensitive), or a room id."
+
+    def has_delete_permission(self, request, obj=None):
+        # The confirmation page would load and list every message in the room.
+        return False
+
+
+@admin.register(Message)
+class MessageAdmin(KeysetAdmin):
+    list_display = ("id", "room", "author", "__str__", "created_at")
+    list_select_related = ("author", "room")
+    list_filter = ("room",)
+    raw_id_fields = ("author", "room")
+    search_help_text = (
+        "Whole words of the text, among the newest matches before the page, "
+        "or a message id."
+    )
+
+    def get_search_fields(self, request):
+        return ("text",)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        terms = query_terms(term)
+        if not terms:
+            return queryset, False
+        # Like the API search, take only the newest matches below the page's
+        # cursor, which FTS5 finds walking its index backwards; all matches
+        # of a common word would be most of the table.
+        try:
+            before_id = int(request.GET.get("id__lt", ""))
+        except ValueError:
+            before_id = MAX_ID
+        matches = RawSQL(
+            "SELECT rowid FROM api_message_fts"
+            " WHERE api_message_fts MATCH %s AND rowid < %s"
+            " ORDER BY rowid DESC LIMIT %s",
+            [match_expression(terms), before_id, settings.CHAT_SEARCH_MAX_CANDIDATES],
+        )
+        return queryset.filter(pk__in=matches), False
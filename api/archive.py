@@ -0,0 +1,173 @@
+"""Cold storage for old chat messages.
+
+``archive_messages`` moves each room's oldest messages into append-only,
+gzip-compressed JSON-lines segment files under ``CHAT_ARCHIVE_ROOT``,
+partitioned as ``room_<id>/<year>-<month>/<first id>-<last id>.jsonl.gz``, and
+records every file as a ``MessageArchiveSegment``. Segments always cover a
+prefix of a room's messages by id, so a room's history is the archive up to
+its boundary followed by the ``Message`` rows above it.
+
+The history endpoint reads segments through ``archived_messages`` when a
+cursor goes below the boundary. Every worker keeps the segment index in memory
+and reloads it (one query) only after the shared generation counter moves.
+"""
+
+import gzip
+import json
+import os
+import threading
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+
+from .fastpath import format_datetime
+from .models import Member, MessageArchiveSegment
+from .shm import SharedCounter
+
+# Fields stored per message. Authors are stored by id and their current
+# nickname is looked up on read, like for messages still in the table.
+SEGMENT_FIELDS = ("id", "author_id", "text", "created_at")
+
+
+def segment_path(room_id, first, last):
+    """Relative path of the segment holding ``first``..``last`` (message dicts)."""
+    month = first["created_at"].strftime("%Y-%m")
+    return f"room_{room_id}/{month}/{first['id']}-{last['id']}.jsonl.gz"
+
+
+def write_segment(room_id, rows):
+    """Write ``rows`` (values() dicts, ascending ids) to a new segment file.
+
+    The file is written under a temporary name, flushed to disk and then
+    renamed, so a reader never sees a partial segment. Returns the path
+    relative to ``CHAT_ARCHIVE_ROOT``.
+    """
+    path = segment_path(room_id, rows[0], rows[-1])
+    target = settings.CHAT_ARCHIVE_ROOT / path
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary = target.with_name(target.name + ".tmp")
+    with open(temporary, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as stream:
+            for row in rows:
+                record = {
+                    **{field: row[field] for field in SEGMENT_FIELDS},
+                    "created_at": format_datetime(row["created_at"]),
+                }
+                stream.write(json.dumps(record, ensure_ascii=False).encode())
+                stream.write(b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temporary, target)
+    return path
+
+
+def read_segment(path):
+    return _read_segment(settings.CHAT_ARCHIVE_ROOT / path)
+
+
+@lru_cache(maxsize=16)
+def _read_segment(filename):
+    # Segments are never rewritten, so their parsed rows can be cached.
+    with gzip.open(filename, "rb") as stream:
+        return tuple(json.loads(line) for line in stream)
+
+
+class ArchiveIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = SharedCounter("chat_archive_generation")
+        self._loaded_generation = None
+        self._segments = {}
+
+    def _current(self):
+        generation = self._generation.get()
+        with self._lock:
+            if generation == self._loaded_generation:
+                return self._segments
+        segments = {}
+        for room_id, first_id, last_id, path in MessageArchiveSegment.objects.order_by(
+            "room_id", "first_id"
+        ).values_list("room_id", "first_id", "last_id", "path"):
+            segments.setdefault(room_id, []).append((first_id, last_id, path))
+        with self._lock:
+            self._segments = segments
+            self._loaded_generation = generation
+        return segments
+
+    def segments(self, room_id):
+        """``(first_id, last_id, path)`` of the room's segments, oldest first."""
+        return self._current().get(room_id, [])
+
+    def boundary(self, room_id):
+        """Highest archived message id of the room (0 when nothing is archived)."""
+        segments = self.segments(room_id)
+        return segments[-1][1] if segments else 0
+
+    def invalidate(self):
+        """Make every worker reload the segment index."""
+        self._generation.incr()
+
+    def clear(self):
+        with self._lock:
+            self._segments = {}
+            self._loaded_generation = None
+
+
+archive_index = ArchiveIndex()
+
+
+def _records(room_id, low, high, newest):
+    segments = [
+        path
+        for first_id, last_id, path in archive_index.segments(room_id)
+        if last_id > low and first_id < high
+    ]
+    for path in reversed(segments) if newest else segments:
+        records = read_segment(path)
+        for record in reversed(records) if newest else records:
+            if low < record["id"] < high:
+                yield record
+
+
+def archived_messages(room_id, after_id=None, before_id=None, limit=50, newest=False):
+    """Archived messages of a room with ``after_id < id < before_id``.
+
+    Returns up to ``limit`` messages in ascending id order, shaped like
+    ``MessageSerializer``: the oldest matching ones, or the newest with
+    ``newest=True``. Messages whose author has since been deleted are left
+    out, as the database cascade would have removed them.
+    """
+    records = _records(
+        room_id,
+        after_id if after_id is not None else 0,
+        before_id if before_id is not None else float("inf"),
+        newest,
+    )
+    messages = []
+    while len(messages) < limit:
+        rows = list(islice(records, limit - len(messages)))
+        if not rows:
+            break
+        nicknames = dict(
+            Member.objects.filter(
+                id__in={row["author_id"] for row in rows}
+            ).values_list("id", "nickname")
+        )
+        messages.extend(
+            {
+                "id": row["id"],
+                "text": row["text"],
+                "created_at": row["created_at"],
+                "author": {
+                    "id": row["author_id"],
+                    "nickname": nicknames[row["author_id"]],
+                },
+                "room_id": room_id,
+            }
+            for row in rows
+            if row["author_id"] in nicknames
+        )
+    if newest:
+        messages.reverse()
+    return messages
@@ -1,12 +1,175 @@
+import copy
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from .models import AuthToken
+from .shm import SharedCounter
+
+
+class TokenCache:
+    """Bounded LRU+TTL cache of token key -> (member, token) for one worker.
+
+    Entries are dropped by every worker as soon as the shared generation
+    counter moves, which ``invalidate()`` does whenever a token is deleted or
+    a member changes. The TTL bounds staleness for changes made behind the
+    application's back.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = SharedCounter("auth_token_generation")
+        self._seen_generation = None
+
+    @property
+    def generation(self):
+        return self._generation.get()
+
+    def get(self, key):
+        generation = self.generation
+        with self._lock:
+            if generation != self._seen_generation:
+                self._entries.clear()
+                self._seen_generation = generation
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        expires, member, token = entry
+        # Hand out copies so a request mutating its member cannot leak into
+        # other requests served from the same entry.
+        member = copy.copy(member)
+        token = copy.copy(token)
+        token.member = member
+        return member, token
+
+    def set(self, key, member, token, generation):
+        """Store an entry loaded while ``generation`` was current."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self._seen_generation:
+                return
+            self._entries[key] = (
+                time.monotonic() + self.ttl,
+                copy.copy(member),
+                copy.copy(token),
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop cached tokens in every worker process."""
+        self._generation.incr()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def token_expiry(created_at, last_used_at):
+    """When a token created and last used at these times expires, or None."""
+    limits = []
+    if settings.AUTH_TOKEN_TTL > 0:
+        limits.append(created_at + timedelta(seconds=settings.AUTH_TOKEN_TTL))
+    if settings.AUTH_TOKEN_IDLE_TTL > 0:
+        limits.append(last_used_at + timedelta(seconds=settings.AUTH_TOKEN_IDLE_TTL))
+    return min(limits) if limits else None
+
+
+def issue_token(member):
+    now = timezone.now()
+    return AuthToken.objects.create(
+        member=member,
+        key=secrets.token_hex(20),
+        last_used_at=now,
+        expires_at=token_expiry(now, now),
+    )
+
+
+def usable_tokens(member):
+    """The member's tokens that have not expired yet."""
+    return AuthToken.objects.filter(member=member).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+    )
+
+
+def login_token(member):
+    """The token a login hands out: the newest usable one, or a new one.
+
+    A token is only reused while its absolute TTL leaves it as long a life
+    without use as a new token would get, so a login never returns a token
+    that expires soon after.
+    """
+    tokens = usable_tokens(member)
+    if settings.AUTH_TOKEN_TTL > 0:
+        lifetime = settings.AUTH_TOKEN_TTL
+        if settings.AUTH_TOKEN_IDLE_TTL > 0:
+            lifetime = min(lifetime, settings.AUTH_TOKEN_IDLE_TTL)
+        oldest = timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_TTL - lifetime)
+        tokens = tokens.filter(created_at__gte=oldest)
+    token = tokens.order_by("-created_at").first()
+    if token is None:
+        return issue_token(member)
+    touch_token(token)
+    return token
+
+
+def touch_token(token, now=None):
+    """Record use of ``token`` and slide its expiry, at most once per interval.
+
+    Returns whether the row was written.
+    """
+    now = now or timezone.now()
+    interval = timedelta(seconds=settings.AUTH_TOKEN_TOUCH_INTERVAL)
+    if now - token.last_used_at < interval:
+        return False
+    token.last_used_at = now
+    token.expires_at = token_expiry(token.created_at, now)
+    AuthToken.objects.filter(pk=token.pk).update(
+        last_used_at=token.last_used_at, expires_at=token.expires_at
+    )
+    return True
 
 
 class TokenAuthentication(BaseAuthentication):
     keyword = "Token"
 
     def authenticate(self, request):
+        # Sub-requests of /api/batch/ reuse what the batch authenticated.
+        credentials = getattr(request._request, "shared_credentials", None)
+        if credentials is not None:
+            request.member, request.auth_token = credentials
+            return credentials
         auth_header = request.headers.get("Authorization")
         if not auth_header:
             return None
@@ -14,11 +177,28 @@ class TokenAuthentication(BaseAuthentication):
         if len(parts) != 2 or parts[0] != self.keyword:
             raise AuthenticationFailed('Invalid Authorization header. Expected value "Token <key>".')
         key = parts[1]
-        try:
-            token = AuthToken.objects.select_related("member").get(key=key)
-        except AuthToken.DoesNotExist:
-            raise AuthenticationFailed("Invalid token.")
-        member = token.member
+        member, token = self.authenticate_credentials(key)
         request.member = member
         request.auth_token = token
         return member, token
+
+    def authenticate_credentials(self, key):
+        generation = token_cache.generation
+        cached = token_cache.get(key)
+        if cached is not None:
+            member, token = cached
+        else:
+            try:
+                token = AuthToken.objects.select_related("member").get(key=key)
+            except AuthToken.DoesNotExist:
+                raise AuthenticationFailed("Invalid token.")
+            member = token.member
+            token_cache.set(key, member, token, generation)
+        now = timezone.now()
+        if token.expires_at is not None and token.expires_at <= now:
+            raise AuthenticationFailed("Token has expired.")
+        if touch_token(token, now):
+            # Keep the cached copy current so the next request does not
+            # write again.
+            token_cache.set(key, member, token, generation)
+        return member, token
@@ -0,0 +1,167 @@
+"""In-process dispatch of the sub-requests of ``/api/batch/``.
+
+A client starting up asks for several resources at once; each extra round
+trip through nginx and gunicorn costs far more than the view it reaches.
+``dispatch`` runs every sub-request through the view its path resolves to,
+in order, inside the batch's own request:
+
+* The batch authenticates once. Sub-requests carry its ``(member, token)``
+  as ``shared_credentials``, which ``TokenAuthentication`` returns as is, so
+  they neither look the token up again nor re-check its expiry. Once a
+  sub-request deletes the token (logout), the ones after it authenticate
+  from the batch's headers again, and are refused like standalone requests.
+* Sub-requests may only set the headers in ``SUB_REQUEST_HEADERS``; the
+  rest, including the client address the IP throttles count, is the
+  batch's own.
+* Only the view runs, not the middleware: the batch is measured, budgeted
+  and recorded as one request, and each sub-request is also recorded under
+  its own view in ``api.metrics``.
+* Safe sub-requests read from the replica, like standalone requests, until
+  a sub-request has written; later ones read their own writes from the
+  primary.
+"""
+
+import io
+import json
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .fastpath import render_json
+from .middleware import ReadReplicaMiddleware, query_budget
+from .routers import read_from_replica
+
+# The only headers a sub-request may send. Everything else, notably the
+# credentials and the client address headers the IP throttles key on, comes
+# from the batch request itself.
+SUB_REQUEST_HEADERS = frozenset(
+    ("accept", "if-none-match", "if-modified-since", "idempotency-key")
+)
+# Set per sub-request; the batch's own values for these do not apply.
+HEADERS_NOT_INHERITED = frozenset(
+    (
+        "CONTENT_TYPE",
+        "CONTENT_LENGTH",
+        *(f"HTTP_{name.upper().replace('-', '_')}" for name in SUB_REQUEST_HEADERS),
+    )
+)
+
+
+def _environ(request, entry):
+    path, _, query = entry["path"].partition("?")
+    environ = {
+        key: value
+        for key, value in request.META.items()
+        if key not in HEADERS_NOT_INHERITED
+    }
+    for name, value in entry.get("headers", {}).items():
+        environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+    body = b""
+    if "body" in entry:
+        body = json.dumps(entry["body"]).encode()
+        environ["CONTENT_TYPE"] = "application/json"
+    environ.update(
+        {
+            "REQUEST_METHOD": entry["method"],
+            "PATH_INFO": path,
+            "SCRIPT_NAME": "",
+            "QUERY_STRING": query,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        }
+    )
+    return environ
+
+
+def _resolve(path):
+    """The API view ``path`` resolves to, or None."""
+    path = path.partition("?")[0]
+    if not path.startswith(settings.API_PATH_PREFIX):
+        return None
+    try:
+        return resolve(path)
+    except Resolver404:
+        return None
+
+
+def _error(status, detail):
+    return _entry(status, b"{}", render_json({"detail": detail}))
+
+
+def _call(sub, match):
+    started = time.perf_counter()
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+    except Exception as exc:
+        response = response_for_exception(sub, exc)
+    if settings.METRICS_ENABLED:
+        metrics.record_request(sub, response, time.perf_counter() - started)
+    return response
+
+
+def _result(response):
+    """The JSON bytes of one entry of the batch's ``responses``."""
+    headers = {
+        name: value for name, value in response.items() if name != "Content-Length"
+    }
+    content = response.content
+    if not content:
+        body = b"null"
+    elif response.get("Content-Type", "").startswith("application/json"):
+        # Already JSON; embedded without parsing it again.
+        body = content
+    else:
+        body = render_json(content.decode(response.charset, "replace"))
+    return _entry(response.status_code, render_json(headers), body)
+
+
+def _entry(status, headers, body):
+    return b'{"status":%d,"headers":%s,"body":%s}' % (status, headers, body)
+
+
+def resolve_entries(entries):
+    """The API view match of each entry's path, or None."""
+    return [_resolve(entry["path"]) for entry in entries]
+
+
+def batch_query_budget(matches):
+    """The sum of the budgets of the views matched."""
+    return sum(query_budget(match.func) for match in matches if match is not None)
+
+
+def dispatch(request, entries, matches, credentials):
+    """Run ``entries`` in order; returns ``(content, wrote)``.
+
+    ``content`` is the batch's JSON response, ``{"responses": [...]}``, and
+    ``wrote`` whether any unsafe sub-request succeeded.
+    """
+    wrote = False
+    pinned = ReadReplicaMiddleware.cookie_name in request.COOKIES
+    results = []
+    for entry, match in zip(entries, matches):
+        if match is None:
+            results.append(_error(404, "Not found."))
+            continue
+        if match.url_name == "batch":
+            results.append(_error(400, "Batches cannot be nested."))
+            continue
+        sub = WSGIRequest(_environ(request, entry))
+        sub.resolver_match = match
+        sub.shared_credentials = credentials
+        safe = sub.method in ReadReplicaMiddleware.safe_methods
+        with read_from_replica() if safe and not (pinned or wrote) else nullcontext():
+            response = _call(sub, match)
+        if not safe and response.status_code < 400:
+            wrote = True
+        if credentials is not None and credentials[1].pk is None:
+            # Deleting a model instance clears its pk.
+            credentials = None
+        results.append(_result(response))
+    return b'{"responses":[' + b",".join(results) + b"]}", wrote
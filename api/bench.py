@@ -0,0 +1,185 @@
+"""Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run against throwaway test databases and a temporary shared-state
+directory, so they never touch the deployment's data, and print a JSON report
+that can be diffed across commits. Request throttling is off in them, since
+it would otherwise be what they measure.
+"""
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def scratch_environment():
+    """Run the body against fresh test databases and shared state."""
+    setup_test_environment()
+    old_config = setup_databases(
+        verbosity=0, interactive=False, aliases=set(connections)
+    )
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            with override_settings(
+                SHARED_STATE_DIR=state_dir, API_THROTTLE_ENABLED=False
+            ):
+                yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(durations):
+    """Latency summary, in milliseconds, of a list of durations in seconds."""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(total / len(ordered) * 1000, 4) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4) if ordered else 0.0,
+    }
+
+
+class Timer:
+    def __init__(self):
+        self.durations = []
+
+    @contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.append(time.perf_counter() - started)
+
+    def summary(self):
+        return summarize(self.durations)
+
+
+class QueryCounter:
+    """Count queries on every connection without keeping their SQL around."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def http_request(conn, method, path, token=None, body=None):
+    """Send one JSON request; returns the response and its body."""
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authorization"] = f"Token {token}"
+    conn.request(method, path, body=body and json.dumps(body), headers=headers)
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            response, _ = http_request(conn, "GET", "/api/hello/")
+            conn.close()
+            if response.status == 200:
+                return
+            error = RuntimeError(f"/api/hello/ answered {response.status}")
+        except OSError as exc:
+            error = exc
+        if time.monotonic() > deadline:
+            raise error
+        time.sleep(0.2)
+
+
+@contextmanager
+def gunicorn_server(env):
+    """Run gunicorn.conf.py on a free local port; yields the port."""
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            "gunicorn.conf.py",
+            "config.wsgi:application",
+        ],
+        cwd=settings.BASE_DIR,
+        env={**env, "GUNICORN_BIND": f"127.0.0.1:{port}"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(port)
+        yield port
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+@contextmanager
+def scratch_database_env():
+    """Environment for subprocesses using a fresh, migrated database file."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "config.settings",
+            "DJANGO_DB_NAME": os.path.join(tmp, "db.sqlite3"),
+            "DJANGO_SHARED_STATE_DIR": os.path.join(tmp, "run"),
+            "API_THROTTLE_ENABLED": "0",
+        }
+        subprocess.run(
+            [sys.executable, "manage.py", "migrate", "--noinput", "-v", "0"],
+            cwd=settings.BASE_DIR,
+            env=env,
+            check=True,
+        )
+        yield env
+
+
+def write_report(stdout, report):
+    stdout.write(json.dumps(report, indent=2, sort_keys=True))
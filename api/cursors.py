@@ -0,0 +1,198 @@
+"""Members' read cursors and unread counts.
+
+Every message carries its position in the room (``Message.seq``) and every
+room the position of its newest message (``ChatRoom.last_seq``), both kept by
+a database trigger. A cursor stores the position it points at, so an unread
+count is a subtraction and never a ``COUNT(*)`` over the message table.
+Deleted messages leave gaps in the numbering and stay counted as unread.
+
+Clients mark messages read as they scroll, which can mean several updates a
+second per member. Each worker keeps the newest cursor per (member, room) in
+memory, and a background thread upserts them every
+``CHAT_READ_CURSOR_FLUSH_INTERVAL`` seconds in one transaction, so a burst of
+updates costs a single row write. The upsert only ever moves a cursor forward,
+so workers may flush in any order. With an interval of 0 every update is
+written through.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .archive import archive_index
+from .models import ChatRoom, Message, ReadCursor
+
+logger = logging.getLogger("api.cursors")
+
+# Cursors of members or rooms deleted in the meantime are dropped instead of
+# failing the whole batch on a foreign key.
+UPSERT_SQL = """
+INSERT INTO api_readcursor (member_id, room_id, last_read_id, last_read_seq, updated_at)
+SELECT %s, %s, %s, %s, %s
+WHERE EXISTS (SELECT 1 FROM api_member WHERE id = %s)
+  AND EXISTS (SELECT 1 FROM api_chatroom WHERE id = %s)
+ON CONFLICT (member_id, room_id) DO UPDATE SET
+    last_read_id = excluded.last_read_id,
+    last_read_seq = excluded.last_read_seq,
+    updated_at = excluded.updated_at
+WHERE excluded.last_read_id > api_readcursor.last_read_id
+"""
+
+
+class ReadCursorBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher_pid = None
+        self.writes = 0
+
+    def advance(self, member_id, room_id, last_read_id, last_read_seq):
+        """Move a cursor forward; ignored if it already points further."""
+        cursor = {(member_id, room_id): (last_read_id, last_read_seq)}
+        if settings.CHAT_READ_CURSOR_FLUSH_INTERVAL <= 0:
+            self._write(cursor)
+            return
+        self._merge(cursor)
+        self._ensure_flusher()
+
+    def pending(self, member_id):
+        """Unwritten cursors of a member in this worker, by room id."""
+        with self._lock:
+            return {
+                room_id: position
+                for (owner_id, room_id), position in self._pending.items()
+                if owner_id == member_id
+            }
+
+    def flush(self):
+        with self._lock:
+            cursors, self._pending = self._pending, {}
+        if not cursors:
+            return
+        try:
+            self._write(cursors)
+        except Exception:
+            # Keep them for the next flush rather than losing the positions.
+            self._merge(cursors)
+            raise
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+    def _merge(self, cursors):
+        with self._lock:
+            for key, position in cursors.items():
+                current = self._pending.get(key)
+                if current is None or position[0] > current[0]:
+                    self._pending[key] = position
+
+    def _write(self, cursors):
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        rows = [
+            (member_id, room_id, last_read_id, last_read_seq, now, member_id, room_id)
+            for (member_id, room_id), (last_read_id, last_read_seq) in cursors.items()
+        ]
+        with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+            cursor.executemany(UPSERT_SQL, rows)
+        self.writes += 1
+
+    def _ensure_flusher(self):
+        # One thread per worker process; a forked child starts its own.
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(
+            target=self._run, name="read-cursor-flusher", daemon=True
+        ).start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(settings.CHAT_READ_CURSOR_FLUSH_INTERVAL, 0.1))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write read cursors")
+            finally:
+                close_old_connections()
+
+
+read_cursors = ReadCursorBuffer()
+
+
+def _latest(current, candidate):
+    if current is None or (candidate is not None and candidate[0] > current[0]):
+        return candidate
+    return current
+
+
+def mark_read(member_id, room, last_read_id):
+    """Move the member's cursor in ``room`` up to ``last_read_id``.
+
+    Returns the resulting ``(last_read_id, unread_count)``; a cursor never
+    moves backwards. The ``seq`` of the first message after the cursor gives
+    its position, which also works for ids of archived or deleted messages.
+    Costs one query, plus the upsert when cursors are written through.
+    """
+    messages = Message.objects.filter(room=OuterRef("pk"))
+    stored = ReadCursor.objects.filter(room=OuterRef("pk"), member_id=member_id)
+    row = (
+        ChatRoom.objects.filter(pk=room.pk)
+        .values_list(
+            "last_seq",
+            Subquery(
+                messages.filter(id__gt=last_read_id).order_by("id").values("seq")[:1]
+            ),
+            Subquery(messages.order_by("-id").values("id")[:1]),
+            Subquery(stored.values("last_read_id")),
+            Subquery(stored.values("last_read_seq")),
+        )
+        .first()
+    )
+    if row is None:
+        raise ChatRoom.DoesNotExist
+    last_seq, next_seq, latest_id, stored_id, stored_seq = row
+    if next_seq is not None:
+        position = (last_read_id, next_seq - 1)
+    else:
+        # Past the newest message: all read, but never ahead of the room.
+        newest = max(latest_id or 0, archive_index.boundary(room.pk))
+        position = (min(last_read_id, newest), last_seq)
+    current = _latest(
+        (stored_id, stored_seq) if stored_id is not None else None,
+        read_cursors.pending(member_id).get(room.pk),
+    )
+    if current is not None and current[0] >= position[0]:
+        position = current
+    else:
+        read_cursors.advance(member_id, room.pk, *position)
+    return position[0], max(last_seq - position[1], 0)
+
+
+def unread_counts(member_id):
+    """``(room_id, last_read_id, unread_count)`` for every room, in two queries."""
+    cursors = {
+        room_id: (last_read_id, last_read_seq)
+        for room_id, last_read_id, last_read_seq in ReadCursor.objects.filter(
+            member_id=member_id
+        ).values_list("room_id", "last_read_id", "last_read_seq")
+    }
+    for room_id, position in read_cursors.pending(member_id).items():
+        cursors[room_id] = _latest(cursors.get(room_id), position)
+    counts = []
+    for room_id, last_seq in ChatRoom.objects.order_by("id").values_list(
+        "id", "last_seq"
+    ):
+        last_read_id, last_read_seq = cursors.get(room_id, (0, 0))
+        counts.append((room_id, last_read_id, max(last_seq - last_read_seq, 0)))
+    return counts
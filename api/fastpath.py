@@ -0,0 +1,55 @@
+"""Read path for message lists that skips per-object DRF serialization.
+
+``message_rows`` fetches flat ``values()`` rows joined to the author in one
+query and shapes them exactly like ``MessageSerializer``; ``render_json``
+produces the same bytes as DRF's ``JSONRenderer`` for that data.
+"""
+
+import json
+
+from rest_framework.settings import api_settings
+
+MESSAGE_ROW_FIELDS = (
+    "id",
+    "text",
+    "created_at",
+    "author_id",
+    "author__nickname",
+    "room_id",
+)
+
+
+def format_datetime(value):
+    # Matches serializers.DateTimeField: UTC values end in "Z".
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def message_row(row):
+    return {
+        "id": row["id"],
+        "text": row["text"],
+        "created_at": format_datetime(row["created_at"]),
+        "author": {"id": row["author_id"], "nickname": row["author__nickname"]},
+        "room_id": row["room_id"],
+    }
+
+
+def message_rows(queryset):
+    """Serialize a ``Message`` queryset into the MessageSerializer shape."""
+    return [message_row(row) for row in queryset.values(*MESSAGE_ROW_FIELDS)]
+
+
+_encoder = json.JSONEncoder(
+    ensure_ascii=not api_settings.UNICODE_JSON,
+    allow_nan=not api_settings.STRICT_JSON,
+    separators=(",", ":") if api_settings.COMPACT_JSON else (", ", ": "),
+)
+
+
+def render_json(data):
+    """Encode plain JSON data the way ``JSONRenderer`` does."""
+    content = _encoder.encode(data)
+    return content.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
@@ -0,0 +1,129 @@
+"""Password hashing off the request workers.
+
+PBKDF2 is deliberately slow, so a burst of logins can occupy every request
+worker. Hashing here is limited in two ways:
+
+* a cap on hashing operations in flight (running or queued) across all
+  worker processes (``PASSWORD_HASHER_MAX_PENDING``). An operation counts
+  until it has finished, even after its request gave up. When it is reached,
+  requests fail fast with 503 and ``Retry-After`` instead of queueing behind
+  the hasher, so the remaining workers stay free for chat traffic;
+* the hashing itself runs in a small per-worker process pool
+  (``PASSWORD_HASHER_WORKERS``, 0 hashes inline). That keeps the CPU work out of
+  the request thread and its GIL.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .shm import SharedSlots
+
+
+class HasherBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many password operations in progress, retry shortly."
+    default_code = "hasher_busy"
+    wait = 1
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _verify_password(password, encoded):
+    """Return ``(valid, must_update)`` for ``password`` against ``encoded``."""
+    outdated = []
+    valid = hashers.check_password(password, encoded, setter=outdated.append)
+    return valid, bool(outdated)
+
+
+def _initialize_worker(settings_module):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+
+    django.setup()
+
+
+class PasswordHasherPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+
+    @property
+    def slots(self):
+        if self._slots is None:
+            self._slots = SharedSlots(
+                "password_hasher_slots", settings.PASSWORD_HASHER_MAX_PENDING
+            )
+        return self._slots
+
+    def _get_executor(self):
+        # Pools do not survive fork, so every gunicorn worker starts its own.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_initialize_worker,
+                    initargs=(
+                        os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings"),
+                    ),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def start(self):
+        """Spawn the pool's processes now rather than on the first hash."""
+        if settings.PASSWORD_HASHER_WORKERS > 0:
+            executor = self._get_executor()
+            for future in [
+                executor.submit(os.getpid)
+                for _ in range(settings.PASSWORD_HASHER_WORKERS)
+            ]:
+                future.result(timeout=settings.PASSWORD_HASHER_TIMEOUT)
+
+    def _run(self, func, *args):
+        slot = self.slots.acquire(stale_after=settings.PASSWORD_HASHER_TIMEOUT)
+        if slot is None:
+            raise HasherBusy()
+        if settings.PASSWORD_HASHER_WORKERS <= 0:
+            try:
+                return func(*args)
+            finally:
+                self.slots.release(slot)
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self.slots.release(slot)
+            raise
+        # A hash that outlives the timeout keeps running in the pool, so its
+        # slot is only freed once it is done (or cancelled before starting).
+        future.add_done_callback(lambda _: self.slots.release(slot))
+        try:
+            return future.result(timeout=settings.PASSWORD_HASHER_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusy()
+
+    def make_password(self, password):
+        return self._run(_make_password, password)
+
+    def verify_password(self, password, encoded):
+        """Check ``password``; also report whether ``encoded`` needs rehashing."""
+        return self._run(_verify_password, password, encoded)
+
+    def in_use(self):
+        return self.slots.in_use()
+
+
+hasher_pool = PasswordHasherPool()
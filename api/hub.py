@@ -0,0 +1,144 @@
+"""In-process fan-out of new chat messages to WebSocket subscribers.
+
+Messages posted through this process are pushed straight from
+``ChatMessageListCreateView.post`` to the subscribers of their room. Messages
+posted through other worker processes are picked up by a bridge task that
+watches the shared latest-message-id counter and loads the new rows once per
+process, no matter how many sockets are connected.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .notify import message_notifier
+
+logger = logging.getLogger("api.hub")
+
+# Seconds the bridge waits after a failed load before it tries again.
+RETRY_DELAY = 1.0
+
+
+class Subscription:
+    def __init__(self, loop, queue_size, room_id=None):
+        self.loop = loop
+        self.room_id = room_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def put(self, data):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Slow consumer: drop it instead of buffering without bound.
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class ChatHub:
+    def __init__(self, recent_size=1024):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._recent = deque(maxlen=recent_size)
+        self._recent_ids = set()
+        self._bridges = {}
+
+    def subscribe(self, room_id=None):
+        """Register a subscriber for the running event loop.
+
+        With ``room_id`` only that room's messages are delivered.
+        """
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(
+            loop, settings.CHAT_WEBSOCKET_QUEUE_SIZE, room_id=room_id
+        )
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if loop not in self._bridges:
+                self._bridges[loop] = loop.create_task(self._bridge(loop))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            loop = subscription.loop
+            if not any(sub.loop is loop for sub in self._subscriptions):
+                bridge = self._bridges.pop(loop, None)
+                if bridge is not None:
+                    bridge.cancel()
+
+    def publish(self, message_data):
+        """Push a serialized message to every subscriber. Safe from any thread."""
+        with self._lock:
+            if not self._subscriptions or not self._remember(message_data["id"]):
+                return
+            subscriptions = [
+                subscription
+                for subscription in self._subscriptions
+                if subscription.room_id in (None, message_data["room_id"])
+            ]
+        if not subscriptions:
+            return
+        data = json.dumps(
+            {"type": "message", "message": message_data}, ensure_ascii=False
+        )
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, data)
+
+    def _remember(self, message_id):
+        if message_id in self._recent_ids:
+            return False
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_ids.discard(self._recent[0])
+        self._recent.append(message_id)
+        self._recent_ids.add(message_id)
+        return True
+
+    async def _bridge(self, loop):
+        cursor = await sync_to_async(message_notifier.latest_id)()
+        while True:
+            await asyncio.sleep(settings.CHAT_LONG_POLL_INTERVAL)
+            try:
+                cursor = await self._catch_up(cursor)
+            except Exception:
+                # The task must outlive a failed query; the messages after
+                # ``cursor`` are loaded again on the next attempt.
+                logger.exception("Could not load new messages for subscribers")
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _catch_up(self, cursor):
+        """Publish the messages after ``cursor``; returns the new cursor."""
+        latest_id = message_notifier.latest_id()
+        limit = settings.CHAT_HUB_LOAD_LIMIT
+        while cursor < latest_id:
+            messages = await sync_to_async(_load_messages)(cursor, latest_id, limit)
+            for message_data in messages:
+                self.publish(message_data)
+            cursor = messages[-1]["id"] if len(messages) == limit else latest_id
+        return cursor
+
+
+def _load_messages(after_id, up_to_id, limit):
+    from .models import Message
+    from .serializers import MessageSerializer
+
+    queryset = (
+        Message.objects.filter(id__gt=after_id, id__lte=up_to_id)
+        .select_related("author", "room")
+        .order_by("id")[:limit]
+    )
+    return MessageSerializer(queryset, many=True).data
+
+
+chat_hub = ChatHub()
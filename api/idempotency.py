@@ -0,0 +1,120 @@
+"""Idempotency keys for message posts.
+
+Clients that time out retry their post, and they time out when the server is
+slowest. A post sent with an ``Idempotency-Key`` header stores its response
+in ``IdempotencyKey`` in the same transaction as the message; a retry with
+the same key gets that response back and inserts nothing.
+
+* Posts without the header never touch the table. A first post adds one
+  SELECT on the unique (member, key) index and one INSERT in the
+  transaction that inserts the message. Both are plain SQL, since building
+  the ORM queries would cost more than running them.
+* Two retries that both miss race on the unique constraint. The loser's
+  transaction, message included, rolls back and it answers with the
+  winner's response.
+* These posts skip group commit, since the key row must commit together
+  with its message.
+* A key reused for a different request answers 422. Keys are forgotten
+  after ``CHAT_IDEMPOTENCY_KEY_TTL`` seconds.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+TABLE = IdempotencyKey._meta.db_table
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used for another request."
+    default_code = "idempotency_key_reused"
+
+
+def request_key(request):
+    """The request's idempotency key, or None if it sent none."""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise ValidationError({HEADER: [f"Must be 1 to {MAX_KEY_LENGTH} characters."]})
+    return key
+
+
+def request_hash(*parts):
+    """A short digest of what a request asks for."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _stored(member, key, cutoff):
+    """``(request_hash, status, body, expired)`` stored for ``key``, or None."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT request_hash, status, body, created_at <= %s FROM {TABLE}"
+            " WHERE member_id = %s AND key = %s",
+            [connection.ops.adapt_datetimefield_value(cutoff), member.pk, key],
+        )
+        return cursor.fetchone()
+
+
+def _store(member, key, digest, status_code, body, replace):
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        if replace:
+            cursor.execute(
+                f"DELETE FROM {TABLE} WHERE member_id = %s AND key = %s",
+                [member.pk, key],
+            )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (member_id, key, request_hash, status, body,"
+            " created_at) VALUES (%s, %s, %s, %s, %s, %s)",
+            [member.pk, key, digest, status_code, body.decode(), now],
+        )
+
+
+def _replay(row, digest):
+    stored_hash, status_code, body, _ = row
+    if stored_hash != digest:
+        raise IdempotencyKeyReused()
+    response = HttpResponse(body, status=status_code, content_type="application/json")
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def respond_once(member, key, digest, create):
+    """``(response, created)``: the stored response, or that of ``create``.
+
+    ``create`` runs in a transaction and returns ``(status, JSON bytes)``,
+    which are stored under ``key`` before the transaction commits.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CHAT_IDEMPOTENCY_KEY_TTL)
+    row = _stored(member, key, cutoff)
+    expired = row is not None and row[3]
+    if row is not None and not expired:
+        return _replay(row, digest), False
+    try:
+        with transaction.atomic():
+            status_code, body = create()
+            _store(member, key, digest, status_code, body, replace=expired)
+    except IntegrityError:
+        # A concurrent request with the same key committed first.
+        row = _stored(member, key, cutoff)
+        if row is None:
+            raise
+        return _replay(row, digest), False
+    response = HttpResponse(body, status=status_code, content_type="application/json")
+    return response, True
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class PeriodicCommand(BaseCommand):
+    """A command that does its work once, or every ``--interval`` seconds.
+
+    Subclasses implement ``run_once(options)``, which returns the line to
+    report. When repeating, the line is only written at verbosity 2 and up.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running, repeating every INTERVAL seconds (0 runs once).",
+        )
+
+    def run_once(self, options):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        while True:
+            report = self.run_once(options)
+            if options["verbosity"] > 1 or not options["interval"]:
+                self.stdout.write(report)
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+
+class BatchedDeleteCommand(PeriodicCommand):
+    """A ``PeriodicCommand`` that deletes rows in batches (``api.sweep``)."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.05,
+            help="Seconds to sleep between delete batches.",
+        )
+        super().add_arguments(parser)
@@ -0,0 +1,128 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.archive import write_segment
+from api.management.base import BatchedDeleteCommand
+from api.models import ChatRoom, Message, MessageArchiveSegment
+from api.notify import message_notifier
+from api.sweep import delete_in_batches
+
+# Pages handed back to the filesystem per write transaction.
+VACUUM_BATCH_PAGES = 1000
+
+
+class Command(BatchedDeleteCommand):
+    help = (
+        "Move messages older than the retention period into compressed segment "
+        "files, delete them from the database in small batches and give the "
+        "freed pages back with an incremental vacuum."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CHAT_MESSAGE_RETENTION_DAYS,
+            help="Archive messages older than this many days (0 archives nothing).",
+        )
+        parser.add_argument(
+            "--segment-size", type=int, default=settings.CHAT_ARCHIVE_SEGMENT_SIZE
+        )
+        super().add_arguments(parser)
+
+    def run_once(self, options):
+        archived = 0
+        if options["days"] > 0:
+            archived = self.archive(
+                timezone.now() - timedelta(days=options["days"]),
+                options["segment_size"],
+                options["batch_size"],
+                options["pause"],
+            )
+        return f"Archived {archived} messages."
+
+    def archive(self, cutoff, segment_size, batch_size, pause):
+        archived = 0
+        for room in ChatRoom.objects.order_by("id"):
+            boundary = (
+                room.archive_segments.aggregate(boundary=Max("last_id"))["boundary"]
+                or 0
+            )
+            # Rows a previous, interrupted run archived but did not delete.
+            self.delete(room, boundary, batch_size, pause)
+            while True:
+                rows = self.next_segment(room, boundary, cutoff, segment_size)
+                if not rows:
+                    break
+                path = write_segment(room.pk, rows)
+                MessageArchiveSegment.objects.create(
+                    room=room,
+                    first_id=rows[0]["id"],
+                    last_id=rows[-1]["id"],
+                    first_created_at=rows[0]["created_at"],
+                    last_created_at=rows[-1]["created_at"],
+                    message_count=len(rows),
+                    path=path,
+                )
+                # The segment's signal has moved readers over to the file
+                # before its rows disappear.
+                boundary = rows[-1]["id"]
+                archived += self.delete(room, boundary, batch_size, pause)
+        self.vacuum(pause)
+        return archived
+
+    def next_segment(self, room, boundary, cutoff, segment_size):
+        """The oldest unarchived messages of ``room`` that belong in one segment.
+
+        Stops at the first message newer than ``cutoff``, so archives stay a
+        prefix of the room's history, and at a month change, so each segment
+        falls in one month's directory.
+        """
+        rows = Message.objects.filter(room=room, id__gt=boundary).order_by("id")
+        segment = []
+        for row in rows.values("id", "author_id", "text", "created_at")[:segment_size]:
+            if row["created_at"] >= cutoff:
+                break
+            if segment and (row["created_at"].year, row["created_at"].month) != (
+                segment[0]["created_at"].year,
+                segment[0]["created_at"].month,
+            ):
+                break
+            segment.append(row)
+        return segment
+
+    def delete(self, room, boundary, batch_size, pause):
+        archived = Message.objects.filter(room=room, id__lte=boundary)
+        # Announces the deletion once per batch rather than once per row.
+        return delete_in_batches(
+            archived, batch_size, pause, after_batch=message_notifier.publish_revision
+        )
+
+    def vacuum(self, pause):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                # Freed pages are still reused for new rows; the file only
+                # shrinks once the database has been VACUUMed with
+                # auto_vacuum=INCREMENTAL.
+                return
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA freelist_count")
+                free = cursor.fetchone()[0]
+            if not free:
+                return
+            # execute() steps the pragma once, which frees one page, and
+            # fetchall() finishes the statement so COMMIT can go through. A
+            # transaction per batch avoids a commit per page while still
+            # letting request writes in between batches.
+            with transaction.atomic(), connection.cursor() as cursor:
+                for _ in range(min(free, VACUUM_BATCH_PAGES)):
+                    cursor.execute("PRAGMA incremental_vacuum(1)")
+                    cursor.fetchall()
+            time.sleep(pause)
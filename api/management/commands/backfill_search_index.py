@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from api.models import Message
+
+# Skips rows the triggers (or an earlier, interrupted run) already indexed, so
+# the command can be stopped and run again at any time.
+BACKFILL_SQL = """
+INSERT INTO api_message_fts (rowid, text)
+SELECT id, text FROM api_message
+WHERE id > %s AND id <= %s
+  AND NOT EXISTS (SELECT 1 FROM api_message_fts_docsize WHERE id = api_message.id)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Add messages that existed before the search index to it, in small "
+        "id-range batches so writers are not blocked for long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Message ids per batch."
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.05,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--optimize",
+            action="store_true",
+            help="Merge the index into one b-tree afterwards (one long write).",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        bounds = Message.objects.aggregate(first_id=Min("id"), last_id=Max("id"))
+        first_id, last_id = bounds["first_id"] or 1, bounds["last_id"] or 0
+        indexed = 0
+        for start in range(first_id - 1, last_id, options["batch_size"]):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    BACKFILL_SQL, [start, min(start + options["batch_size"], last_id)]
+                )
+                indexed += cursor.rowcount
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Indexed up to id {start + options['batch_size']}.")
+            time.sleep(options["pause"])
+        if options["optimize"]:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO api_message_fts (api_message_fts) VALUES ('optimize')"
+                )
+        self.stdout.write(
+            f"Indexed {indexed} messages in {time.perf_counter() - started:.1f}s."
+        )
@@ -0,0 +1,258 @@
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from api.bench import (
+    Timer,
+    gunicorn_server,
+    http_request,
+    scratch_database_env,
+    scratch_environment,
+    write_report,
+)
+
+
+def _register(member, password):
+    body = {"nickname": f"bench-{uuid.uuid4().hex[:16]}", "password": password}
+    return "POST", "/api/auth/register/", None, body
+
+
+def _login(member, password):
+    body = {"nickname": member["nickname"], "password": password}
+    return "POST", "/api/auth/login/", None, body
+
+
+def _me(member, password):
+    return "GET", "/api/auth/me/", member["token"], None
+
+
+def _profile(member, password):
+    return "GET", "/api/profile/", member["token"], None
+
+
+def _chat_list(member, password):
+    # The newest page, as a client opening the chat would fetch it.
+    path = "/api/chat/messages/?before_id=2147483647&limit=50"
+    return "GET", path, member["token"], None
+
+
+def _chat_post(member, password):
+    return "POST", "/api/chat/messages/", member["token"], {"text": "benchmark"}
+
+
+# Endpoint name -> function returning (method, path, token, body).
+ENDPOINTS = {
+    "register": _register,
+    "login": _login,
+    "me": _me,
+    "profile": _profile,
+    "chat_list": _chat_list,
+    "chat_post": _chat_post,
+}
+
+
+class InProcessClient:
+    """Requests through the Django test client, in this process.
+
+    The test database is in memory with a shared cache, where concurrent
+    writers fail with "table is locked" (counted as 500s) instead of waiting;
+    measure concurrent writes with the gunicorn target.
+    """
+
+    def __init__(self):
+        self.client = APIClient(raise_request_exception=False)
+
+    def request(self, method, path, token, body):
+        extra = {"HTTP_AUTHORIZATION": f"Token {token}"} if token else {}
+        response = getattr(self.client, method.lower())(
+            path, body, format="json", **extra
+        )
+        return response.status_code, response.headers.get("X-SQL-Queries")
+
+    def close(self):
+        connection.close()
+
+
+class HTTPClient:
+    """Requests over a keep-alive connection to a local gunicorn."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def request(self, method, path, token, body):
+        try:
+            response, _ = http_request(self.conn, method, path, token, body)
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            raise
+        return response.status, response.getheader("X-SQL-Queries")
+
+    def close(self):
+        self.conn.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark each API endpoint at several concurrency levels, in process "
+        "through the test client or over HTTP against a local gunicorn, on "
+        "bulk-seeded data. Prints latency percentiles, throughput and SQL "
+        "query counts as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target", choices=["inprocess", "gunicorn"], default="inprocess"
+        )
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+        parser.add_argument(
+            "--seconds", type=float, default=5.0, help="Per endpoint and level."
+        )
+        parser.add_argument("--members", type=int, default=200)
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument(
+            "--endpoint",
+            action="append",
+            choices=list(ENDPOINTS),
+            help="Endpoint to run; repeat for several (default: all).",
+        )
+
+    def handle(self, *args, **options):
+        report = {
+            "target": options["target"],
+            "seconds": options["seconds"],
+            "members": options["members"],
+            "messages": options["messages"],
+            "cpu_count": len(os.sched_getaffinity(0)),
+            "commit": self._commit(),
+        }
+        if options["target"] == "gunicorn":
+            report["endpoints"] = self._gunicorn(options)
+        else:
+            report["endpoints"] = self._inprocess(options)
+        write_report(self.stdout, report)
+
+    def _commit(self):
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        return result.stdout.strip() or None
+
+    def _seed_arguments(self, options, tokens_file):
+        return {
+            "members": options["members"],
+            "messages": options["messages"],
+            "prefix": "bench",
+            "tokens_file": tokens_file,
+        }
+
+    def _inprocess(self, options):
+        with (
+            scratch_environment(),
+            override_settings(SQL_BUDGET_ENABLED=True, SQL_BUDGET_HEADERS=True),
+            tempfile.NamedTemporaryFile("r") as tokens_file,
+        ):
+            call_command(
+                "seed_data",
+                stdout=self.stderr,
+                **self._seed_arguments(options, tokens_file.name),
+            )
+            seed = json.load(tokens_file)
+            return self._run_all(seed, InProcessClient, options)
+
+    def _gunicorn(self, options):
+        with (
+            scratch_database_env() as env,
+            tempfile.NamedTemporaryFile("r") as tokens_file,
+        ):
+            arguments = self._seed_arguments(options, tokens_file.name)
+            subprocess.run(
+                [sys.executable, "manage.py", "seed_data"]
+                + [
+                    f"--{name.replace('_', '-')}={value}"
+                    for name, value in arguments.items()
+                ],
+                cwd=settings.BASE_DIR,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            seed = json.load(tokens_file)
+            with gunicorn_server({**env, "SQL_BUDGET_HEADERS": "1"}) as port:
+                return self._run_all(seed, lambda: HTTPClient(port), options)
+
+    def _run_all(self, seed, make_client, options):
+        results = {}
+        for name in options["endpoint"] or list(ENDPOINTS):
+            results[name] = {
+                str(level): self._run(
+                    ENDPOINTS[name], level, seed, make_client, options
+                )
+                for level in options["concurrency"]
+            }
+        return results
+
+    def _run(self, endpoint, level, seed, make_client, options):
+        deadline = time.perf_counter() + options["seconds"]
+        timer = Timer()
+        statuses = {}
+        queries = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(index)
+            client = make_client()
+            try:
+                while time.perf_counter() < deadline:
+                    member = rng.choice(seed["members"])
+                    request = endpoint(member, seed["password"])
+                    try:
+                        with timer.measure():
+                            status, count = client.request(*request)
+                    except (OSError, http.client.HTTPException) as exc:
+                        client = make_client()
+                        with lock:
+                            errors.append(type(exc).__name__)
+                        continue
+                    with lock:
+                        statuses[status] = statuses.get(status, 0) + 1
+                        if count is not None:
+                            queries.append(int(count))
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(level)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            "requests_per_second": round(len(timer.durations) / options["seconds"], 2),
+            "latency": timer.summary(),
+            "statuses": {
+                str(status): count for status, count in sorted(statuses.items())
+            },
+            "errors": len(errors),
+            "queries": {
+                "mean": round(sum(queries) / len(queries), 2) if queries else None,
+                "max": max(queries, default=None),
+            },
+        }
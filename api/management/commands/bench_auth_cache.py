@@ -0,0 +1,63 @@
+import secrets
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.bench import QueryCounter, Timer, scratch_environment, write_report
+from api.models import AuthToken, Member
+
+
+class Command(BaseCommand):
+    help = "Compare GET /api/auth/me/ with the token cache disabled and enabled."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--members", type=int, default=50)
+
+    def handle(self, *args, **options):
+        with scratch_environment():
+            keys = []
+            for index in range(options["members"]):
+                member = Member.objects.create(nickname=f"bench-{index}", password="!")
+                token = AuthToken.objects.create(
+                    member=member, key=secrets.token_hex(20)
+                )
+                keys.append(token.key)
+            report = {
+                "endpoint": "/api/auth/me/",
+                "requests": options["requests"],
+                "members": options["members"],
+            }
+            original_size = token_cache.max_size
+            try:
+                for label, size in (
+                    ("uncached", 0),
+                    ("cached", original_size or 10000),
+                ):
+                    token_cache.max_size = size
+                    token_cache.clear()
+                    report[label] = self._run(keys, options["requests"])
+            finally:
+                token_cache.max_size = original_size
+                token_cache.clear()
+        uncached = report["uncached"]["queries_per_request"]
+        cached = report["cached"]["queries_per_request"]
+        report["queries_saved_per_request"] = round(uncached - cached, 4)
+        write_report(self.stdout, report)
+
+    def _run(self, keys, requests):
+        client = APIClient()
+        timer = Timer()
+        with QueryCounter() as queries:
+            for index in range(requests):
+                key = keys[index % len(keys)]
+                with timer.measure():
+                    response = client.get(
+                        "/api/auth/me/", HTTP_AUTHORIZATION=f"Token {key}"
+                    )
+                assert response.status_code == 200, response.status_code
+        result = timer.summary()
+        result["queries_per_request"] = round(queries.count / requests, 4)
+        result.update(token_cache.stats())
+        return result
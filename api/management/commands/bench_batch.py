@@ -0,0 +1,131 @@
+import http.client
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.bench import (
+    Timer,
+    gunicorn_server,
+    http_request,
+    scratch_database_env,
+    write_report,
+)
+
+# What the client asks for on app open.
+BOOTSTRAP = ["/api/auth/me/", "/api/profile/", "/api/chat/messages/?limit=50"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure a client bootstrap through gunicorn as sequential requests "
+        "and as one /api/batch/ request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--clients", type=int, default=8)
+        parser.add_argument("--members", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=10_000)
+        parser.add_argument(
+            "--rtt-ms",
+            type=float,
+            default=0.0,
+            help="Network round trip added to every request, as a mobile "
+            "client would see it.",
+        )
+
+    def handle(self, *args, **options):
+        report = {
+            "seconds": options["seconds"],
+            "clients": options["clients"],
+            "rtt_ms": options["rtt_ms"],
+            "bootstrap": BOOTSTRAP,
+        }
+        with (
+            scratch_database_env() as env,
+            tempfile.NamedTemporaryFile("r") as tokens_file,
+        ):
+            subprocess.run(
+                [
+                    sys.executable,
+                    "manage.py",
+                    "seed_data",
+                    f"--members={options['members']}",
+                    f"--messages={options['messages']}",
+                    "--prefix=bench",
+                    f"--tokens-file={tokens_file.name}",
+                ],
+                cwd=settings.BASE_DIR,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            tokens = [member["token"] for member in json.load(tokens_file)["members"]]
+            with gunicorn_server(env) as port:
+                for label in ("sequential", "batch"):
+                    report[label] = self._run(port, tokens, label, options)
+        write_report(self.stdout, report)
+
+    def _run(self, port, tokens, label, options):
+        deadline = time.perf_counter() + options["seconds"]
+        rtt = options["rtt_ms"] / 1000
+        bootstraps = Timer()
+        lock = threading.Lock()
+        counts = {"requests": 0, "errors": 0}
+        batch = {"requests": [{"path": path} for path in BOOTSTRAP]}
+
+        def send(conn, method, path, token, body=None):
+            time.sleep(rtt)
+            response, payload = http_request(conn, method, path, token, body)
+            assert response.status == 200, response.status
+            return payload
+
+        def client(index):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            token = tokens[index % len(tokens)]
+            while time.perf_counter() < deadline:
+                try:
+                    with bootstraps.measure():
+                        if label == "batch":
+                            payload = send(conn, "POST", "/api/batch/", token, batch)
+                            statuses = [
+                                result["status"]
+                                for result in json.loads(payload)["responses"]
+                            ]
+                            assert statuses == [200] * len(BOOTSTRAP), statuses
+                            sent = 1
+                        else:
+                            for path in BOOTSTRAP:
+                                send(conn, "GET", path, token)
+                            sent = len(BOOTSTRAP)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    with lock:
+                        counts["errors"] += 1
+                    continue
+                with lock:
+                    counts["requests"] += sent
+            conn.close()
+
+        threads = [
+            threading.Thread(target=client, args=(index,))
+            for index in range(options["clients"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            "bootstraps_per_second": round(
+                len(bootstraps.durations) / options["seconds"], 2
+            ),
+            "bootstrap_latency": bootstraps.summary(),
+            "http_requests": counts["requests"],
+            "errors": counts["errors"],
+        }
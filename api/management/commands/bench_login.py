@@ -0,0 +1,120 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from api import serializers
+from api.bench import Timer, scratch_environment, write_report
+from api.hashing import PasswordHasherPool, hasher_pool
+from api.models import AuthToken, ChatRoom, Member, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login throughput and concurrent chat read latency with hashing "
+        "inline and unbounded versus offloaded behind the pending limit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--login-threads", type=int, default=4)
+        parser.add_argument("--chat-threads", type=int, default=1)
+
+    def handle(self, *args, **options):
+        with scratch_environment():
+            password = "bench-pass"
+            encoded = hasher_pool.make_password(password)
+            members = [
+                Member.objects.create(nickname=f"bench-{index}", password=encoded)
+                for index in range(options["login_threads"])
+            ]
+            reader = Member.objects.create(nickname="bench-reader", password="!")
+            token = AuthToken.objects.create(member=reader, key="b" * 40)
+            room, _ = ChatRoom.objects.get_or_create(name="Global chat")
+            Message.objects.bulk_create(
+                Message(room=room, author=reader, text=f"message {index}")
+                for index in range(50)
+            )
+            report = {
+                "seconds": options["seconds"],
+                "login_threads": options["login_threads"],
+                "chat_threads": options["chat_threads"],
+            }
+            scenarios = (
+                ("inline_unbounded", {"workers": 0, "max_pending": 1000}),
+                ("offloaded_limited", {"workers": 1, "max_pending": 2}),
+            )
+            for label, scenario in scenarios:
+                with override_settings(
+                    PASSWORD_HASHER_WORKERS=scenario["workers"],
+                    PASSWORD_HASHER_MAX_PENDING=scenario["max_pending"],
+                ):
+                    pool = PasswordHasherPool()
+                    with mock.patch.object(serializers, "hasher_pool", pool):
+                        if scenario["workers"]:
+                            # Start the pool before the clock does.
+                            pool.make_password(password)
+                        result = self._run(members, password, token.key, options)
+                result.update(scenario)
+                report[label] = result
+        write_report(self.stdout, report)
+
+    def _run(self, members, password, token_key, options):
+        deadline = time.perf_counter() + options["seconds"]
+        login_timer = Timer()
+        chat_timer = Timer()
+        outcomes = {"ok": 0, "rejected": 0}
+        lock = threading.Lock()
+
+        def log_in(member):
+            client = APIClient()
+            try:
+                while time.perf_counter() < deadline:
+                    with login_timer.measure():
+                        response = client.post(
+                            "/api/auth/login/",
+                            {"nickname": member.nickname, "password": password},
+                            format="json",
+                        )
+                    outcome = "ok" if response.status_code == 200 else "rejected"
+                    assert response.status_code in (200, 503), response.status_code
+                    with lock:
+                        outcomes[outcome] += 1
+                    if outcome == "rejected":
+                        # Back off briefly rather than the full Retry-After so
+                        # the limiter stays under pressure.
+                        time.sleep(0.1)
+            finally:
+                connection.close()
+
+        def read_chat():
+            client = APIClient()
+            try:
+                while time.perf_counter() < deadline:
+                    with chat_timer.measure():
+                        response = client.get(
+                            "/api/chat/messages/",
+                            HTTP_AUTHORIZATION=f"Token {token_key}",
+                        )
+                    assert response.status_code == 200, response.status_code
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=log_in, args=(m,)) for m in members]
+        threads += [
+            threading.Thread(target=read_chat) for _ in range(options["chat_threads"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            "logins_per_second": round(outcomes["ok"] / options["seconds"], 2),
+            "logins_rejected": outcomes["rejected"],
+            "login_latency": login_timer.summary(),
+            "chat_latency": chat_timer.summary(),
+        }
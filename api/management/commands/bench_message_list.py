@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.bench import QueryCounter, Timer, scratch_environment, write_report
+from api.fastpath import message_rows, render_json
+from api.models import ChatRoom, Member, Message
+from api.serializers import MessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare MessageSerializer + JSONRenderer with the values() fast path "
+        "for message pages of several sizes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 10000])
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--authors", type=int, default=100)
+
+    def handle(self, *args, **options):
+        sizes = options["sizes"]
+        with scratch_environment():
+            room = ChatRoom.objects.create(name="Global chat")
+            authors = Member.objects.bulk_create(
+                Member(nickname=f"bench-{index}", password="!")
+                for index in range(options["authors"])
+            )
+            Message.objects.bulk_create(
+                (
+                    Message(
+                        room=room,
+                        author=authors[index % len(authors)],
+                        text=f"message {index} — ünïcode",
+                    )
+                    for index in range(max(sizes))
+                ),
+                batch_size=1000,
+            )
+            report = {"repeat": options["repeat"], "sizes": {}}
+            for size in sizes:
+                queryset = Message.objects.filter(room=room).order_by("id")[:size]
+                drf = self._run(options["repeat"], lambda: self._drf(queryset))
+                fast = self._run(options["repeat"], lambda: self._fast(queryset))
+                report["sizes"][str(size)] = {
+                    "drf": drf,
+                    "fast": fast,
+                    "identical_output": self._drf(queryset) == self._fast(queryset),
+                    "speedup": round(drf["mean_ms"] / fast["mean_ms"], 2),
+                }
+        write_report(self.stdout, report)
+
+    def _drf(self, queryset):
+        return JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+
+    def _fast(self, queryset):
+        return render_json(message_rows(queryset))
+
+    def _run(self, repeat, func):
+        timer = Timer()
+        with QueryCounter() as queries:
+            for _ in range(repeat):
+                with timer.measure():
+                    func()
+        result = timer.summary()
+        result["queries_per_call"] = round(queries.count / repeat, 2)
+        return result
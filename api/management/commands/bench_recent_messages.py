@@ -0,0 +1,176 @@
+import http.client
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.bench import (
+    Timer,
+    gunicorn_server,
+    http_request,
+    scratch_database_env,
+    write_report,
+)
+from api.recent import RecentMessages
+
+SCENARIOS = {
+    "ring": {},
+    "database": {"CHAT_RECENT_MESSAGES": "0"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure polls after a recent cursor through gunicorn, with and without "
+        "the shared ring of recent messages, while other clients keep posting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--pollers", type=int, default=16)
+        parser.add_argument("--posters", type=int, default=2)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.05,
+            help="Seconds each poller sleeps between polls.",
+        )
+        parser.add_argument(
+            "--post-interval",
+            type=float,
+            default=0.02,
+            help="Seconds each poster sleeps between posts.",
+        )
+        parser.add_argument("--members", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=200_000)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="Scenario to run; repeat for several (default: all).",
+        )
+
+    def handle(self, *args, **options):
+        report = {
+            "seconds": options["seconds"],
+            "pollers": options["pollers"],
+            "posters": options["posters"],
+            "seeded_messages": options["messages"],
+        }
+        with (
+            scratch_database_env() as env,
+            tempfile.NamedTemporaryFile("r") as tokens_file,
+        ):
+            subprocess.run(
+                [
+                    sys.executable,
+                    "manage.py",
+                    "seed_data",
+                    f"--members={options['members']}",
+                    f"--messages={options['messages']}",
+                    "--prefix=bench",
+                    f"--tokens-file={tokens_file.name}",
+                ],
+                cwd=settings.BASE_DIR,
+                env=env,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            tokens = [member["token"] for member in json.load(tokens_file)["members"]]
+            for label in options["scenario"] or list(SCENARIOS):
+                scenario_env = {**env, "SQL_BUDGET_HEADERS": "1", **SCENARIOS[label]}
+                with gunicorn_server(scenario_env) as port:
+                    before = self._ring_stats(env, label)
+                    result = self._run(port, tokens, options)
+                    after = self._ring_stats(env, label)
+                if before is not None:
+                    hits, misses = (now - then for now, then in zip(after, before))
+                    result["ring_hits"] = hits
+                    result["ring_misses"] = misses
+                    result["hit_ratio"] = round(hits / ((hits + misses) or 1), 4)
+                report[label] = result
+        write_report(self.stdout, report)
+
+    def _ring_stats(self, env, label):
+        if "CHAT_RECENT_MESSAGES" in SCENARIOS[label]:
+            return None
+        with override_settings(SHARED_STATE_DIR=env["DJANGO_SHARED_STATE_DIR"]):
+            return RecentMessages().stats()
+
+    def _run(self, port, tokens, options):
+        deadline = time.perf_counter() + options["seconds"]
+        polls = Timer()
+        posts = Timer()
+        lock = threading.Lock()
+        counts = {"messages": 0, "queries": 0, "errors": 0}
+
+        def poster(index):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            token = tokens[index % len(tokens)]
+            while time.perf_counter() < deadline:
+                try:
+                    with posts.measure():
+                        response, _ = http_request(
+                            conn, "POST", "/api/chat/messages/", token, {"text": "hi"}
+                        )
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    with lock:
+                        counts["errors"] += 1
+                    continue
+                assert response.status == 201, response.status
+                time.sleep(options["post_interval"])
+            conn.close()
+
+        def poller(index):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            token = tokens[-1 - index % len(tokens)]
+            path = "/api/chat/messages/?before_id=2147483647&limit=1"
+            response, _ = http_request(conn, "GET", path, token)
+            cursor = response.headers["X-Next-Cursor"]
+            while time.perf_counter() < deadline:
+                path = f"/api/chat/messages/?after_id={cursor}&limit=50"
+                try:
+                    with polls.measure():
+                        response, payload = http_request(conn, "GET", path, token)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    with lock:
+                        counts["errors"] += 1
+                    continue
+                assert response.status == 200, response.status
+                cursor = response.headers["X-Next-Cursor"]
+                with lock:
+                    counts["messages"] += len(json.loads(payload))
+                    counts["queries"] += int(response.headers["X-SQL-Queries"])
+                time.sleep(options["poll_interval"])
+            conn.close()
+
+        threads = [
+            threading.Thread(target=poster, args=(index,))
+            for index in range(options["posters"])
+        ]
+        threads += [
+            threading.Thread(target=poller, args=(index,))
+            for index in range(options["pollers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            "polls_per_second": round(len(polls.durations) / options["seconds"], 2),
+            "poll_latency": polls.summary(),
+            "post_latency": posts.summary(),
+            "queries_per_poll": round(
+                counts["queries"] / (len(polls.durations) or 1), 3
+            ),
+            "messages_received": counts["messages"],
+            "errors": counts["errors"],
+        }
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.bench import summarize, write_report
+
+SCHEMA = """
+CREATE TABLE room (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX message_room_id ON message (room_id, id);
+INSERT INTO room (id, name) VALUES (1, 'Global chat');
+"""
+
+
+def _connect(path, profile):
+    # Mirrors what Django's sqlite backend does with DATABASES OPTIONS.
+    conn = sqlite3.connect(path, isolation_level=None, timeout=5.0)
+    for command in profile["init_command"].split(";"):
+        if command.strip():
+            conn.execute(command)
+    return conn
+
+
+def _wait_until(start_at):
+    time.sleep(max(0.0, start_at - time.monotonic()))
+
+
+def _writer(path, profile, start_at, deadline, results):
+    conn = _connect(path, profile)
+    _wait_until(start_at)
+    begin = f"BEGIN {profile['transaction_mode']}".strip()
+    durations, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            # Read-then-write in one transaction, like get_or_create + create.
+            conn.execute(begin)
+            conn.execute("SELECT id FROM room WHERE name = 'Global chat'").fetchone()
+            conn.execute(
+                "INSERT INTO message (room_id, author_id, text, created_at) "
+                "VALUES (1, 1, 'hello', datetime('now'))"
+            )
+            conn.execute("COMMIT")
+            durations.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    results.put(("write", durations, errors))
+
+
+def _reader(path, profile, start_at, deadline, results):
+    conn = _connect(path, profile)
+    _wait_until(start_at)
+    durations, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.execute(
+                "SELECT id, text FROM message WHERE room_id = 1 "
+                "ORDER BY id DESC LIMIT 50"
+            ).fetchall()
+            durations.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(("read", durations, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent reader and writer processes against a scratch SQLite "
+        "file with stock settings and with the configured tuning profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        db_options = settings.DATABASES["default"].get("OPTIONS", {})
+        profiles = {
+            "stock": {"init_command": "", "transaction_mode": ""},
+            "tuned": {
+                "init_command": db_options.get("init_command", ""),
+                "transaction_mode": db_options.get("transaction_mode") or "",
+            },
+        }
+        report = {
+            "writers": options["writers"],
+            "readers": options["readers"],
+            "seconds": options["seconds"],
+            "profiles": {},
+        }
+        for name, profile in profiles.items():
+            report["profiles"][name] = self._run(profile, options)
+        write_report(self.stdout, report)
+
+    def _run(self, profile, options):
+        context = multiprocessing.get_context("spawn")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.sqlite3")
+            setup = _connect(path, profile)
+            setup.executescript(SCHEMA)
+            setup.close()
+            results = context.Queue()
+            # Give spawned processes time to start so all of them run for the
+            # same measured window.
+            start_at = time.monotonic() + 2.0
+            deadline = start_at + options["seconds"]
+            processes = [
+                context.Process(
+                    target=_writer, args=(path, profile, start_at, deadline, results)
+                )
+                for _ in range(options["writers"])
+            ] + [
+                context.Process(
+                    target=_reader, args=(path, profile, start_at, deadline, results)
+                )
+                for _ in range(options["readers"])
+            ]
+            for process in processes:
+                process.start()
+            collected = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+        result = {}
+        for kind in ("write", "read"):
+            durations = [d for k, ds, _ in collected if k == kind for d in ds]
+            errors = sum(e for k, _, e in collected if k == kind)
+            summary = summarize(durations)
+            summary["ops_per_second"] = round(len(durations) / options["seconds"], 1)
+            summary["lock_errors"] = errors
+            result[kind] = summary
+        return result
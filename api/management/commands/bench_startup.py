@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.bench import summarize, write_report
+
+# Runs in a fresh interpreter per sample: boot the WSGI application, then time
+# the first and subsequent requests through the full middleware stack.
+CHILD = """
+import json, os, sys, time
+from wsgiref.util import setup_testing_defaults
+
+# CPU time: boot is dominated by imports, and wall time on a shared box is noisy.
+started = time.process_time()
+from config.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+booted = time.process_time()
+
+def call(path):
+    environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET"}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers: statuses.append(status))
+    b"".join(body)
+    body.close()
+    return statuses[0]
+
+first = time.perf_counter()
+assert call("/api/hello/").startswith("200")
+first = time.perf_counter() - first
+timings = {}
+for path in ("/api/hello/", "/admin/login/"):
+    assert call(path).startswith("200"), path
+    durations = []
+    for _ in range(int(sys.argv[1])):
+        t = time.perf_counter()
+        call(path)
+        durations.append(time.perf_counter() - t)
+    timings[path] = durations
+print(json.dumps({"boot": booted - started, "first_request": first, "requests": timings}))
+"""
+
+SCENARIOS = {
+    "before": {"DJANGO_API_LEAN_MIDDLEWARE": "0"},
+    "lean": {"DJANGO_API_LEAN_MIDDLEWARE": "1"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker boot time and per-request middleware overhead with and "
+        "without the lean API profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=7)
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        samples = {label: [] for label in SCENARIOS}
+        # Interleave the scenarios so drift in machine load hits all of them.
+        for _ in range(options["runs"]):
+            for label, overrides in SCENARIOS.items():
+                output = subprocess.run(
+                    [sys.executable, "-c", CHILD, str(options["requests"])],
+                    cwd=settings.BASE_DIR,
+                    env={
+                        **os.environ,
+                        "DJANGO_SETTINGS_MODULE": "config.settings",
+                        **overrides,
+                    },
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                samples[label].append(json.loads(output))
+        report = {"runs": options["runs"], "requests": options["requests"]}
+        for label, runs in samples.items():
+            requests = {}
+            for sample in runs:
+                for path, durations in sample["requests"].items():
+                    requests.setdefault(path, []).extend(durations)
+            report[label] = {
+                "environment": SCENARIOS[label],
+                "boot_cpu": summarize([sample["boot"] for sample in runs]),
+                "first_request": summarize(
+                    [sample["first_request"] for sample in runs]
+                ),
+                "requests": {
+                    path: summarize(durations) for path, durations in requests.items()
+                },
+            }
+        write_report(self.stdout, report)
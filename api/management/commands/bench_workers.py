@@ -0,0 +1,168 @@
+import http.client
+import json
+import os
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.bench import (
+    Timer,
+    gunicorn_server,
+    http_request,
+    scratch_database_env,
+    summarize,
+    write_report,
+)
+
+SCENARIOS = {
+    # The previous deployment: two sync workers.
+    "sync_2": {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_WORKERS": "2"},
+    "sync_auto": {"GUNICORN_WORKER_CLASS": "sync"},
+    "gthread_auto": {"GUNICORN_WORKER_CLASS": "gthread"},
+}
+
+# (weight, method, path) of the mixed client workload.
+WORKLOAD = [
+    (60, "GET", "/api/chat/messages/?limit=50"),
+    (20, "GET", "/api/auth/me/"),
+    (10, "GET", "/api/profile/"),
+    (10, "POST", "/api/chat/messages/"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the real endpoints through gunicorn with each worker model "
+        "while a few clients hold long-polls open."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--clients", type=int, default=16)
+        parser.add_argument("--long-polls", type=int, default=2)
+        parser.add_argument("--members", type=int, default=4)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="Scenario to run; repeat for several (default: all).",
+        )
+
+    def handle(self, *args, **options):
+        scenarios = options["scenario"] or list(SCENARIOS)
+        report = {
+            "seconds": options["seconds"],
+            "clients": options["clients"],
+            "long_polls": options["long_polls"],
+            "cpu_count": len(os.sched_getaffinity(0)),
+        }
+        with scratch_database_env() as env:
+            tokens = None
+            for label in scenarios:
+                with gunicorn_server({**env, **SCENARIOS[label]}) as port:
+                    if tokens is None:
+                        tokens = self._seed(port, options["members"])
+                    result = self._run(port, tokens, options)
+                result["environment"] = SCENARIOS[label]
+                report[label] = result
+        write_report(self.stdout, report)
+
+    def _request(self, conn, method, path, token=None, body=None):
+        response, payload = http_request(conn, method, path, token, body)
+        return response.status, payload
+
+    def _seed(self, port, members):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        tokens = []
+        for index in range(members):
+            body = {"nickname": f"bench-{index}", "password": "bench-pass-123"}
+            while True:
+                status, payload = self._request(
+                    conn, "POST", "/api/auth/register/", body=body
+                )
+                if status != 503:
+                    break
+                time.sleep(1)
+            assert status == 201, (status, payload)
+            tokens.append(json.loads(payload)["token"])
+        for index in range(200):
+            status, _ = self._request(
+                conn,
+                "POST",
+                "/api/chat/messages/",
+                token=tokens[index % len(tokens)],
+                body={"text": f"seed message {index}"},
+            )
+            assert status == 201, status
+        conn.close()
+        return tokens
+
+    def _run(self, port, tokens, options):
+        deadline = time.perf_counter() + options["seconds"]
+        timers = {f"{method} {path}": Timer() for _, method, path in WORKLOAD}
+        statuses = {}
+        errors = []
+        long_polls = []
+        lock = threading.Lock()
+        weights = [weight for weight, _, _ in WORKLOAD]
+
+        def client(index):
+            rng = random.Random(index)
+            token = tokens[index % len(tokens)]
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            while time.perf_counter() < deadline:
+                _, method, path = rng.choices(WORKLOAD, weights)[0]
+                body = {"text": "load"} if method == "POST" else None
+                try:
+                    with timers[f"{method} {path}"].measure():
+                        status, _ = self._request(conn, method, path, token, body)
+                except (OSError, http.client.HTTPException) as exc:
+                    conn.close()
+                    with lock:
+                        errors.append(type(exc).__name__)
+                    continue
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+            conn.close()
+
+        def long_poll(index):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            path = "/api/chat/messages/?after_id=1000000000&wait=5"
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    self._request(conn, "GET", path, tokens[index % len(tokens)])
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    continue
+                with lock:
+                    long_polls.append(time.perf_counter() - started)
+            conn.close()
+
+        threads = [
+            threading.Thread(target=long_poll, args=(index,))
+            for index in range(options["long_polls"])
+        ]
+        threads += [
+            threading.Thread(target=client, args=(index,))
+            for index in range(options["clients"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        durations = [d for timer in timers.values() for d in timer.durations]
+        return {
+            "requests_per_second": round(len(durations) / options["seconds"], 2),
+            "latency": summarize(durations),
+            "latency_by_request": {
+                name: timer.summary() for name, timer in timers.items()
+            },
+            "statuses": {
+                str(status): count for status, count in sorted(statuses.items())
+            },
+            "errors": len(errors),
+            "long_polls_completed": len(long_polls),
+        }
@@ -0,0 +1,29 @@
+from django.db import connection
+
+from api.management.base import PeriodicCommand
+
+
+class Command(PeriodicCommand):
+    help = (
+        "Copy the SQLite write-ahead log back into the database file. Run "
+        "continuously, it keeps checkpoints out of request transactions: "
+        "SQLITE_WAL_AUTOCHECKPOINT is set high enough that the commit which "
+        "crosses it (and pays for the checkpoint) is only a fallback."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=["PASSIVE", "FULL", "RESTART", "TRUNCATE"],
+            default="PASSIVE",
+            help="PASSIVE never waits for readers or writers.",
+        )
+        super().add_arguments(parser)
+
+    def run_once(self, options):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA wal_checkpoint({options['mode']})")
+            busy, logged, copied = cursor.fetchone()
+        return f"Checkpointed {copied} of {logged} WAL frames" + (
+            " (busy)." if busy else "."
+        )
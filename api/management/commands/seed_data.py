@@ -0,0 +1,153 @@
+import json
+import random
+import secrets
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.authentication import token_expiry
+from api.hashing import hasher_pool
+from api.models import AuthToken, ChatRoom, Member, Message
+from api.notify import message_notifier
+from api.rooms import GLOBAL_ROOM_NAME
+
+WORDS = (
+    "hello hi hey thanks sure maybe tomorrow today lunch meeting deploy bug fix "
+    "review merge coffee weekend later soon great nice cool ok yes no why how "
+    "what when where who link docs test build release server client chat room"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load members with tokens and messages spread over the past days, "
+        "for benchmarks and capacity tests. Every member gets the same password."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument(
+            "--rooms",
+            type=int,
+            default=0,
+            help="Rooms to create besides the global room.",
+        )
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=30,
+            help="Spread message timestamps over this many past days.",
+        )
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--password", default="seed-pass-123")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument(
+            "--tokens-file",
+            help="Write the members' nicknames and token keys here as JSON.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rng = random.Random(options["random_seed"])
+        prefix = options["prefix"]
+        members = self.seed_members(
+            prefix, options["members"], options["password"], options["batch_size"]
+        )
+        tokens = self.seed_tokens(members, options["batch_size"])
+        rooms = [ChatRoom.objects.get_or_create(name=GLOBAL_ROOM_NAME)[0]]
+        rooms += [
+            ChatRoom.objects.get_or_create(name=f"{prefix}-room-{index}")[0]
+            for index in range(options["rooms"])
+        ]
+        messages = self.seed_messages(
+            rng,
+            rooms,
+            members,
+            options["messages"],
+            timedelta(days=options["days"]),
+            options["batch_size"],
+        )
+        if options["tokens_file"]:
+            with open(options["tokens_file"], "w") as stream:
+                json.dump(
+                    {
+                        "password": options["password"],
+                        "rooms": [room.pk for room in rooms],
+                        "members": [
+                            {"nickname": member.nickname, "token": tokens[member.pk]}
+                            for member in members
+                        ],
+                    },
+                    stream,
+                )
+        self.stdout.write(
+            f"Seeded {len(members)} members, {len(tokens)} tokens and {messages} "
+            f"messages in {time.perf_counter() - started:.1f}s."
+        )
+
+    def seed_members(self, prefix, count, password, batch_size):
+        # One hash shared by every member: hashing is deliberately slow.
+        encoded = hasher_pool.make_password(password)
+        Member.objects.bulk_create(
+            (
+                Member(nickname=f"{prefix}-{index}", password=encoded)
+                for index in range(count)
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        return list(
+            Member.objects.filter(nickname__startswith=f"{prefix}-").order_by("id")
+        )
+
+    def seed_tokens(self, members, batch_size):
+        now = timezone.now()
+        tokens = {member.pk: secrets.token_hex(20) for member in members}
+        AuthToken.objects.bulk_create(
+            (
+                AuthToken(
+                    member=member,
+                    key=tokens[member.pk],
+                    last_used_at=now,
+                    expires_at=token_expiry(now, now),
+                )
+                for member in members
+            ),
+            batch_size=batch_size,
+        )
+        return tokens
+
+    def seed_messages(self, rng, rooms, members, count, period, batch_size):
+        if not count or not members:
+            return 0
+        start = timezone.now() - period
+        batches = (count + batch_size - 1) // batch_size
+        created = 0
+        latest = {}
+        for batch in range(batches):
+            size = min(batch_size, count - created)
+            with transaction.atomic():
+                rows = Message.objects.bulk_create(
+                    Message(
+                        room=rng.choice(rooms),
+                        author=rng.choice(members),
+                        text=" ".join(rng.choices(WORDS, k=rng.randint(1, 30))),
+                    )
+                    for _ in range(size)
+                )
+                # created_at is auto_now_add, so bulk_create stamps every row
+                # with now; date each batch back to its share of the period.
+                Message.objects.filter(id__gte=rows[0].pk, id__lte=rows[-1].pk).update(
+                    created_at=start + period * batch / batches
+                )
+            created += size
+            latest.update((row.room_id, row.pk) for row in rows)
+        # bulk_create skips post_save, so announce the rows like a post would.
+        for room_id, message_id in latest.items():
+            message_notifier.publish(message_id, room_id)
+        return created
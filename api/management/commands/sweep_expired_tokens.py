@@ -0,0 +1,23 @@
+from django.utils import timezone
+
+from api.management.base import BatchedDeleteCommand
+from api.models import AuthToken
+from api.sweep import delete_in_batches
+
+
+class Command(BatchedDeleteCommand):
+    help = (
+        "Delete expired auth tokens in small batches, each in its own short "
+        "transaction, pausing between batches so request writes can interleave."
+    )
+
+    def run_once(self, options):
+        deleted = self.sweep(options["batch_size"], options["pause"])
+        return f"Deleted {deleted} expired tokens."
+
+    def sweep(self, batch_size, pause):
+        now = timezone.now()
+        expired = AuthToken.objects.filter(expires_at__lte=now)
+        # Expired tokens are rejected even when a worker still caches them,
+        # so no worker's cache needs flushing.
+        return delete_in_batches(expired, batch_size, pause)
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.management.base import BatchedDeleteCommand
+from api.models import IdempotencyKey
+from api.sweep import delete_in_batches
+
+
+class Command(BatchedDeleteCommand):
+    help = (
+        "Delete idempotency keys older than CHAT_IDEMPOTENCY_KEY_TTL in small "
+        "batches, each in its own short transaction, pausing between batches "
+        "so request writes can interleave."
+    )
+
+    def run_once(self, options):
+        deleted = self.sweep(options["batch_size"], options["pause"])
+        return f"Deleted {deleted} expired idempotency keys."
+
+    def sweep(self, batch_size, pause):
+        cutoff = timezone.now() - timedelta(seconds=settings.CHAT_IDEMPOTENCY_KEY_TTL)
+        # Walks the created_at index from the oldest row.
+        expired = IdempotencyKey.objects.filter(created_at__lte=cutoff).order_by(
+            "created_at"
+        )
+        return delete_in_batches(expired, batch_size, pause)
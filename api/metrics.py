@@ -0,0 +1,193 @@
+"""Prometheus metrics for the whole gunicorn process group.
+
+``MetricsMiddleware`` records every request into the file of the worker that
+served it (``ProcessValues``): a latency histogram, request and 5xx counters
+and the SQL counted by ``QueryBudgetMiddleware`` per URL name, plus the
+worker's token-cache figures. ``/api/metrics/`` sums the files of every
+worker, so any worker answers for all of them.
+
+Counters of a worker that exits are folded into the master's file by the
+``child_exit`` hook in gunicorn.conf.py, so totals never go backwards when
+workers are recycled; per-worker gauges are only read from live workers.
+Recording takes the worker's thread lock once and writes a handful of
+doubles in shared memory, under series names cached per view and status.
+"""
+
+import bisect
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+
+from .authentication import token_cache
+from .hashing import hasher_pool
+from .recent import recent_messages
+from .shm import ProcessValues
+
+# Upper bounds (seconds) of the latency histogram buckets. Long-polls may
+# take up to CHAT_LONG_POLL_MAX_WAIT.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Anything else would let clients create series at will.
+METHODS = frozenset(("GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"))
+
+FAMILIES = {
+    "api_requests_total": (
+        "counter",
+        "Requests served, by URL name, method and status.",
+    ),
+    "api_request_errors_total": ("counter", "Requests answered with a 5xx status."),
+    "api_request_duration_seconds": (
+        "histogram",
+        "Time from the first middleware to the response, by URL name.",
+    ),
+    "api_db_queries_total": ("counter", "SQL queries issued by requests."),
+    "api_db_query_seconds_total": ("counter", "Time spent in SQL queries."),
+    "api_auth_token_cache_hits_total": ("counter", "Token cache hits."),
+    "api_auth_token_cache_misses_total": ("counter", "Token cache misses."),
+    "api_auth_token_cache_entries": ("gauge", "Tokens cached, over all workers."),
+    "api_workers": ("gauge", "Worker processes that have served a request."),
+    "api_password_hasher_in_flight": (
+        "gauge",
+        "Password hashing operations running or queued, over all workers.",
+    ),
+    "api_password_hasher_capacity": (
+        "gauge",
+        "Hashing operations allowed in flight before answering 503.",
+    ),
+    "api_recent_messages_hits_total": (
+        "counter",
+        "Polls answered from the ring of recent messages.",
+    ),
+    "api_recent_messages_misses_total": (
+        "counter",
+        "Polls after a cursor that the ring could not answer.",
+    ),
+}
+
+# Per-worker gauges: summed over live workers, dropped with exited ones.
+WORKER_GAUGES = frozenset(("api_auth_token_cache_entries", "api_workers"))
+
+values = ProcessValues("metrics", settings.METRICS_MAX_SERIES)
+
+# Their ``le`` labels, plus the last bucket.
+LE = [*(f"{bound:g}" for bound in BUCKETS), "+Inf"]
+
+
+@lru_cache(maxsize=4096)
+def _series(view, method, status):
+    labels = f'view="{view}"'
+    return (
+        f'api_requests_total{{{labels},method="{method}",status="{status}"}}',
+        [f'api_request_duration_seconds_bucket{{{labels},le="{le}"}}' for le in LE],
+        f"api_request_duration_seconds_sum{{{labels}}}",
+        f"api_request_duration_seconds_count{{{labels}}}",
+        f"api_request_errors_total{{{labels}}}",
+        f"api_db_queries_total{{{labels}}}",
+        f"api_db_query_seconds_total{{{labels}}}",
+    )
+
+
+def record_request(request, response, duration):
+    match = request.resolver_match
+    view = match.view_name if match is not None else "unmatched"
+    method = request.method if request.method in METHODS else "other"
+    status = response.status_code
+    requests, buckets, total, count, errors, queries, query_time = _series(
+        view, method, status
+    )
+    increments = [
+        (requests, 1),
+        (buckets[bisect.bisect_left(BUCKETS, duration)], 1),
+        (total, duration),
+        (count, 1),
+    ]
+    if status >= 500:
+        increments.append((errors, 1))
+    stats = getattr(request, "sql_stats", None)
+    if stats is not None:
+        increments.append((queries, stats.count))
+        increments.append((query_time, stats.duration))
+    # The token cache keeps per-worker totals; mirror them.
+    cache = token_cache.stats()
+    values.update(
+        increments,
+        (
+            ("api_auth_token_cache_hits_total", cache["hits"]),
+            ("api_auth_token_cache_misses_total", cache["misses"]),
+            ("api_auth_token_cache_entries", cache["size"]),
+            ("api_workers", 1),
+        ),
+    )
+
+
+def collect_worker(pid):
+    """Fold an exited worker's counters into this process's, drop its file."""
+    path = ProcessValues.files(values.prefix).get(pid)
+    if path is not None:
+        values.update(
+            (name, value)
+            for name, value in ProcessValues.read(path).items()
+            if name not in WORKER_GAUGES
+        )
+        path.unlink(missing_ok=True)
+
+
+def reset():
+    """Delete every process's file, e.g. when the master starts."""
+    values.close()
+    for path in ProcessValues.files(values.prefix).values():
+        path.unlink(missing_ok=True)
+
+
+def collect():
+    """``{series: value}`` summed over every worker, plus shared state."""
+    live = ProcessValues.files(values.prefix, live=True)
+    totals = defaultdict(float)
+    for pid, path in ProcessValues.files(values.prefix).items():
+        for name, value in ProcessValues.read(path).items():
+            if pid in live or name not in WORKER_GAUGES:
+                totals[name] += value
+    totals["api_password_hasher_in_flight"] = hasher_pool.in_use()
+    totals["api_password_hasher_capacity"] = settings.PASSWORD_HASHER_MAX_PENDING
+    if recent_messages.enabled:
+        hits, misses = recent_messages.stats()
+        totals["api_recent_messages_hits_total"] = hits
+        totals["api_recent_messages_misses_total"] = misses
+    return totals
+
+
+def _format(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(totals):
+    """The Prometheus text exposition format (version 0.0.4) of ``totals``."""
+    samples = defaultdict(list)
+    histograms = defaultdict(dict)
+    for name, value in totals.items():
+        series, _, labels = name.partition("{")
+        family = series.rpartition("_")[0]
+        if FAMILIES.get(family, ("",))[0] != "histogram":
+            samples[series].append((name, value))
+        elif series.endswith("_bucket"):
+            labels, _, le = labels.rpartition(',le="')
+            histograms[family].setdefault(labels, {})[le[:-2]] = value
+    lines = []
+    for family in sorted(samples.keys() | histograms.keys()):
+        kind, description = FAMILIES.get(family, ("untyped", family))
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, value in sorted(samples.get(family, ())):
+            lines.append(f"{name} {_format(value)}")
+        for labels, counts in sorted(histograms.get(family, {}).items()):
+            # Buckets are stored per interval; the format wants them cumulative.
+            running = 0.0
+            for le in LE:
+                running += counts.get(le, 0.0)
+                lines.append(
+                    f'{family}_bucket{{{labels},le="{le}"}} {_format(running)}'
+                )
+            for suffix in ("_sum", "_count"):
+                value = totals.get(f"{family}{suffix}{{{labels}}}", 0.0)
+                lines.append(f"{family}{suffix}{{{labels}}} {_format(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,150 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .routers import read_from_replica
+
+logger = logging.getLogger("api.sql")
+
+
+class QueryStats:
+    """Execute wrapper collecting count, total time and the slowest query."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+    def record(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def query_budget(view_func):
+    """The ``query_budget`` declared on a view class, or the default."""
+    view_class = getattr(view_func, "view_class", None)
+    budget = getattr(view_class, "query_budget", None)
+    if budget is None:
+        budget = settings.SQL_BUDGET_MAX_QUERIES
+    return budget
+
+
+class QueryBudgetMiddleware:
+    """Measure the SQL issued by each request and flag requests over budget.
+
+    The per-view budget comes from a ``query_budget`` attribute on the view
+    class (the same number the test suite enforces), falling back to
+    ``SQL_BUDGET_MAX_QUERIES``. Budgets of views that authenticate by token
+    include the UPDATE ``touch_token`` issues once per
+    ``AUTH_TOKEN_TOUCH_INTERVAL``. With ``SQL_BUDGET_HEADERS`` the
+    measurements are also returned in ``X-SQL-*`` response headers.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SQL_BUDGET_ENABLED:
+            return self.get_response(request)
+        stats = QueryStats()
+        request.sql_stats = stats
+        with stats.record():
+            response = self.get_response(request)
+        if settings.SQL_BUDGET_HEADERS:
+            response["X-SQL-Queries"] = str(stats.count)
+            response["X-SQL-Time-Ms"] = f"{stats.duration * 1000:.3f}"
+            response["X-SQL-Slowest-Ms"] = f"{stats.slowest_duration * 1000:.3f}"
+        budget = getattr(request, "sql_query_budget", settings.SQL_BUDGET_MAX_QUERIES)
+        duration_ms = stats.duration * 1000
+        if stats.count > budget or duration_ms > settings.SQL_BUDGET_MAX_TIME_MS:
+            logger.warning(
+                "SQL budget exceeded: %s %s ran %d queries (budget %d) in %.1f ms; "
+                "slowest %.1f ms: %s",
+                request.method,
+                request.path,
+                stats.count,
+                budget,
+                duration_ms,
+                stats.slowest_duration * 1000,
+                stats.slowest_sql,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.sql_query_budget = query_budget(view_func)
+
+
+class MetricsMiddleware:
+    """Record each request's latency, status and SQL in ``api.metrics``.
+
+    Listed first, so the latency covers the other middleware, and after
+    ``QueryBudgetMiddleware`` has attached the request's ``sql_stats``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        metrics.record_request(request, response, time.perf_counter() - started)
+        return response
+
+
+class ReadReplicaMiddleware:
+    """Send reads of safe-method requests to the read-only replica.
+
+    After a successful unsafe request the client gets a short-lived cookie
+    that pins its reads to the primary, so it always sees its own writes even
+    once the replica can lag behind. Views that know an unsafe request wrote
+    nothing (a batch of reads) set ``request.read_only`` to skip the cookie.
+    """
+
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+    cookie_name = "db_primary"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in self.safe_methods:
+            if self.cookie_name in request.COOKIES:
+                return self.get_response(request)
+            with read_from_replica():
+                return self.get_response(request)
+        response = self.get_response(request)
+        sticky_seconds = settings.DATABASE_READ_STICKY_SECONDS
+        if (
+            sticky_seconds > 0
+            and response.status_code < 400
+            and not getattr(request, "read_only", False)
+        ):
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
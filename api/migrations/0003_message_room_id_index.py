@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_chatroom_message"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="message",
+            options={"ordering": ["id"]},
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["room", "id"], name="api_message_room_id_idx"),
+        ),
+    ]
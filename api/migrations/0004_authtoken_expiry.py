@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_expiry(apps, schema_editor):
+    # Existing tokens count as used when the migration runs, so a deploy does
+    # not log out everyone whose token is older than the idle TTL; the
+    # absolute TTL still counts from creation.
+    AuthToken = apps.get_model("api", "AuthToken")
+    tokens = AuthToken.objects.using(schema_editor.connection.alias)
+    now = django.utils.timezone.now()
+    idle_expiry = None
+    if settings.AUTH_TOKEN_IDLE_TTL > 0:
+        idle_expiry = now + timedelta(seconds=settings.AUTH_TOKEN_IDLE_TTL)
+    tokens.update(last_used_at=now, expires_at=idle_expiry)
+    if settings.AUTH_TOKEN_TTL > 0:
+        ttl = timedelta(seconds=settings.AUTH_TOKEN_TTL)
+        if idle_expiry is not None:
+            # Only tokens whose absolute expiry comes first.
+            tokens = tokens.filter(created_at__lt=idle_expiry - ttl)
+        tokens.update(expires_at=F("created_at") + ttl)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_message_room_id_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="authtoken",
+            name="last_used_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="authtoken",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_expiry, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="authtoken",
+            index=models.Index(
+                fields=["member", "created_at"], name="api_authtoken_member_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="authtoken",
+            index=models.Index(fields=["expires_at"], name="api_authtoken_expires_idx"),
+        ),
+    ]
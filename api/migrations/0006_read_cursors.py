@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Number existing messages per room, then keep numbering new ones in the
+# database so every insert path (group commit, bulk seeding, admin) is covered
+# without an extra round trip.
+BACKFILL_SEQ = """
+UPDATE api_message SET seq = numbered.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY id) AS seq
+    FROM api_message
+) AS numbered
+WHERE api_message.id = numbered.id;
+UPDATE api_chatroom SET last_seq = (
+    SELECT COALESCE(MAX(seq), 0) FROM api_message
+    WHERE api_message.room_id = api_chatroom.id
+);
+"""
+
+CREATE_SEQ_TRIGGER = """
+CREATE TRIGGER api_message_seq AFTER INSERT ON api_message
+BEGIN
+    UPDATE api_chatroom SET last_seq = last_seq + 1 WHERE id = NEW.room_id;
+    UPDATE api_message
+    SET seq = (SELECT last_seq FROM api_chatroom WHERE id = NEW.room_id)
+    WHERE id = NEW.id;
+END;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_message_archive_segment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.IntegerField(default=0)),
+                ('last_read_seq', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='api.member')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='api.chatroom')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('member', 'room'), name='api_readcursor_member_room_uniq')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SEQ, migrations.RunSQL.noop),
+        migrations.RunSQL(
+            CREATE_SEQ_TRIGGER, "DROP TRIGGER IF EXISTS api_message_seq;"
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# An external-content FTS5 index over api_message.text: the index stores only
+# terms and rowids (= message ids), the text stays in api_message. Triggers
+# keep it in step with every write path. Rows that existed before this
+# migration are indexed by the backfill_search_index command. The delete and
+# update triggers check the docsize table first, since removing a row that
+# was never indexed would corrupt an external-content index. detail=none keeps
+# no positions (ranking and snippets are computed in api/search.py), which
+# makes the index a third of the size and inserts cheaper.
+CREATE_SEARCH_INDEX = """
+CREATE VIRTUAL TABLE api_message_fts USING fts5(
+    text,
+    content='api_message',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    detail=none
+);
+CREATE TRIGGER api_message_fts_insert AFTER INSERT ON api_message
+BEGIN
+    INSERT INTO api_message_fts (rowid, text) VALUES (NEW.id, NEW.text);
+END;
+CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message
+WHEN EXISTS (SELECT 1 FROM api_message_fts_docsize WHERE id = OLD.id)
+BEGIN
+    INSERT INTO api_message_fts (api_message_fts, rowid, text)
+    VALUES ('delete', OLD.id, OLD.text);
+END;
+CREATE TRIGGER api_message_fts_update AFTER UPDATE OF text ON api_message
+BEGIN
+    INSERT INTO api_message_fts (api_message_fts, rowid, text)
+    SELECT 'delete', OLD.id, OLD.text
+    WHERE EXISTS (SELECT 1 FROM api_message_fts_docsize WHERE id = OLD.id);
+    INSERT INTO api_message_fts (rowid, text) VALUES (NEW.id, NEW.text);
+END;
+"""
+
+DROP_SEARCH_INDEX = """
+DROP TRIGGER IF EXISTS api_message_fts_update;
+DROP TRIGGER IF EXISTS api_message_fts_delete;
+DROP TRIGGER IF EXISTS api_message_fts_insert;
+DROP TABLE IF EXISTS api_message_fts;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_read_cursors"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH_INDEX, DROP_SEARCH_INDEX),
+    ]
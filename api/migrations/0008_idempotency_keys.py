@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=32)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('member', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='api.member')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='api_idempotencykey_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('member', 'key'), name='api_idempotencykey_member_key_uniq')],
+            },
+        ),
+    ]
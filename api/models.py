@@ -1,4 +1,19 @@
 from django.db import models
+from django.utils import timezone
+
+
+def _save_without(instance, field_name, kwargs):
+    """Leave a trigger-maintained column out of UPDATEs of ``instance``.
+
+    The in-memory value may be stale; writing it back would undo the trigger.
+    """
+    if not instance._state.adding and kwargs.get("update_fields") is None:
+        kwargs["update_fields"] = [
+            field.name
+            for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name != field_name
+        ]
+    return kwargs
 
 
 class Member(models.Model):
@@ -19,6 +34,16 @@ class AuthToken(models.Model):
     key = models.CharField(max_length=40, unique=True)
     member = models.ForeignKey(Member, related_name="auth_tokens", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["member", "created_at"], name="api_authtoken_member_idx"
+            ),
+            models.Index(fields=["expires_at"], name="api_authtoken_expires_idx"),
+        ]
 
     def __str__(self):
         return self.key
@@ -27,6 +52,12 @@ class AuthToken(models.Model):
 class ChatRoom(models.Model):
     name = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Sequence number of the room's newest message, kept by a database
+    # trigger (migration 0006) on every insert.
+    last_seq = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, **kwargs):
+        super().save(**_save_without(self, "last_seq", kwargs))
 
     def __str__(self):
         return self.name
@@ -37,9 +68,111 @@ class Message(models.Model):
     author = models.ForeignKey(Member, related_name="messages", on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Position within the room (1, 2, ...), assigned by the same trigger after
+    # the insert; instances created in Python hold 0 until reloaded.
+    seq = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
-        ordering = ["created_at"]
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["room", "id"], name="api_message_room_id_idx"),
+        ]
+
+    def save(self, **kwargs):
+        super().save(**_save_without(self, "seq", kwargs))
 
     def __str__(self):
         return self.text[:50]
+
+
+class ReadCursor(models.Model):
+    """How far a member has read a room.
+
+    ``last_read_seq`` is the room sequence number at the cursor, so the unread
+    count is ``room.last_seq - last_read_seq`` without counting messages.
+    """
+
+    member = models.ForeignKey(
+        Member, related_name="read_cursors", on_delete=models.CASCADE
+    )
+    room = models.ForeignKey(
+        ChatRoom, related_name="read_cursors", on_delete=models.CASCADE
+    )
+    last_read_id = models.IntegerField(default=0)
+    last_read_seq = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["member", "room"], name="api_readcursor_member_room_uniq"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.member_id}:{self.room_id}@{self.last_read_id}"
+
+
+class MessageArchiveSegment(models.Model):
+    """A compressed file of archived messages (see api/archive.py).
+
+    Each room's segments cover a contiguous prefix of its messages by id, so
+    the newest ``last_id`` is the boundary between archive and table.
+    """
+
+    room = models.ForeignKey(
+        ChatRoom, related_name="archive_segments", on_delete=models.CASCADE
+    )
+    first_id = models.IntegerField()
+    last_id = models.IntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    path = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["room", "first_id"]
+        indexes = [
+            models.Index(fields=["room", "last_id"], name="api_archive_room_last_idx"),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+class IdempotencyKey(models.Model):
+    """The first response to a member's post sent with an ``Idempotency-Key``.
+
+    Written in the transaction that inserts the message (see
+    api/idempotency.py), so a retry finds either both or neither. Rows older
+    than ``CHAT_IDEMPOTENCY_KEY_TTL`` are ignored and removed by the
+    sweep_idempotency_keys command.
+    """
+
+    # Indexed as the first column of the unique constraint.
+    member = models.ForeignKey(
+        Member,
+        related_name="idempotency_keys",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    key = models.CharField(max_length=255)
+    # Digest of what was posted, to tell a retry from a reused key.
+    request_hash = models.CharField(max_length=32)
+    status = models.PositiveSmallIntegerField()
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["member", "key"], name="api_idempotencykey_member_key_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["created_at"], name="api_idempotencykey_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.member_id}:{self.key}"
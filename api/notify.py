@@ -0,0 +1,110 @@
+"""Cross-worker "latest message id" signals used by chat long-polling.
+
+Besides the latest id overall, each room with an id below
+``CHAT_LONG_POLL_ROOM_SLOTS`` has a counter of its own, so a poller waiting
+on a quiet room is not woken by posts elsewhere and the room's pages keep
+their ETag. Rooms beyond the table use the overall latest id.
+"""
+
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db.models import Max
+
+from .shm import SharedCounter, SharedCounters
+
+
+class MessageNotifier:
+    """Publishes the newest message id and lets readers wait for it to move.
+
+    Readers only touch the shared counter while they wait, so an idle
+    long-poll costs a memory read per interval instead of a database query.
+    """
+
+    def __init__(self, name="latest_message_id"):
+        self.name = name
+        self._counter = SharedCounter(name)
+        self._revision = SharedCounter(f"{name}_revision")
+        self._rooms = None
+
+    @property
+    def rooms(self):
+        # Sized from settings on first use, after they are configured.
+        if self._rooms is None:
+            self._rooms = SharedCounters(
+                f"{self.name}_rooms", settings.CHAT_LONG_POLL_ROOM_SLOTS
+            )
+        return self._rooms
+
+    def _room_counter(self, room_id):
+        """The room's slot in ``rooms``, or None if it has none."""
+        if room_id is None or not 0 <= room_id < self.rooms.size:
+            return None
+        return room_id
+
+    def latest_id(self, room_id=None):
+        """The newest message id, in ``room_id`` if given."""
+        slot = self._room_counter(room_id)
+        if slot is not None:
+            if not self.rooms.initialized(slot):
+                from .models import Message
+
+                return self.rooms.ensure_initialized(
+                    slot,
+                    lambda: Message.objects.filter(room_id=room_id).aggregate(
+                        latest=Max("id")
+                    )["latest"],
+                )
+            return self.rooms.get(slot)
+        if not self._counter.initialized:
+            from .models import Message
+
+            return self._counter.ensure_initialized(
+                lambda: Message.objects.aggregate(latest=Max("id"))["latest"]
+            )
+        return self._counter.get()
+
+    def reset(self):
+        """Forget the latest ids; the next readers re-seed them from the database."""
+        self._counter.reset()
+        self.rooms.reset()
+
+    def publish(self, message_id, room_id):
+        # The overall id first, so no room is ever ahead of it.
+        self._counter.set_max(message_id)
+        slot = self._room_counter(room_id)
+        if slot is not None:
+            self.rooms.set_max(slot, message_id)
+
+    def revision(self):
+        """Counter of changes to existing messages (edits and deletions)."""
+        return self._revision.get()
+
+    def publish_revision(self):
+        self._revision.incr()
+
+    def wait(self, after_id, timeout, room_id=None):
+        """Block until a message newer than ``after_id`` exists or ``timeout`` ends.
+
+        With ``room_id``, only a message in that room ends the wait. Returns
+        the latest known message id, in the room if given.
+        """
+        latest_id = self.latest_id(room_id)
+        slot = self._room_counter(room_id)
+        if slot is not None:
+            current = partial(self.rooms.get, slot)
+        else:
+            current = self._counter.get
+        deadline = time.monotonic() + timeout
+        interval = settings.CHAT_LONG_POLL_INTERVAL
+        while latest_id <= after_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            latest_id = current()
+        return latest_id
+
+
+message_notifier = MessageNotifier()
@@ -0,0 +1,108 @@
+"""The newest chat messages, already rendered, shared by every worker.
+
+Most list requests are pollers asking for whatever arrived after the last id
+they saw. Each new message's JSON goes into a ``SharedRing`` of
+``CHAT_RECENT_MESSAGES`` slots right after its transaction commits, just
+before its id is published to ``message_notifier``, and a page after a cursor
+inside that window is joined from the stored bytes without touching the
+database.
+
+A page is only answered from the ring when every id between the cursor and
+the latest published id is there. Messages saved without their author loaded
+(the admin) or without signals (``seed_data``) leave gaps that send those
+pages to the database until the ring has moved past them. Edits and
+deletions of messages, and of members, whose nicknames the stored messages
+embed, bump the notifier's revision, which invalidates the whole ring until
+the next post.
+"""
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+
+from .fastpath import format_datetime, render_json
+from .models import Message
+from .notify import message_notifier
+from .shm import SharedRing
+
+# Between list items, as render_json would write it.
+SEPARATOR = b"," if api_settings.COMPACT_JSON else b", "
+
+
+class RecentMessages:
+    def __init__(self, name="recent_messages"):
+        self.name = name
+        self._ring = None
+
+    @property
+    def ring(self):
+        # Sized from settings on first use, after they are configured.
+        if self._ring is None:
+            self._ring = SharedRing(
+                self.name,
+                settings.CHAT_RECENT_MESSAGES,
+                settings.CHAT_RECENT_SLOT_BYTES,
+            )
+        return self._ring
+
+    @property
+    def enabled(self):
+        return settings.CHAT_RECENT_MESSAGES > 0
+
+    def append(self, message):
+        """Store a just-committed ``Message`` as ``MessageSerializer`` renders it.
+
+        Skipped when the author is not loaded, which would cost a query.
+        """
+        if not self.enabled or not Message.author.is_cached(message):
+            return
+        data = {
+            "id": message.pk,
+            "text": message.text,
+            "created_at": format_datetime(message.created_at),
+            "author": {"id": message.author_id, "nickname": message.author.nickname},
+            "room_id": message.room_id,
+        }
+        self.ring.put(
+            message.pk, message.room_id, render_json(data), message_notifier.revision()
+        )
+
+    def page(self, room_id, after_id, latest_id, limit):
+        """``(ids, JSON array)`` of the room's messages after ``after_id``.
+
+        Returns None, and the caller reads the database, when the ring does
+        not hold every message up to ``latest_id``.
+        """
+        if not self.enabled:
+            return None
+        ring = self.ring
+        if (
+            latest_id - after_id > ring.slots
+            or ring.revision() != message_notifier.revision()
+        ):
+            ring.count(hit=False)
+            return None
+        ids = []
+        payloads = []
+        for message_id in range(after_id + 1, latest_id + 1):
+            entry = ring.get(message_id)
+            if entry is None:
+                ring.count(hit=False)
+                return None
+            tag, payload = entry
+            if tag == room_id:
+                ids.append(message_id)
+                payloads.append(payload)
+                if len(ids) == limit:
+                    break
+        ring.count(hit=True)
+        return ids, b"[" + SEPARATOR.join(payloads) + b"]"
+
+    def stats(self):
+        """``(hits, misses)`` counted by every worker."""
+        return self.ring.stats()
+
+    def clear(self):
+        self.ring.clear()
+
+
+recent_messages = RecentMessages()
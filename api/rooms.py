@@ -0,0 +1,60 @@
+"""In-process registry of chat rooms.
+
+Rooms are few and rarely change, but every chat request needs one. Each
+worker keeps all rooms in memory and reloads them (one query) only after the
+shared generation counter moves, which the ChatRoom signals do on every
+create, update and delete.
+"""
+
+import threading
+
+from .models import ChatRoom
+from .shm import SharedCounter
+
+GLOBAL_ROOM_NAME = "Global chat"
+
+
+class RoomRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = SharedCounter("chat_room_generation")
+        self._loaded_generation = None
+        self._rooms = {}
+
+    def _current(self):
+        generation = self._generation.get()
+        with self._lock:
+            if generation == self._loaded_generation:
+                return self._rooms
+        rooms = {room.pk: room for room in ChatRoom.objects.order_by("id")}
+        with self._lock:
+            self._rooms = rooms
+            self._loaded_generation = generation
+        return rooms
+
+    def all(self):
+        return list(self._current().values())
+
+    def get(self, room_id):
+        return self._current().get(room_id)
+
+    def global_room(self):
+        for room in self._current().values():
+            if room.name == GLOBAL_ROOM_NAME:
+                return room
+        # First request after a fresh database; creating it bumps the
+        # generation, so the next lookup reloads.
+        room, _ = ChatRoom.objects.get_or_create(name=GLOBAL_ROOM_NAME)
+        return room
+
+    def invalidate(self):
+        """Make every worker reload its rooms."""
+        self._generation.incr()
+
+    def clear(self):
+        with self._lock:
+            self._rooms = {}
+            self._loaded_generation = None
+
+
+room_registry = RoomRegistry()
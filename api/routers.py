@@ -0,0 +1,56 @@
+"""Database routing between the read-write primary and the read-only replica.
+
+``ReadReplicaMiddleware`` marks safe-method requests; queries they read go to
+the ``replica`` alias, everything else to ``default``. With a single SQLite
+file the replica is a ``mode=ro`` connection to the same database, which keeps
+readers off the writable connection today and gives real replicas a place to
+plug in later.
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+REPLICA = "replica"
+
+_read_from_replica = contextvars.ContextVar("read_from_replica", default=False)
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """Route reads in the current context to the replica (if configured)."""
+    token = _read_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def replica_available():
+    if REPLICA not in settings.DATABASES:
+        return False
+    # Under the test runner the replica is a TEST MIRROR of the primary; reading
+    # through the primary connection keeps test transactions visible.
+    return (
+        connections[REPLICA].settings_dict["NAME"]
+        != connections["default"].settings_dict["NAME"]
+    )
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and replica_available():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
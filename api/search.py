@@ -0,0 +1,189 @@
+"""Full-text search over chat messages with SQLite FTS5.
+
+``api_message_fts`` (migration 0007) indexes ``Message.text``. A search takes
+the newest ``CHAT_SEARCH_MAX_CANDIDATES`` matches, which FTS5 finds by walking
+the index in descending rowid order and stopping there, and ranks only those,
+with BM25 computed here over that window: FTS5's own ``bm25()`` counts the
+documents containing each term across the whole table on every query, so its
+cost grows with the history. Recent messages are usually the ones people look
+for anyway. Pages of one search share the window through ``before_id``, so
+new messages do not shift later pages.
+
+Words match whole: a prefix query merges the complete doclists of every term
+it expands to, which is again proportional to the history. Archived messages
+are removed from the index along with their rows.
+"""
+
+import html
+import math
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connections, router
+
+from .fastpath import format_datetime
+from .models import Message
+
+# Words as the unicode61 tokenizer splits them: letters and digits only. A
+# quoted term it would split further is a phrase, which detail=none rejects.
+TERM_RE = re.compile(r"[^\W_]+")
+# BM25 parameters, as in FTS5.
+K1 = 1.2
+B = 0.75
+SNIPPET_WORDS = 16
+
+CANDIDATES_SQL = """
+SELECT m.id, m.text, m.created_at, m.author_id, a.nickname, m.room_id
+FROM api_message_fts
+JOIN api_message m ON m.id = api_message_fts.rowid
+JOIN api_member a ON a.id = m.author_id
+WHERE {where}
+ORDER BY api_message_fts.rowid DESC
+LIMIT %s
+"""
+
+
+def fold(text):
+    """Lower-case and strip diacritics, as the index's tokenizer does."""
+    text = text.casefold()
+    if text.isascii():
+        return text
+    return "".join(
+        char
+        for char in unicodedata.normalize("NFKD", text)
+        if not unicodedata.combining(char)
+    )
+
+
+def query_terms(query):
+    """The distinct folded words of a free-text query, in order."""
+    return list(dict.fromkeys(TERM_RE.findall(fold(query))))
+
+
+def match_expression(terms):
+    """Quote every word into an FTS5 MATCH expression that requires them all.
+
+    Operators and syntax errors in user input never reach FTS5.
+    """
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def _scores(texts, terms):
+    """BM25 of each text, with document frequencies taken over ``texts``.
+
+    Only the query terms are located in each text, and length is measured in
+    characters; both keep scoring a window of candidates to a few
+    milliseconds.
+    """
+    pattern = re.compile(
+        r"(?<![^\W_])(?:%s)(?![^\W_])" % "|".join(map(re.escape, terms)),
+        re.IGNORECASE,
+    )
+    positions = {term: index for index, term in enumerate(terms)}
+    counts = []
+    frequencies = [0] * len(terms)
+    for text in texts:
+        found = [0] * len(terms)
+        for word in pattern.findall(text if text.isascii() else fold(text)):
+            index = positions.get(word.casefold())
+            if index is not None:
+                found[index] += 1
+        for index, count in enumerate(found):
+            frequencies[index] += count > 0
+        counts.append(found)
+    lengths = [len(text) for text in texts]
+    average = sum(lengths) / len(lengths) or 1
+    idf = [
+        math.log((len(texts) - frequency + 0.5) / (frequency + 0.5) + 1)
+        for frequency in frequencies
+    ]
+    return [
+        sum(
+            idf[index]
+            * count
+            * (K1 + 1)
+            / (count + K1 * (1 - B + B * length / average))
+            for index, count in enumerate(found)
+            if count
+        )
+        for length, found in zip(lengths, counts)
+    ]
+
+
+def snippet(text, terms):
+    """HTML excerpt of up to SNIPPET_WORDS words with the matches in <mark>."""
+    words = list(TERM_RE.finditer(text))
+    if not words:
+        return html.escape(text, quote=False)
+    hits = [index for index, word in enumerate(words) if fold(word.group()) in terms]
+    # Start a few words before the first match, but keep the excerpt full.
+    first = hits[0] - SNIPPET_WORDS // 4 if hits else 0
+    first = max(0, min(first, len(words) - SNIPPET_WORDS))
+    last = min(len(words), first + SNIPPET_WORDS) - 1
+    start = words[first].start() if first else 0
+    end = words[last].end() if last < len(words) - 1 else len(text)
+    parts = ["…"] if start else []
+    position = start
+    for index in hits:
+        if first <= index <= last:
+            word = words[index]
+            parts.append(html.escape(text[position : word.start()], quote=False))
+            parts.append(f"<mark>{html.escape(word.group(), quote=False)}</mark>")
+            position = word.end()
+    parts.append(html.escape(text[position:end], quote=False))
+    if end < len(text):
+        parts.append("…")
+    return "".join(parts)
+
+
+def search_messages(query, room_id=None, before_id=None, limit=20, offset=0):
+    """Messages matching ``query``, best first, shaped like ``message_rows``.
+
+    Returns ``(rows, window)``. Each row also carries an HTML ``snippet``
+    with the matches in ``<mark>``; ``window`` is the ``before_id`` that keeps
+    following pages on the same candidates (None when nothing matched).
+    Costs one query.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], None
+    filters = ["api_message_fts MATCH %s"]
+    params = [match_expression(terms)]
+    if room_id is not None:
+        filters.append("m.room_id = %s")
+        params.append(room_id)
+    if before_id is not None:
+        filters.append("api_message_fts.rowid < %s")
+        params.append(before_id)
+    connection = connections[router.db_for_read(Message)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CANDIDATES_SQL.format(where=" AND ".join(filters)),
+            [*params, settings.CHAT_SEARCH_MAX_CANDIDATES],
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return [], None
+    scores = _scores([row[1] for row in rows], terms)
+    # Candidates arrive newest first and sorted() is stable, so ties go to the
+    # newer message.
+    ranked = sorted(range(len(rows)), key=scores.__getitem__, reverse=True)
+    created_at = Message._meta.get_field("created_at")
+    results = []
+    for index in ranked[offset : offset + limit]:
+        message_id, text, created, author_id, nickname, message_room_id = rows[index]
+        created = connection.ops.convert_datetimefield_value(
+            created, created_at, connection
+        )
+        results.append(
+            {
+                "id": message_id,
+                "text": text,
+                "created_at": format_datetime(created),
+                "author": {"id": author_id, "nickname": nickname},
+                "room_id": message_room_id,
+                "snippet": snippet(text, terms),
+            }
+        )
+    return results, rows[0][0] + 1
@@ -1,6 +1,9 @@
-from django.contrib.auth.hashers import make_password, check_password
+from django.conf import settings
 from rest_framework import serializers
+from .batch import SUB_REQUEST_HEADERS
+from .hashing import hasher_pool
 from .models import Member, ChatRoom, Message
+from .writequeue import message_write_queue
 
 
 class HelloMessageSerializer(serializers.Serializer):
@@ -22,6 +25,8 @@ class MemberRegistrationSerializer(serializers.ModelSerializer):
         model = Member
         fields = ["id", "nickname", "password", "created_at"]
         read_only_fields = ["id", "created_at"]
+        # validate_nickname already checks uniqueness; skip the duplicate query.
+        extra_kwargs = {"nickname": {"validators": []}}
 
     def validate_nickname(self, value):
         if Member.objects.filter(nickname=value).exists():
@@ -30,7 +35,7 @@ class MemberRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         password = validated_data.pop("password")
-        validated_data["password"] = make_password(password)
+        validated_data["password"] = hasher_pool.make_password(password)
         member = Member.objects.create(**validated_data)
         return member
 
@@ -48,8 +53,13 @@ class MemberLoginSerializer(serializers.Serializer):
             member = Member.objects.get(nickname=nickname)
         except Member.DoesNotExist:
             raise serializers.ValidationError("Invalid credentials.")
-        if not check_password(password, member.password):
+        valid, needs_rehash = hasher_pool.verify_password(password, member.password)
+        if not valid:
             raise serializers.ValidationError("Invalid credentials.")
+        if needs_rehash:
+            # The hasher or its parameters changed since this hash was made.
+            member.password = hasher_pool.make_password(password)
+            Member.objects.filter(pk=member.pk).update(password=member.password)
         attrs["member"] = member
         return attrs
 
@@ -65,6 +75,12 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         fields = ["id", "name"]
 
 
+class ReadCursorSerializer(serializers.Serializer):
+    room_id = serializers.IntegerField(read_only=True)
+    last_read_id = serializers.IntegerField(min_value=0)
+    unread_count = serializers.IntegerField(read_only=True)
+
+
 class MessageAuthorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Member
@@ -92,6 +108,14 @@ class MessageCreateSerializer(serializers.Serializer):
     def create(self, validated_data):
         member = self.context["member"]
         room = self.context["room"]
+        # Callers that write more rows in the same transaction opt out.
+        group_commit = self.context.get("group_commit", True)
+        if group_commit and settings.CHAT_GROUP_COMMIT_ENABLED:
+            return message_write_queue.submit(
+                room=room,
+                author=member,
+                text=validated_data["text"],
+            )
         message = Message.objects.create(
             room=room,
             author=member,
@@ -108,6 +132,7 @@ class ProfileSerializer(serializers.ModelSerializer):
         model = Member
         fields = ["id", "nickname", "created_at", "new_password", "old_password"]
         read_only_fields = ["id", "created_at"]
+        extra_kwargs = {"nickname": {"validators": []}}
 
     def validate_nickname(self, value):
         member = self.instance
@@ -126,7 +151,8 @@ class ProfileSerializer(serializers.ModelSerializer):
             if member is None:
                 raise serializers.ValidationError({"new_password": "Member instance is required."})
             if old_password is not None and old_password != "":
-                if not check_password(old_password, member.password):
+                valid, _ = hasher_pool.verify_password(old_password, member.password)
+                if not valid:
                     raise serializers.ValidationError({"old_password": "Old password is incorrect."})
         return attrs
 
@@ -136,6 +162,48 @@ class ProfileSerializer(serializers.ModelSerializer):
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         if new_password is not None and new_password != "":
-            instance.password = make_password(new_password)
+            instance.password = hasher_pool.make_password(new_password)
         instance.save()
         return instance
+
+
+class BatchEntrySerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        choices=["GET", "POST", "PUT", "PATCH", "DELETE"], default="GET"
+    )
+    path = serializers.CharField(max_length=2048)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+    body = serializers.JSONField(required=False)
+
+    def validate_headers(self, value):
+        names = sorted(
+            name for name in value if name.lower() not in SUB_REQUEST_HEADERS
+        )
+        if names:
+            raise serializers.ValidationError(
+                f"Headers not allowed in a sub-request: {', '.join(names)}. "
+                f"Allowed: {', '.join(sorted(SUB_REQUEST_HEADERS))}."
+            )
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = serializers.ListField(child=BatchEntrySerializer(), min_length=1)
+
+    def validate_requests(self, value):
+        limit = settings.API_BATCH_MAX_REQUESTS
+        if len(value) > limit:
+            raise serializers.ValidationError(
+                f"Ensure this field has no more than {limit} elements."
+            )
+        return value
+
+
+class BatchResultSerializer(serializers.Serializer):
+    status = serializers.IntegerField()
+    headers = serializers.DictField(child=serializers.CharField())
+    body = serializers.JSONField(allow_null=True)
+
+
+class BatchResponseSerializer(serializers.Serializer):
+    responses = BatchResultSerializer(many=True)
@@ -0,0 +1,493 @@
+"""Small pieces of state shared between gunicorn workers through mmap'd files.
+
+Workers are separate processes, so module-level Python objects are private to
+each of them. The helpers here keep tiny fixed-layout records in files under
+``settings.SHARED_STATE_DIR``; every process maps the same file, so reads are
+plain memory loads and writes are visible to all workers immediately.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+
+def shared_state_path(name):
+    directory = Path(settings.SHARED_STATE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / name
+
+
+class SharedFile:
+    """A fixed-size memory-mapped file guarded by an inter-process ``flock``.
+
+    ``flock`` locks belong to the open file description, which forked children
+    share with their parent, so the descriptor is reopened in every process.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def map(self):
+        if self._pid != os.getpid():
+            self._open()
+        return self._map
+
+    def _open(self):
+        with self._thread_lock:
+            if self._pid == os.getpid():
+                return
+            fd = os.open(shared_state_path(self.name), os.O_RDWR | os.O_CREAT, 0o660)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < self.size:
+                    os.ftruncate(fd, self.size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, self.size)
+            self._fd = fd
+            self._pid = os.getpid()
+
+    def close(self):
+        with self._thread_lock:
+            if self._pid == os.getpid():
+                self._map.close()
+                os.close(self._fd)
+            self._pid = self._fd = self._map = None
+
+    @contextmanager
+    def locked(self):
+        buf = self.map
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield buf
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SharedCounter:
+    """An unsigned 64-bit integer visible to every worker process.
+
+    The first 8 bytes hold the value and the next 8 an "initialized" flag, so
+    callers can seed the counter from the database exactly once.
+    """
+
+    _layout = struct.Struct("<QQ")
+
+    def __init__(self, name):
+        self._file = SharedFile(name, self._layout.size)
+
+    def get(self):
+        return self._layout.unpack_from(self._file.map, 0)[0]
+
+    @property
+    def initialized(self):
+        return self._layout.unpack_from(self._file.map, 0)[1] == 1
+
+    def ensure_initialized(self, loader):
+        """Seed the counter with ``loader()`` unless a worker already did."""
+        if self.initialized:
+            return self.get()
+        with self._file.locked() as buf:
+            value, flag = self._layout.unpack_from(buf, 0)
+            if flag != 1:
+                value = max(value, int(loader() or 0))
+                self._layout.pack_into(buf, 0, value, 1)
+            return value
+
+    def set_max(self, value):
+        """Raise the counter to ``value`` if it is currently lower."""
+        with self._file.locked() as buf:
+            current, flag = self._layout.unpack_from(buf, 0)
+            if value > current:
+                self._layout.pack_into(buf, 0, value, flag)
+                return value
+            return current
+
+    def reset(self):
+        """Zero the counter and mark it uninitialized."""
+        with self._file.locked() as buf:
+            self._layout.pack_into(buf, 0, 0, 0)
+
+    def incr(self, amount=1):
+        with self._file.locked() as buf:
+            current, flag = self._layout.unpack_from(buf, 0)
+            current += amount
+            self._layout.pack_into(buf, 0, current, flag)
+            return current
+
+
+class SharedCounters:
+    """``size`` counters laid out like ``SharedCounter``, in one file.
+
+    Each counter has its own "initialized" flag, so callers can seed them
+    one by one.
+    """
+
+    _layout = SharedCounter._layout
+
+    def __init__(self, name, size):
+        self.size = size
+        self._file = SharedFile(name, self._layout.size * max(size, 1))
+
+    def get(self, index):
+        return self._layout.unpack_from(self._file.map, index * self._layout.size)[0]
+
+    def initialized(self, index):
+        offset = index * self._layout.size
+        return self._layout.unpack_from(self._file.map, offset)[1] == 1
+
+    def ensure_initialized(self, index, loader):
+        """Seed counter ``index`` with ``loader()`` unless a worker already did."""
+        if self.initialized(index):
+            return self.get(index)
+        offset = index * self._layout.size
+        with self._file.locked() as buf:
+            value, flag = self._layout.unpack_from(buf, offset)
+            if flag != 1:
+                value = max(value, int(loader() or 0))
+                self._layout.pack_into(buf, offset, value, 1)
+            return value
+
+    def set_max(self, index, value):
+        """Raise counter ``index`` to ``value`` if it is currently lower."""
+        offset = index * self._layout.size
+        with self._file.locked() as buf:
+            current, flag = self._layout.unpack_from(buf, offset)
+            if value > current:
+                self._layout.pack_into(buf, offset, value, flag)
+
+    def reset(self):
+        """Zero every counter and mark them all uninitialized."""
+        with self._file.locked() as buf:
+            buf[:] = bytes(len(buf))
+
+
+class SharedSlots:
+    """A counting semaphore shared by every worker process.
+
+    Each slot records the holder's pid and start time. A slot whose holder
+    died, or that has been held longer than ``stale_after`` seconds, is taken
+    over, so a killed worker cannot leak capacity.
+    """
+
+    _slot = struct.Struct("<Id")
+
+    def __init__(self, name, size):
+        self.size = size
+        self._file = SharedFile(name, self._slot.size * max(size, 1))
+
+    def acquire(self, stale_after):
+        """Claim a free slot and return its index, or ``None`` if all are busy."""
+        now = time.time()
+        with self._file.locked() as buf:
+            for index in range(self.size):
+                offset = index * self._slot.size
+                pid, started = self._slot.unpack_from(buf, offset)
+                if pid and now - started < stale_after and _process_alive(pid):
+                    continue
+                self._slot.pack_into(buf, offset, os.getpid(), now)
+                return index
+        return None
+
+    def release(self, index):
+        with self._file.locked() as buf:
+            offset = index * self._slot.size
+            # The slot may have been reclaimed as stale in the meantime.
+            if self._slot.unpack_from(buf, offset)[0] == os.getpid():
+                self._slot.pack_into(buf, offset, 0, 0.0)
+
+    def in_use(self):
+        buf = self._file.map
+        return sum(
+            1
+            for index in range(self.size)
+            if self._slot.unpack_from(buf, index * self._slot.size)[0]
+        )
+
+
+class SharedBuckets:
+    """Token buckets keyed by string, in a hash table shared by every worker.
+
+    Each slot holds a 64-bit hash of the key, the tokens left and when they
+    were counted. Keys probe a few consecutive slots; when all of them belong
+    to other keys the least recently used one is taken over, which at worst
+    hands that key a fresh (full) bucket.
+    """
+
+    _slot = struct.Struct("<Qdd")
+    probes = 8
+
+    def __init__(self, name, size):
+        self.size = size
+        self._file = SharedFile(name, self._slot.size * size)
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # 0 marks an empty slot.
+        return int.from_bytes(digest, "little") or 1
+
+    def take(self, key, capacity, rate, now=None):
+        """Take one token from ``key``'s bucket.
+
+        The bucket holds up to ``capacity`` tokens and refills at ``rate``
+        tokens per second. Returns 0.0 if a token was taken, otherwise the
+        seconds until one will be available.
+        """
+        now = time.time() if now is None else now
+        wanted = self._hash(key)
+        with self._file.locked() as buf:
+            found = free = oldest = None
+            oldest_stamp = float("inf")
+            for probe in range(self.probes):
+                offset = (wanted + probe) % self.size * self._slot.size
+                slot_key, tokens, stamp = self._slot.unpack_from(buf, offset)
+                if slot_key == wanted:
+                    found = offset
+                    break
+                if slot_key == 0:
+                    if free is None:
+                        free = offset
+                elif stamp < oldest_stamp:
+                    oldest, oldest_stamp = offset, stamp
+            if found is not None:
+                offset = found
+                tokens = min(capacity, tokens + max(now - stamp, 0.0) * rate)
+            else:
+                offset = free if free is not None else oldest
+                tokens = capacity
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._slot.pack_into(buf, offset, wanted, tokens, now)
+            return wait
+
+    def clear(self):
+        with self._file.locked() as buf:
+            buf[:] = bytes(len(buf))
+
+
+class SharedRing:
+    """Fixed-size byte payloads keyed by a growing integer, in a shared ring.
+
+    Key ``k`` lives in slot ``k % slots``, so a newer key overwrites the one
+    ``slots`` before it. Writers take the file lock; readers do not. A writer
+    clears the slot's key before replacing the payload and sets it last, and
+    a reader checks the key again after copying, so it never returns a torn
+    payload. The header holds a revision: the first ``put`` for a different
+    revision empties the ring, so callers that compare ``revision()`` with the
+    current one never read entries from before an edit or a deletion. Hit and
+    miss counters in the header are updated without the lock and may
+    lose an increment under contention.
+    """
+
+    _header = struct.Struct("<QQQ")
+    _slot = struct.Struct("<QQI")
+    OVERSIZED = 0xFFFFFFFF
+
+    def __init__(self, name, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - self._slot.size
+        self._file = SharedFile(name, self._header.size + slots * slot_size)
+
+    def _offset(self, key):
+        return self._header.size + key % self.slots * self.slot_size
+
+    def revision(self):
+        return self._header.unpack_from(self._file.map, 0)[0]
+
+    def put(self, key, tag, payload, revision):
+        """Store ``payload`` (bytes) under ``key``; oversized ones as a gap."""
+        with self._file.locked() as buf:
+            current, hits, misses = self._header.unpack_from(buf, 0)
+            if current != revision:
+                self._clear_slots(buf)
+                self._header.pack_into(buf, 0, revision, hits, misses)
+            offset = self._offset(key)
+            self._slot.pack_into(buf, offset, 0, 0, 0)
+            if len(payload) > self.capacity:
+                self._slot.pack_into(buf, offset, key, tag, self.OVERSIZED)
+                return
+            start = offset + self._slot.size
+            buf[start : start + len(payload)] = payload
+            self._slot.pack_into(buf, offset, key, tag, len(payload))
+
+    def get(self, key):
+        """``(tag, payload)`` stored under ``key``, or None."""
+        buf = self._file.map
+        offset = self._offset(key)
+        stored, tag, length = self._slot.unpack_from(buf, offset)
+        if stored != key or length == self.OVERSIZED:
+            return None
+        start = offset + self._slot.size
+        payload = buf[start : start + length]
+        if self._slot.unpack_from(buf, offset)[0] != key:
+            return None
+        return tag, payload
+
+    def count(self, hit):
+        """Add one to the hit or the miss counter."""
+        buf = self._file.map
+        offset = 8 if hit else 16
+        (value,) = struct.unpack_from("<Q", buf, offset)
+        struct.pack_into("<Q", buf, offset, value + 1)
+
+    def stats(self):
+        """``(hits, misses)`` since the ring was created or cleared."""
+        return self._header.unpack_from(self._file.map, 0)[1:]
+
+    def clear(self):
+        with self._file.locked() as buf:
+            buf[:] = bytes(len(buf))
+
+    def _clear_slots(self, buf):
+        for index in range(self.slots):
+            self._slot.pack_into(
+                buf, self._header.size + index * self.slot_size, 0, 0, 0
+            )
+
+
+class ProcessValues:
+    """Named float values that one process writes and any process can read.
+
+    Each process appends its series to its own file, ``<prefix>-<pid>``, so
+    writers never contend for a file lock; readers list the files with
+    ``files`` and sum what ``read`` returns for each. A new series' record
+    is written before the count in the header is raised, so readers never
+    see a half-written name, and values are aligned doubles, which are
+    stored whole.
+    """
+
+    _header = struct.Struct("<Q")
+    _record = struct.Struct("<120sd")
+    name_size = 120
+
+    def __init__(self, prefix, size):
+        self.prefix = prefix
+        self.size = size
+        self._pid = None
+        self._file = None
+        self._index = {}
+        self._values = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self._file = SharedFile(
+            f"{self.prefix}-{os.getpid()}",
+            self._header.size + self.size * self._record.size,
+        )
+        buf = self._file.map
+        # A recycled pid finds its predecessor's series and carries on.
+        self._index = {
+            name: self._value_index(position)
+            for position, (name, _) in enumerate(self._records(buf))
+        }
+        self._values = memoryview(buf).cast("d")
+        self._pid = os.getpid()
+
+    def _value_index(self, position):
+        offset = self._header.size + (position + 1) * self._record.size - 8
+        return offset // 8
+
+    def _series(self, name):
+        index = self._index.get(name)
+        if index is None:
+            buf = self._file.map
+            (count,) = self._header.unpack_from(buf, 0)
+            encoded = name.encode()
+            if count >= self.size or len(encoded) > self.name_size:
+                return None
+            offset = self._header.size + count * self._record.size
+            self._record.pack_into(buf, offset, encoded, 0.0)
+            self._header.pack_into(buf, 0, count + 1)
+            index = self._index[name] = self._value_index(count)
+        return index
+
+    def update(self, increments=(), values=()):
+        """Add each ``(name, amount)`` and set each ``(name, value)``."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            stored = self._values
+            for name, amount in increments:
+                index = self._series(name)
+                if index is not None:
+                    stored[index] += amount
+            for name, value in values:
+                index = self._series(name)
+                if index is not None:
+                    stored[index] = value
+
+    @classmethod
+    def _records(cls, data):
+        (count,) = cls._header.unpack_from(data, 0)
+        for position in range(count):
+            name, value = cls._record.unpack_from(
+                data, cls._header.size + position * cls._record.size
+            )
+            yield name.rstrip(b"\0").decode(), value
+
+    @classmethod
+    def read(cls, path):
+        """``{name: value}`` from one process's file."""
+        with open(path, "rb") as stream:
+            data = stream.read(cls._header.size)
+            if len(data) < cls._header.size:
+                return {}
+            (count,) = cls._header.unpack_from(data, 0)
+            data += stream.read(count * cls._record.size)
+        return dict(cls._records(data))
+
+    @classmethod
+    def files(cls, prefix, live=False):
+        """``{pid: path}`` of the files written under ``prefix``.
+
+        With ``live``, only those of processes that are still running.
+        """
+        directory = shared_state_path(prefix).parent
+        found = {}
+        for path in directory.glob(f"{prefix}-*"):
+            pid = path.name.removeprefix(f"{prefix}-")
+            if not pid.isdigit():
+                continue
+            pid = int(pid)
+            if not live or pid == os.getpid() or _process_alive(pid):
+                found[pid] = path
+        return found
+
+    def close(self):
+        """Forget this process's file, e.g. after it was deleted."""
+        with self._lock:
+            self._pid = None
+            self._index = {}
+            if self._values is not None:
+                self._values.release()
+                self._file.close()
+            self._values = self._file = None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .archive import archive_index
+from .authentication import token_cache
+from .models import AuthToken, ChatRoom, Member, Message, MessageArchiveSegment
+from .notify import message_notifier
+from .recent import recent_messages
+from .rooms import room_registry
+
+
+@receiver(post_save, sender=Message)
+def publish_new_message(sender, instance, created, **kwargs):
+    if created:
+        message_id = instance.pk
+        room_id = instance.room_id
+
+        def publish():
+            # Into the ring first, so pollers woken by the new id find it there.
+            recent_messages.append(instance)
+            message_notifier.publish(message_id, room_id)
+
+        transaction.on_commit(publish)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def publish_message_revision(sender, **kwargs):
+    # Appends are covered by the latest id; edits and deletions (admin,
+    # archival) change pages that id alone would report as unchanged.
+    if kwargs.get("created"):
+        return
+    message_notifier.publish_revision()
+    transaction.on_commit(message_notifier.publish_revision)
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def publish_author_revision(sender, **kwargs):
+    # Messages embed their author's nickname, so renaming a member changes
+    # rendered pages, including those kept in recent_messages.
+    if kwargs.get("created"):
+        return
+    message_notifier.publish_revision()
+    transaction.on_commit(message_notifier.publish_revision)
+
+
+@receiver(post_delete, sender=AuthToken)
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def invalidate_token_cache(sender, **kwargs):
+    # Covers LogoutView, ProfileView updates and admin edits alike. Invalidate
+    # now so the change is visible at once, and again after commit so no worker
+    # keeps a row it re-read before the transaction finished.
+    if kwargs.get("created"):
+        return
+    token_cache.invalidate()
+    transaction.on_commit(token_cache.invalidate)
+
+
+@receiver(post_save, sender=ChatRoom)
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_room_registry(sender, **kwargs):
+    room_registry.invalidate()
+    transaction.on_commit(room_registry.invalidate)
+
+
+@receiver(post_save, sender=MessageArchiveSegment)
+@receiver(post_delete, sender=MessageArchiveSegment)
+def invalidate_archive_index(sender, **kwargs):
+    archive_index.invalidate()
+    transaction.on_commit(archive_index.invalidate)
@@ -0,0 +1,45 @@
+"""Batched deletion for the sweeper commands.
+
+The sweepers delete rows that nothing references: expired tokens, archived
+messages and old idempotency keys. ``QuerySet.delete()`` would collect each
+batch row by row to send ``post_delete``, whose receivers flush every
+worker's token cache or announce a message revision once per row.
+``delete_in_batches`` instead issues one plain ``DELETE`` per batch, each in
+its own autocommit transaction, and leaves the caller to do once per batch
+what the receivers would have done per row.
+"""
+
+import time
+
+from django.db import connections
+
+
+def _delete_rows(model, pks, using):
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ", ".join(["%s"] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", pks)
+        return cursor.rowcount
+
+
+def delete_in_batches(queryset, batch_size, pause, after_batch=None):
+    """Delete the rows of ``queryset``; returns how many were deleted.
+
+    Rows go ``batch_size`` at a time, sleeping ``pause`` seconds between
+    batches so request writes can interleave. ``after_batch`` is called
+    after each batch. No signals are sent and no related rows are collected,
+    so the model must not be the target of any foreign key.
+    """
+    deleted = 0
+    while True:
+        batch = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += _delete_rows(queryset.model, batch, queryset.db)
+        if after_batch is not None:
+            after_batch()
+        if len(batch) < batch_size:
+            return deleted
+        time.sleep(pause)
@@ -1,3 +1,1545 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management import call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from . import metrics
+from .archive import archive_index
+from .admin import MessageAdmin
+from .authentication import token_cache, token_expiry
+from .cursors import read_cursors
+from .hashing import HasherBusy, hasher_pool
+from .hub import ChatHub, _load_messages
+from .middleware import ReadReplicaMiddleware
+from .idempotency import _stored
+from .models import (
+    AuthToken,
+    ChatRoom,
+    IdempotencyKey,
+    Member,
+    Message,
+    MessageArchiveSegment,
+    ReadCursor,
+)
+from .notify import MessageNotifier, message_notifier
+from .recent import recent_messages
+from .rooms import room_registry
+from .serializers import MessageSerializer
+from .shm import ProcessValues, SharedBuckets, shared_state_path
+from .views import MeView
+from .throttling import throttle_buckets
+from .warmup import warm_up_threads
+from .websocket import CHAT_PATH, websocket_application
+from .writequeue import message_write_queue
+
+_shared_state = ExitStack()
+
+
+def setUpModule():
+    # Shared files open lazily, so everything the tests map lives in a
+    # directory of their own rather than the running server's.
+    directory = _shared_state.enter_context(tempfile.TemporaryDirectory())
+    _shared_state.enter_context(override_settings(SHARED_STATE_DIR=directory))
+
+
+def tearDownModule():
+    _shared_state.close()
+
+
+def scratch_name(test_case):
+    """A unique shared file name, whose files are deleted after the test."""
+    name = f"test-{uuid.uuid4().hex}"
+
+    def remove():
+        for path in shared_state_path(name).parent.glob(f"{name}*"):
+            path.unlink()
+
+    test_case.addCleanup(remove)
+    return name
+
+
+class QueryBudgetTestCase(APITestCase):
+    """Base class for endpoint tests that enforce each view's ``query_budget``.
+
+    The budget is declared on the view class, where ``QueryBudgetMiddleware``
+    also reads it, so the numbers checked here are the ones production logs
+    against.
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        room_registry.clear()
+        archive_index.clear()
+        throttle_buckets.clear()
+        recent_messages.clear()
+
+    def create_member(self, nickname="alice", password="s3cret-pass"):
+        from django.contrib.auth.hashers import make_password
+
+        member = Member.objects.create(
+            nickname=nickname, password=make_password(password)
+        )
+        token = AuthToken.objects.create(member=member, key=secrets.token_hex(20))
+        return member, token
+
+    def authenticate(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def request(self, method, path, data=None, **extra):
+        """Issue a request and fail if it runs more queries than its budget."""
+        budget = resolve(path.split("?")[0]).func.view_class.query_budget
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format="json", **extra)
+        if len(queries) > budget:
+            statements = "\n".join(
+                f"  {index}. {query['sql']}"
+                for index, query in enumerate(queries.captured_queries, start=1)
+            )
+            self.fail(
+                f"{method.upper()} {path} ran {len(queries)} queries, over its "
+                f"budget of {budget}:\n{statements}"
+            )
+        return response
+
+
+class AuthEndpointTests(QueryBudgetTestCase):
+    def test_hello_runs_no_queries(self):
+        response = self.request("get", "/api/hello/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_register(self):
+        response = self.request(
+            "post",
+            "/api/auth/register/",
+            {"nickname": "bob", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["member"]["nickname"], "bob")
+
+    def test_login(self):
+        member, token = self.create_member()
+        response = self.request(
+            "post",
+            "/api/auth/login/",
+            {"nickname": "alice", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["token"], token.key)
+
+    def test_me(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        response = self.request("get", "/api/auth/me/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], member.id)
+
+    def test_me_honours_if_modified_since(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        last_modified = self.client.get("/api/auth/me/")["Last-Modified"]
+        response = self.client.get(
+            "/api/auth/me/", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_me_is_served_from_token_cache(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        self.client.get("/api/auth/me/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/auth/me/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_revokes_cached_token(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        self.client.get("/api/auth/me/")
+        response = self.request("post", "/api/auth/logout/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get("/api/auth/me/").status_code, 403)
+
+
+class TokenExpiryTests(QueryBudgetTestCase):
+    def age_token(self, token, seconds):
+        past = timezone.now() - timedelta(seconds=seconds)
+        AuthToken.objects.filter(pk=token.pk).update(
+            created_at=past,
+            last_used_at=past,
+            expires_at=token_expiry(past, past),
+        )
+
+    def test_expired_token_is_rejected_even_when_cached(self):
+        member, token = self.create_member()
+        expires_at = timezone.now() + timedelta(seconds=60)
+        AuthToken.objects.filter(pk=token.pk).update(expires_at=expires_at)
+        self.authenticate(token)
+        self.assertEqual(self.client.get("/api/auth/me/").status_code, 200)
+        later = expires_at + timedelta(seconds=1)
+        with mock.patch("api.authentication.timezone.now", return_value=later):
+            with self.assertNumQueries(0):
+                response = self.client.get("/api/auth/me/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_use_slides_expiry_once_per_touch_interval(self):
+        member, token = self.create_member()
+        self.age_token(token, settings.AUTH_TOKEN_TOUCH_INTERVAL + 60)
+        old_expiry = AuthToken.objects.get(pk=token.pk).expires_at
+        self.authenticate(token)
+        response = self.request("get", "/api/auth/me/")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(AuthToken.objects.get(pk=token.pk).expires_at, old_expiry)
+        with self.assertNumQueries(0):
+            self.client.get("/api/auth/me/")
+
+    def test_login_issues_new_token_when_newest_has_expired(self):
+        member, token = self.create_member()
+        self.age_token(token, settings.AUTH_TOKEN_TTL + 60)
+        response = self.request(
+            "post",
+            "/api/auth/login/",
+            {"nickname": "alice", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["token"], token.key)
+
+    def test_login_reuses_newest_token(self):
+        member, token = self.create_member()
+        self.age_token(token, 3600)
+        response = self.request(
+            "post",
+            "/api/auth/login/",
+            {"nickname": "alice", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.data["token"], token.key)
+
+    def test_login_issues_new_token_when_newest_is_near_its_ttl(self):
+        member, token = self.create_member()
+        self.age_token(token, settings.AUTH_TOKEN_TTL - 3600)
+        AuthToken.objects.filter(pk=token.pk).update(last_used_at=timezone.now())
+        response = self.request(
+            "post",
+            "/api/auth/login/",
+            {"nickname": "alice", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["token"], token.key)
+        new_token = AuthToken.objects.get(key=response.data["token"])
+        self.assertGreater(
+            new_token.expires_at,
+            timezone.now() + timedelta(seconds=settings.AUTH_TOKEN_IDLE_TTL - 60),
+        )
+
+    def test_sweeper_deletes_only_expired_tokens(self):
+        member, live = self.create_member()
+        expired = [
+            AuthToken.objects.create(member=member, key=secrets.token_hex(20))
+            for _ in range(5)
+        ]
+        for token in expired:
+            self.age_token(token, settings.AUTH_TOKEN_TTL + 60)
+        call_command("sweep_expired_tokens", batch_size=2, pause=0, stdout=StringIO())
+        self.assertEqual(list(AuthToken.objects.values_list("pk", flat=True)), [live.pk])
+
+
+class PasswordHashingTests(QueryBudgetTestCase):
+    def test_login_rehashes_outdated_password_hash(self):
+        member, token = self.create_member()
+        hasher = PBKDF2PasswordHasher()
+        member.password = hasher.encode("s3cret-pass", hasher.salt(), iterations=1000)
+        member.save(update_fields=["password"])
+        response = self.request(
+            "post",
+            "/api/auth/login/",
+            {"nickname": "alice", "password": "s3cret-pass"},
+        )
+        self.assertEqual(response.status_code, 200)
+        member.refresh_from_db()
+        self.assertEqual(
+            hasher.decode(member.password)["iterations"], hasher.iterations
+        )
+
+    @override_settings(PASSWORD_HASHER_WORKERS=0)
+    def test_login_rejected_while_hasher_is_saturated(self):
+        self.create_member()
+        slots = hasher_pool.slots
+        held = []
+        try:
+            while (index := slots.acquire(stale_after=60)) is not None:
+                held.append(index)
+            response = self.client.post(
+                "/api/auth/login/",
+                {"nickname": "alice", "password": "s3cret-pass"},
+                format="json",
+            )
+        finally:
+            for index in held:
+                slots.release(index)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    @override_settings(PASSWORD_HASHER_WORKERS=1, PASSWORD_HASHER_TIMEOUT=0.01)
+    def test_timed_out_hash_holds_its_slot_until_done(self):
+        running = Future()
+        running.set_running_or_notify_cancel()
+        executor = mock.Mock(**{"submit.return_value": running})
+        in_use = hasher_pool.in_use()
+        with mock.patch.object(hasher_pool, "_get_executor", return_value=executor):
+            with self.assertRaises(HasherBusy):
+                hasher_pool.make_password("s3cret-pass")
+        self.assertEqual(hasher_pool.in_use(), in_use + 1)
+        running.set_result("hash")
+        self.assertEqual(hasher_pool.in_use(), in_use)
+
+
+class ProfileEndpointTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+
+    def test_get(self):
+        response = self.request("get", "/api/profile/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_patch_nickname(self):
+        response = self.request("patch", "/api/profile/", {"nickname": "carol"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/api/auth/me/").data["nickname"], "carol")
+
+    def test_put(self):
+        response = self.request("put", "/api/profile/", {"nickname": "dave"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_revalidation(self):
+        etag = self.client.get("/api/profile/")["ETag"]
+        response = self.client.get("/api/profile/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.patch("/api/profile/", {"nickname": "erin"}, format="json")
+        response = self.client.get("/api/profile/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["nickname"], "erin")
+
+
+class ChatEndpointTests(QueryBudgetTestCase):
+    path = "/api/chat/messages/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        # Ids restart with every test's rolled-back transaction, so re-seed the
+        # shared latest-id counter, outside the measured requests.
+        message_notifier.reset()
+        message_notifier.latest_id(self.room.pk)
+
+    def create_messages(self, count):
+        Message.objects.bulk_create(
+            Message(room=self.room, author=self.member, text=f"message {index}")
+            for index in range(count)
+        )
+        messages = list(Message.objects.order_by("id"))
+        # bulk_create skips post_save, so announce the rows like a post would.
+        message_notifier.publish(messages[-1].id, self.room.pk)
+        return messages
+
+    def test_list(self):
+        messages = self.create_messages(60)
+        response = self.request("get", self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), MessageSerializer(messages[:50], many=True).data
+        )
+        self.assertEqual(response["X-Next-Cursor"], str(messages[49].id))
+
+    def test_list_after_id(self):
+        messages = self.create_messages(10)
+        response = self.request("get", f"{self.path}?after_id={messages[6].id}")
+        self.assertEqual(
+            [item["id"] for item in response.json()],
+            [message.id for message in messages[7:]],
+        )
+
+    def test_list_before_id_returns_newest_older_page(self):
+        messages = self.create_messages(10)
+        response = self.request(
+            "get", f"{self.path}?before_id={messages[8].id}&limit=3"
+        )
+        self.assertEqual(
+            [item["id"] for item in response.json()],
+            [message.id for message in messages[5:8]],
+        )
+        self.assertEqual(response["X-Prev-Cursor"], str(messages[5].id))
+
+    def test_caught_up_poll_skips_database(self):
+        messages = self.create_messages(3)
+        notifier = MessageNotifier(scratch_name(self))
+        notifier.latest_id(self.room.pk)
+        self.client.get(self.path)
+        with mock.patch("api.views.message_notifier", notifier):
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    f"{self.path}?after_id={messages[-1].id}&wait=0.01"
+                )
+        self.assertEqual(response.json(), [])
+
+    def test_poll_is_not_woken_by_other_rooms(self):
+        messages = self.create_messages(3)
+        other = ChatRoom.objects.create(name="Other")
+        etag = self.client.get(self.path)["ETag"]
+        path = f"{self.path}?after_id={messages[-1].id}"
+        etag_after = self.client.get(path)["ETag"]
+        elsewhere = threading.Timer(
+            0.05, message_notifier.publish, (messages[-1].id + 1, other.pk)
+        )
+        elsewhere.start()
+        self.addCleanup(elsewhere.cancel)
+        started = time.monotonic()
+        response = self.client.get(f"{path}&wait=0.5")
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+        self.assertEqual(response.json(), [])
+        self.assertEqual(response["ETag"], etag_after)
+        self.assertEqual(self.client.get(self.path)["ETag"], etag)
+
+    def test_unchanged_page_is_not_modified(self):
+        self.create_messages(3)
+        etag = self.client.get(self.path)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_new_or_deleted_message_changes_etag(self):
+        messages = self.create_messages(3)
+        etag = self.client.get(self.path)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.request("post", self.path, {"text": "hello"})
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        messages[0].delete()
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+    def test_post(self):
+        response = self.request("post", self.path, {"text": "hello"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["author"]["nickname"], "alice")
+        self.assertEqual(response.data["room_id"], self.room.id)
+
+    def test_global_room_comes_from_registry(self):
+        self.client.get(self.path)
+        with self.assertNumQueries(0):
+            self.assertEqual(room_registry.global_room(), self.room)
+
+
+class IdempotencyKeyTests(QueryBudgetTestCase):
+    path = "/api/chat/messages/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+
+    def post(self, text, key="retry-1"):
+        return self.request(
+            "post", self.path, {"text": text}, HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_first_response(self):
+        first = self.post("hello")
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", first)
+        retry = self.post("hello")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(first.json()["text"], "hello")
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(self.post("hello", key="retry-2").status_code, 201)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_reused_key_is_rejected(self):
+        self.post("hello")
+        self.assertEqual(self.post("something else").status_code, 422)
+        self.assertEqual(Message.objects.count(), 1)
+        response = self.post("hello", key="x" * 256)
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CHAT_GROUP_COMMIT_ENABLED=True)
+    def test_bypasses_group_commit(self):
+        batches = message_write_queue.batches
+        with mock.patch("api.views.chat_hub.publish") as publish:
+            first = self.post("hello")
+        self.assertEqual(message_write_queue.batches, batches)
+        publish.assert_called_once_with(first.json())
+        self.assertEqual(self.post("hello")["Idempotent-Replayed"], "true")
+
+    def test_concurrent_retry_rolls_back_its_message(self):
+        first = self.post("hello")
+        # The retry misses the key, as if the first post had not committed yet.
+        stored = _stored(self.member, "retry-1", timezone.now() - timedelta(days=1))
+        with (
+            mock.patch("api.idempotency._stored", side_effect=[None, stored]),
+            mock.patch("api.views.chat_hub.publish") as publish,
+        ):
+            retry = self.post("hello")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(Message.objects.count(), 1)
+        publish.assert_not_called()
+
+    def test_expired_keys_are_reused_and_swept(self):
+        self.post("hello")
+        self.post("other", key="retry-2")
+        old = timezone.now() - timedelta(seconds=settings.CHAT_IDEMPOTENCY_KEY_TTL + 1)
+        IdempotencyKey.objects.update(created_at=old)
+        self.assertNotIn("Idempotent-Replayed", self.post("again"))
+        self.assertEqual(Message.objects.count(), 3)
+        call_command("sweep_idempotency_keys", pause=0, stdout=StringIO())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list("key", flat=True)), ["retry-1"]
+        )
+
+
+class ChatHubTests(QueryBudgetTestCase):
+    def test_load_messages_is_limited(self):
+        member, _ = self.create_member()
+        room = ChatRoom.objects.create(name="Global chat")
+        messages = [
+            Message.objects.create(room=room, author=member, text=f"message {index}")
+            for index in range(5)
+        ]
+        loaded = _load_messages(messages[0].id, messages[-1].id, 2)
+        self.assertEqual(
+            [item["id"] for item in loaded], [message.id for message in messages[1:3]]
+        )
+
+    @override_settings(CHAT_LONG_POLL_INTERVAL=0.001, CHAT_HUB_LOAD_LIMIT=2)
+    def test_bridge_survives_failed_load_and_catches_up_in_chunks(self):
+        hub = ChatHub()
+        rows = [{"id": message_id, "room_id": 1} for message_id in (1, 2, 3)]
+
+        async def receive(count):
+            subscription = hub.subscribe()
+            try:
+                return [
+                    json.loads(await asyncio.wait_for(subscription.get(), 5))
+                    for _ in range(count)
+                ]
+            finally:
+                hub.unsubscribe(subscription)
+
+        with (
+            mock.patch(
+                "api.hub._load_messages",
+                side_effect=[RuntimeError("database is locked"), rows[:2], rows[2:]],
+            ) as load,
+            mock.patch("api.hub.message_notifier") as notifier,
+            mock.patch("api.hub.RETRY_DELAY", 0),
+            self.assertLogs("api.hub", "ERROR"),
+        ):
+            notifier.latest_id.side_effect = itertools.chain([0], itertools.repeat(3))
+            frames = asyncio.run(receive(3))
+        self.assertEqual([frame["message"]["id"] for frame in frames], [1, 2, 3])
+        self.assertEqual(
+            load.call_args_list, [mock.call(0, 3, 2)] * 2 + [mock.call(2, 3, 2)]
+        )
+
+
+class WebSocketTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.room = ChatRoom.objects.create(name="Global chat")
+
+    def connect(self, query="", headers=(), after_accept=None):
+        """Drive ``websocket_application``; returns the events it sent.
+
+        ``after_accept`` runs, on this thread, once the socket is accepted;
+        the client disconnects when it has returned and a frame was sent.
+        """
+        scope = {
+            "type": "websocket",
+            "path": CHAT_PATH,
+            "query_string": query.encode(),
+            "headers": list(headers),
+        }
+        sent = []
+
+        async def run():
+            events = [{"type": "websocket.connect"}]
+            frame = asyncio.Event()
+
+            async def receive():
+                if events:
+                    return events.pop(0)
+                if after_accept is not None:
+                    await sync_to_async(after_accept)()
+                    await asyncio.wait_for(frame.wait(), 5)
+                return {"type": "websocket.disconnect", "code": 1000}
+
+            async def send(event):
+                sent.append(event)
+                if event["type"] == "websocket.send":
+                    frame.set()
+
+            await websocket_application(scope, receive, send)
+
+        # Runs the sync_to_async calls on this thread, inside the test's
+        # transaction.
+        async_to_sync(run)()
+        return sent
+
+    def test_rejects_bad_token(self):
+        sent = self.connect(headers=[(b"authorization", b"Token nope")])
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4401}])
+
+    def test_rejects_unknown_room(self):
+        sent = self.connect(f"token={self.token.key}&room={self.room.pk + 1}")
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4404}])
+
+    def test_delivers_posted_message(self):
+        other = ChatRoom.objects.create(name="Other")
+        self.authenticate(self.token)
+
+        def post():
+            self.request(
+                "post", f"/api/chat/rooms/{other.pk}/messages/", {"text": "not here"}
+            )
+            return self.request("post", "/api/chat/messages/", {"text": "hello"})
+
+        sent = self.connect(
+            headers=[(b"authorization", f"Token {self.token.key}".encode())],
+            after_accept=post,
+        )
+        self.assertEqual(sent[0], {"type": "websocket.accept"})
+        frames = [json.loads(event["text"]) for event in sent[1:]]
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["type"], "message")
+        self.assertEqual(frames[0]["message"]["text"], "hello")
+        self.assertEqual(frames[0]["message"]["author"]["nickname"], "alice")
+
+
+class RecentMessagesTests(QueryBudgetTestCase):
+    path = "/api/chat/messages/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        message_notifier.reset()
+        message_notifier.latest_id(self.room.pk)
+
+    def post(self, text, path=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.request("post", path or self.path, {"text": text})
+        return response.json()["id"]
+
+    def poll(self, after_id, limit=50):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request("get", f"{self.path}?after_id={after_id}&limit={limit}")
+        message_queries = [q for q in queries if "api_message" in q["sql"]]
+        return response, message_queries
+
+    def test_poll_is_served_from_ring(self):
+        ids = [self.post(f"message {index}") for index in range(4)]
+        response, message_queries = self.poll(ids[0], limit=2)
+        self.assertEqual(message_queries, [])
+        self.assertEqual([item["id"] for item in response.json()], ids[1:3])
+        self.assertEqual(response["X-Next-Cursor"], str(ids[2]))
+        with override_settings(CHAT_RECENT_MESSAGES=0):
+            from_database, message_queries = self.poll(ids[0], limit=2)
+        self.assertTrue(message_queries)
+        self.assertEqual(response.content, from_database.content)
+        self.assertEqual(response["Link"], from_database["Link"])
+        self.assertEqual(recent_messages.stats(), (1, 0))
+
+    def test_other_rooms_are_skipped(self):
+        other = ChatRoom.objects.create(name="Other")
+        first = self.post("here")
+        self.post("there", f"/api/chat/rooms/{other.pk}/messages/")
+        last = self.post("here again")
+        response, message_queries = self.poll(first)
+        self.assertEqual(message_queries, [])
+        self.assertEqual([item["id"] for item in response.json()], [last])
+
+    def test_gap_falls_back_to_database(self):
+        first = self.post("posted")
+        # bulk_create skips the signal that fills the ring, as seed_data does.
+        (created,) = Message.objects.bulk_create(
+            [Message(room=self.room, author=self.member, text="bulk loaded")]
+        )
+        last = self.post("posted again")
+        response, message_queries = self.poll(first)
+        self.assertTrue(message_queries)
+        self.assertEqual(
+            [item["id"] for item in response.json()], [created.id, last]
+        )
+        self.assertEqual(recent_messages.stats(), (0, 1))
+
+    def test_deletion_invalidates_ring(self):
+        ids = [self.post(f"message {index}") for index in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(pk=ids[1]).delete()
+        response, message_queries = self.poll(ids[0])
+        self.assertTrue(message_queries)
+        self.assertEqual([item["id"] for item in response.json()], [ids[2]])
+        last = self.post("after the deletion")
+        response, message_queries = self.poll(ids[2])
+        self.assertEqual(message_queries, [])
+        self.assertEqual([item["id"] for item in response.json()], [last])
+
+    def test_rename_invalidates_ring(self):
+        first = self.post("before the rename")
+        last = self.post("also before the rename")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.request("patch", "/api/profile/", {"nickname": "alice2"})
+        self.assertEqual(response.status_code, 200)
+        response, message_queries = self.poll(first)
+        self.assertTrue(message_queries)
+        self.assertEqual(
+            [item["author"]["nickname"] for item in response.json()], ["alice2"]
+        )
+        self.assertEqual([item["id"] for item in response.json()], [last])
+
+
+class ChatRoomEndpointTests(QueryBudgetTestCase):
+    path = "/api/chat/rooms/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        self.other = ChatRoom.objects.create(name="Random")
+        message_notifier.reset()
+        message_notifier.latest_id(self.room.pk)
+
+    def messages_path(self, room):
+        return f"/api/chat/rooms/{room.id}/messages/"
+
+    def test_list_is_cached(self):
+        response = self.request("get", self.path)
+        self.assertEqual(
+            [room["name"] for room in response.json()], ["Global chat", "Random"]
+        )
+        with self.assertNumQueries(0):  # the token lookup is cached too
+            self.client.get(self.path)
+
+    def test_create_room_is_listed(self):
+        response = self.request("post", self.path, {"name": "Off-topic"})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(
+            "Off-topic", [room["name"] for room in self.client.get(self.path).json()]
+        )
+
+    def test_messages_are_scoped_to_room(self):
+        self.request("post", self.messages_path(self.other), {"text": "psst"})
+        self.request("post", "/api/chat/messages/", {"text": "hello all"})
+        response = self.request("get", self.messages_path(self.other))
+        self.assertEqual([item["text"] for item in response.json()], ["psst"])
+        self.assertEqual(response.json()[0]["room_id"], self.other.id)
+        response = self.request("get", "/api/chat/messages/")
+        self.assertEqual([item["text"] for item in response.json()], ["hello all"])
+
+    def test_unknown_room(self):
+        response = self.request("get", "/api/chat/rooms/999999/messages/")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CHAT_READ_CURSOR_FLUSH_INTERVAL=0)
+class ReadCursorTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        read_cursors.clear()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        self.other = ChatRoom.objects.create(name="Random")
+        self.author, _ = self.create_member("bob")
+
+    def post(self, room, count):
+        return [
+            Message.objects.create(room=room, author=self.author, text=f"m{index}")
+            for index in range(count)
+        ]
+
+    def unread(self):
+        response = self.request("get", "/api/chat/unread/")
+        self.assertEqual(response.status_code, 200)
+        return {item["room_id"]: item["unread_count"] for item in response.json()}
+
+    def test_trigger_numbers_messages_per_room(self):
+        self.post(self.room, 2)
+        self.post(self.other, 1)
+        # Group commit inserts with bulk_create, which the trigger covers too.
+        Message.objects.bulk_create(
+            Message(room=self.room, author=self.author, text=f"bulk {index}")
+            for index in range(3)
+        )
+        self.assertEqual(
+            list(
+                Message.objects.filter(room=self.room).values_list("seq", flat=True)
+            ),
+            [1, 2, 3, 4, 5],
+        )
+        self.room.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.room.last_seq, self.other.last_seq), (5, 1))
+
+    def test_saving_a_stale_room_keeps_last_seq(self):
+        stale = ChatRoom.objects.get(pk=self.room.pk)
+        self.post(self.room, 3)
+        stale.name = "Lobby"
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual((stale.name, stale.last_seq), ("Lobby", 3))
+
+    def test_unread_counts(self):
+        messages = self.post(self.room, 5)
+        self.post(self.other, 2)
+        self.assertEqual(self.unread(), {self.room.id: 5, self.other.id: 2})
+        response = self.request(
+            "put", "/api/chat/cursor/", {"last_read_id": messages[2].id}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {"room_id": self.room.id, "last_read_id": messages[2].id, "unread_count": 2},
+        )
+        self.assertEqual(self.unread(), {self.room.id: 2, self.other.id: 2})
+        self.post(self.room, 1)
+        self.assertEqual(self.unread()[self.room.id], 3)
+
+    def test_unread_counts_do_not_count_messages(self):
+        self.post(self.room, 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.unread()
+        self.assertFalse(
+            any("COUNT(" in query["sql"].upper() for query in queries.captured_queries)
+        )
+
+    def test_cursor_never_moves_backwards(self):
+        messages = self.post(self.other, 4)
+        path = f"/api/chat/rooms/{self.other.id}/cursor/"
+        self.request("put", path, {"last_read_id": messages[3].id})
+        response = self.request("put", path, {"last_read_id": messages[0].id})
+        self.assertEqual(response.json()["last_read_id"], messages[3].id)
+        self.assertEqual(response.json()["unread_count"], 0)
+        cursor = ReadCursor.objects.get(member=self.member, room=self.other)
+        self.assertEqual((cursor.last_read_id, cursor.last_read_seq), (messages[3].id, 4))
+
+    def test_cursor_past_the_newest_message(self):
+        messages = self.post(self.room, 2)
+        response = self.request("put", "/api/chat/cursor/", {"last_read_id": 10**9})
+        self.assertEqual(response.json()["last_read_id"], messages[1].id)
+        self.assertEqual(response.json()["unread_count"], 0)
+
+    def test_cursor_validation(self):
+        response = self.request("put", "/api/chat/cursor/", {"last_read_id": -1})
+        self.assertEqual(response.status_code, 400)
+        response = self.request(
+            "put", "/api/chat/rooms/999999/cursor/", {"last_read_id": 1}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CHAT_READ_CURSOR_FLUSH_INTERVAL=3600)
+    def test_updates_are_coalesced(self):
+        messages = self.post(self.room, 20)
+        writes = read_cursors.writes
+        with mock.patch.object(read_cursors, "_ensure_flusher"):
+            for message in messages[:10]:
+                response = self.request(
+                    "put", "/api/chat/cursor/", {"last_read_id": message.id}
+                )
+        self.assertEqual(response.json()["unread_count"], 10)
+        self.assertFalse(ReadCursor.objects.exists())
+        # Pending cursors already count for this worker's reads.
+        self.assertEqual(self.unread()[self.room.id], 10)
+        read_cursors.flush()
+        self.assertEqual(read_cursors.writes, writes + 1)
+        cursor = ReadCursor.objects.get()
+        self.assertEqual((cursor.last_read_id, cursor.last_read_seq), (messages[9].id, 10))
+
+
+class MessageSearchTests(QueryBudgetTestCase):
+    path = "/api/chat/search/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        self.other = ChatRoom.objects.create(name="Random")
+
+    def post(self, text, room=None):
+        return Message.objects.create(
+            room=room or self.room, author=self.member, text=text
+        )
+
+    def search(self, query, **params):
+        response = self.request("get", self.path, {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_finds_words_with_snippets(self):
+        self.post("lunch at noon?")
+        match = self.post("Deploying the <new> release after lunch")
+        response = self.search("release")
+        self.assertEqual([item["id"] for item in response.json()], [match.id])
+        item = response.json()[0]
+        self.assertEqual(item["author"]["nickname"], "alice")
+        self.assertEqual(item["room_id"], self.room.id)
+        self.assertIn("&lt;new&gt; <mark>release</mark>", item["snippet"])
+
+    def test_rejects_ids_out_of_range(self):
+        self.post("release notes")
+        for name in ("before_id", "offset", "room_id"):
+            response = self.request("get", self.path, {"q": "release", name: "9" * 23})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(name, response.json())
+        response = self.request(
+            "get", "/api/chat/messages/", {"after_id": "-" + "9" * 23}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_ranks_and_filters(self):
+        once = self.post("coffee later")
+        twice = self.post("coffee coffee coffee")
+        elsewhere = self.post("coffee", room=self.other)
+        self.post("tea")
+        response = self.search("coffee")
+        self.assertEqual(
+            [item["id"] for item in response.json()][:2], [twice.id, elsewhere.id]
+        )
+        self.assertIn(once.id, [item["id"] for item in response.json()])
+        response = self.search("coffee", room_id=self.other.id)
+        self.assertEqual([item["id"] for item in response.json()], [elsewhere.id])
+
+    def test_matches_whole_words_ignoring_case_and_accents(self):
+        match = self.post("Café opens at nine")
+        self.post("deployment finished")
+        response = self.search("CAFE")
+        self.assertEqual([item["id"] for item in response.json()], [match.id])
+        self.assertIn("<mark>Café</mark>", response.json()[0]["snippet"])
+        self.assertEqual(self.search("deploy").json(), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.post("hello world")
+        for query in ['"', "hello AND", "NEAR(hello", "*", "hello OR -world", "a_b"]:
+            self.search(query)
+        self.assertEqual(len(self.search("hello OR").json()), 0)
+        response = self.request("get", self.path)
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_share_a_window(self):
+        messages = [self.post(f"standup notes {index}") for index in range(5)]
+        response = self.search("standup", limit=2)
+        first = [item["id"] for item in response.json()]
+        self.assertIn(f"before_id={messages[-1].id + 1}", response["Link"])
+        self.post("standup moved")
+        next_page = response["Link"].split(";")[0].strip("<>")
+        next_page = next_page.removeprefix("http://testserver")
+        second = [item["id"] for item in self.request("get", next_page).json()]
+        self.assertEqual(len(second), 2)
+        self.assertFalse(set(first) & set(second))
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.post("typo here")
+        message.text = "fixed here"
+        message.save()
+        self.assertEqual(self.search("typo").json(), [])
+        self.assertEqual(len(self.search("fixed").json()), 1)
+        message.delete()
+        self.assertEqual(self.search("fixed").json(), [])
+
+    def test_backfill_indexes_existing_messages(self):
+        message = self.post("backfilled words")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO api_message_fts (api_message_fts) VALUES ('delete-all')"
+            )
+        self.assertEqual(self.search("backfilled").json(), [])
+        out = StringIO()
+        call_command("backfill_search_index", "--pause=0", stdout=out)
+        self.assertIn("Indexed 1 messages", out.getvalue())
+        response = self.search("backfilled")
+        self.assertEqual([item["id"] for item in response.json()], [message.id])
+        call_command("backfill_search_index", "--pause=0", "--optimize", stdout=out)
+        self.assertIn("Indexed 0 messages", out.getvalue())
+
+
+class MessageArchiveTests(QueryBudgetTestCase):
+    path = "/api/chat/messages/"
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_root = override_settings(CHAT_ARCHIVE_ROOT=Path(directory.name))
+        archive_root.enable()
+        self.addCleanup(archive_root.disable)
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        Message.objects.bulk_create(
+            Message(room=self.room, author=self.member, text=f"message {index}")
+            for index in range(10)
+        )
+        self.ids = list(Message.objects.values_list("id", flat=True))
+        # The oldest six are past retention and span two months.
+        now = timezone.now()
+        Message.objects.filter(id__in=self.ids[:3]).update(
+            created_at=now - timedelta(days=400)
+        )
+        Message.objects.filter(id__in=self.ids[3:6]).update(
+            created_at=now - timedelta(days=200)
+        )
+        message_notifier.reset()
+        message_notifier.latest_id()
+
+    def archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "archive_messages", days=90, batch_size=2, pause=0, stdout=StringIO()
+            )
+
+    def ids_of(self, response):
+        return [item["id"] for item in response.json()]
+
+    def test_old_messages_move_to_segments(self):
+        self.archive()
+        self.assertEqual(
+            list(Message.objects.values_list("id", flat=True)), self.ids[6:]
+        )
+        segments = list(MessageArchiveSegment.objects.all())
+        self.assertEqual(
+            [(segment.first_id, segment.last_id) for segment in segments],
+            [(self.ids[0], self.ids[2]), (self.ids[3], self.ids[5])],
+        )
+        for segment in segments:
+            self.assertTrue((settings.CHAT_ARCHIVE_ROOT / segment.path).is_file())
+        self.archive()
+        self.assertEqual(MessageArchiveSegment.objects.count(), 2)
+
+    def test_history_reads_archived_ranges(self):
+        before = self.client.get(self.path).json()
+        self.archive()
+        self.assertEqual(self.request("get", self.path).json(), before)
+        response = self.request("get", f"{self.path}?before_id={self.ids[7]}&limit=4")
+        self.assertEqual(self.ids_of(response), self.ids[3:7])
+        response = self.request("get", f"{self.path}?after_id={self.ids[1]}&limit=3")
+        self.assertEqual(self.ids_of(response), self.ids[2:5])
+
+    def test_archived_authors_follow_nickname_changes(self):
+        self.archive()
+        Member.objects.filter(pk=self.member.pk).update(nickname="alicia")
+        response = self.client.get(f"{self.path}?limit=1")
+        self.assertEqual(response.json()[0]["author"]["nickname"], "alicia")
+
+    def test_interrupted_run_deletes_archived_rows(self):
+        self.archive()
+        Message.objects.create(
+            id=self.ids[0], room=self.room, author=self.member, text="leftover"
+        )
+        self.archive()
+        self.assertEqual(
+            list(Message.objects.values_list("id", flat=True)), self.ids[6:]
+        )
+
+
+@override_settings(
+    API_THROTTLE_ENABLED=True,
+    API_THROTTLE_RATES={
+        "chat_post.member": "2/min",
+        "chat_post.ip": "4/min",
+        "login.member": "1/min",
+    },
+)
+class ThrottleTests(QueryBudgetTestCase):
+    path = "/api/chat/messages/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        ChatRoom.objects.create(name="Global chat")
+
+    def post(self, token, **extra):
+        self.authenticate(token)
+        return self.request("post", self.path, {"text": "hi"}, **extra)
+
+    def test_member_bucket(self):
+        self.assertEqual(self.post(self.token).status_code, 201)
+        self.assertEqual(self.post(self.token).status_code, 201)
+        response = self.post(self.token)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(self.request("get", self.path).status_code, 200)
+        other, other_token = self.create_member("bob")
+        self.assertEqual(self.post(other_token).status_code, 201)
+        # Rejected attempts count too, so the IP bucket (4/min) is now empty
+        # for everyone behind that address...
+        self.assertEqual(self.post(other_token).status_code, 429)
+        # ...not even when the client sends its own X-Forwarded-For...
+        _, third_token = self.create_member("carol")
+        response = self.post(third_token, HTTP_X_FORWARDED_FOR="203.0.113.7")
+        self.assertEqual(response.status_code, 429)
+        # ...but not for another client address, as nginx reports it.
+        response = self.post(third_token, HTTP_X_REAL_IP="203.0.113.7")
+        self.assertEqual(response.status_code, 201)
+
+    def test_login_is_limited_per_nickname(self):
+        from django.contrib.auth.hashers import make_password
+
+        Member.objects.filter(pk=self.member.pk).update(
+            password=make_password("s3cret-pass")
+        )
+        body = {"nickname": "alice", "password": "wrong"}
+        self.assertEqual(self.request("post", "/api/auth/login/", body).status_code, 400)
+        response = self.request(
+            "post", "/api/auth/login/", body, HTTP_X_REAL_IP="203.0.113.8"
+        )
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(API_THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(4):
+            self.assertEqual(self.post(self.token).status_code, 201)
+
+    def test_bucket_refills_and_evicts(self):
+        buckets = SharedBuckets(scratch_name(self), 4)
+        self.assertEqual(buckets.take("a", 2, 1.0, now=100.0), 0.0)
+        self.assertEqual(buckets.take("a", 2, 1.0, now=100.0), 0.0)
+        self.assertEqual(buckets.take("a", 2, 1.0, now=100.5), 0.5)
+        self.assertEqual(buckets.take("a", 2, 1.0, now=101.0), 0.0)
+        # More keys than slots: the least recently used bucket is reused.
+        for index in range(8):
+            self.assertEqual(buckets.take(f"key-{index}", 1, 1.0, now=102.0), 0.0)
+
+
+class SeedDataTests(TestCase):
+    def test_seeds_members_tokens_and_dated_messages(self):
+        message_notifier.reset()
+        with tempfile.NamedTemporaryFile("r") as tokens_file:
+            call_command(
+                "seed_data",
+                members=5,
+                messages=25,
+                rooms=1,
+                batch_size=10,
+                days=10,
+                tokens_file=tokens_file.name,
+                stdout=StringIO(),
+            )
+            seed = json.load(tokens_file)
+        self.assertEqual(Member.objects.count(), 5)
+        self.assertEqual(len(seed["rooms"]), 2)
+        member = seed["members"][0]
+        self.assertTrue(
+            AuthToken.objects.filter(
+                key=member["token"], member__nickname=member["nickname"]
+            ).exists()
+        )
+        client = APIClient()
+        response = client.post(
+            "/api/auth/login/",
+            {"nickname": member["nickname"], "password": seed["password"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        dates = list(Message.objects.values_list("created_at", flat=True))
+        self.assertEqual(len(dates), 25)
+        self.assertEqual(dates, sorted(dates))
+        self.assertLess(dates[0], timezone.now() - timedelta(days=9))
+        self.assertEqual(message_notifier.latest_id(), Message.objects.last().id)
+
+
+class QueryBudgetMiddlewareTests(QueryBudgetTestCase):
+    @override_settings(SQL_BUDGET_HEADERS=True)
+    def test_reports_sql_headers(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        response = self.client.get("/api/auth/me/")
+        self.assertEqual(response["X-SQL-Queries"], "1")
+        self.assertIn("X-SQL-Time-Ms", response)
+
+    def test_logs_requests_over_budget(self):
+        member, token = self.create_member()
+        self.authenticate(token)
+        with mock.patch.object(MeView, "query_budget", 0):
+            with self.assertLogs("api.sql", level="WARNING") as logs:
+                self.client.get("/api/auth/me/")
+        self.assertIn("ran 1 queries (budget 0)", logs.output[0])
+
+
+@override_settings(METRICS_TOKEN="scrape-token")
+class MetricsTests(QueryBudgetTestCase):
+    path = "/api/metrics/"
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def scrape(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer scrape-token")
+        response = self.request("get", self.path)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()
+
+    def test_records_requests(self):
+        member, token = self.create_member()
+        self.client.get("/api/hello/")
+        self.client.get("/api/hello/")
+        self.authenticate(token)
+        self.client.get("/api/auth/me/")
+        lines = self.scrape()
+        self.assertIn('api_requests_total{view="hello",method="GET",status="200"} 2', lines)
+        self.assertIn('api_request_duration_seconds_count{view="hello"} 2', lines)
+        self.assertIn(
+            'api_request_duration_seconds_bucket{view="hello",le="+Inf"} 2', lines
+        )
+        self.assertIn('api_db_queries_total{view="auth-me"} 1', lines)
+        self.assertIn("# TYPE api_request_duration_seconds histogram", lines)
+        self.assertIn("api_auth_token_cache_misses_total 1", lines)
+
+    def test_sums_workers_and_keeps_exited_ones(self):
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        series = 'api_requests_total{view="hello",method="GET",status="200"}'
+        with mock.patch("api.shm.os.getpid", return_value=exited.pid):
+            worker = ProcessValues(metrics.values.prefix, 16)
+            worker.update([(series, 3)], [("api_workers", 1)])
+            worker.close()
+        totals = metrics.collect()
+        self.assertEqual(totals[series], 3)
+        self.assertNotIn("api_workers", totals)
+        metrics.collect_worker(exited.pid)
+        self.assertEqual(
+            ProcessValues.files(metrics.values.prefix).keys(), {os.getpid()}
+        )
+        totals = metrics.collect()
+        self.assertEqual(totals[series], 3)
+        self.assertNotIn("api_workers", totals)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(self.path).status_code, 403)
+        response = self.client.get(self.path, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_refused_without_a_token_configured(self):
+        response = self.client.get(self.path, HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(response.status_code, 403)
+
+
+class BatchTests(QueryBudgetTestCase):
+    path = "/api/batch/"
+
+    def setUp(self):
+        super().setUp()
+        self.member, self.token = self.create_member()
+        self.authenticate(self.token)
+        self.room = ChatRoom.objects.create(name="Global chat")
+        message_notifier.reset()
+        message_notifier.latest_id(self.room.pk)
+
+    def batch(self, *entries, **extra):
+        return self.client.post(
+            self.path, {"requests": list(entries)}, format="json", **extra
+        )
+
+    def test_bootstrap_authenticates_once(self):
+        self.client.post("/api/chat/messages/", {"text": "hi"}, format="json")
+        paths = ["/api/auth/me/", "/api/profile/", "/api/chat/messages/?limit=5"]
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as separate:
+            expected = [self.client.get(path) for path in paths]
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as batched:
+            response = self.batch(*({"path": path} for path in paths))
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["responses"]
+        self.assertEqual([result["status"] for result in results], [200] * 3)
+        for result, single in zip(results, expected):
+            self.assertEqual(result["body"], single.json())
+            self.assertEqual(result["headers"].get("ETag"), single.get("ETag"))
+        token_lookups = [
+            query for query in batched.captured_queries if "api_authtoken" in query["sql"]
+        ]
+        self.assertEqual(len(token_lookups), 1)
+        self.assertLessEqual(len(batched), len(separate))
+        self.assertNotIn(ReadReplicaMiddleware.cookie_name, response.cookies)
+
+    def test_writes_run_in_order(self):
+        response = self.batch(
+            {"method": "POST", "path": "/api/chat/messages/", "body": {"text": "hey"}},
+            {"path": "/api/chat/messages/"},
+            {"method": "POST", "path": "/api/chat/messages/", "body": {"text": ""}},
+        )
+        created, listed, invalid = response.json()["responses"]
+        self.assertEqual(created["status"], 201)
+        self.assertEqual(listed["body"], [created["body"]])
+        self.assertEqual(invalid["status"], 400)
+        self.assertIn(ReadReplicaMiddleware.cookie_name, response.cookies)
+
+    def test_logout_ends_shared_credentials(self):
+        response = self.batch(
+            {"method": "POST", "path": "/api/auth/logout/"},
+            {"path": "/api/auth/me/"},
+        )
+        self.assertEqual(response.status_code, 200)
+        standalone = self.client.get("/api/auth/me/")
+        self.assertEqual(
+            [result["status"] for result in response.json()["responses"]],
+            [204, standalone.status_code],
+        )
+        self.assertIn(standalone.status_code, (401, 403))
+
+    def test_sub_request_headers(self):
+        etag = self.client.get("/api/auth/me/")["ETag"]
+        response = self.batch(
+            {"path": "/api/auth/me/", "headers": {"If-None-Match": etag}}
+        )
+        result = response.json()["responses"][0]
+        self.assertEqual(result["status"], 304)
+        self.assertIsNone(result["body"])
+        for name in ("Authorization", "X-Forwarded-For", "X-Real-IP"):
+            response = self.batch(
+                {"path": "/api/auth/me/", "headers": {name: "203.0.113.9"}}
+            )
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(API_THROTTLE_RATES={"register.ip": "2/hour"})
+    def test_sub_requests_share_the_batch_address(self):
+        response = self.batch(
+            *(
+                {
+                    "method": "POST",
+                    "path": "/api/auth/register/",
+                    "body": {"nickname": f"user{index}", "password": "s3cret-pass"},
+                }
+                for index in range(3)
+            )
+        )
+        statuses = [result["status"] for result in response.json()["responses"]]
+        self.assertEqual(statuses, [201, 201, 429])
+
+    def test_rejects_unknown_nested_and_too_many(self):
+        response = self.batch(
+            {"path": "/admin/"}, {"path": "/api/nowhere/"}, {"path": self.path}
+        )
+        statuses = [result["status"] for result in response.json()["responses"]]
+        self.assertEqual(statuses, [404, 404, 400])
+        with override_settings(API_BATCH_MAX_REQUESTS=2):
+            response = self.batch(*({"path": "/api/hello/"} for _ in range(3)))
+        self.assertEqual(response.status_code, 400)
+        self.client.credentials()
+        self.assertEqual(self.batch({"path": "/api/hello/"}).status_code, 403)
+
+
+@override_settings(CHAT_GROUP_COMMIT_ENABLED=True, CHAT_GROUP_COMMIT_WINDOW_MS=50)
+class GroupCommitTests(TransactionTestCase):
+    def test_concurrent_posts_share_one_transaction(self):
+        member = Member.objects.create(nickname="alice", password="!")
+        token = AuthToken.objects.create(member=member, key=secrets.token_hex(20))
+        ChatRoom.objects.create(name="Global chat")
+        batches = message_write_queue.batches
+        results = [None] * 5
+        barrier = threading.Barrier(len(results))
+
+        def post(index):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+            barrier.wait()
+            results[index] = client.post(
+                "/api/chat/messages/", {"text": f"message {index}"}, format="json"
+            )
+            connection.close()
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(message_write_queue.batches, batches + 1)
+        for index, response in enumerate(results):
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data["text"], f"message {index}")
+            stored = Message.objects.get(pk=response.data["id"])
+            self.assertEqual(stored.text, f"message {index}")
+        self.assertEqual(Message.objects.count(), 5)
+
+
+class LongPollTests(TransactionTestCase):
+    path = "/api/chat/messages/"
+
+    def test_parked_poll_returns_message_posted_meanwhile(self):
+        member = Member.objects.create(nickname="alice", password="!")
+        token = AuthToken.objects.create(member=member, key=secrets.token_hex(20))
+        room = ChatRoom.objects.create(name="Global chat")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        first = client.post(self.path, {"text": "first"}, format="json").data["id"]
+        results = {}
+
+        def poll():
+            poller_client = APIClient()
+            poller_client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+            started = time.monotonic()
+            results["response"] = poller_client.get(
+                f"{self.path}?after_id={first}&wait=5"
+            )
+            results["elapsed"] = time.monotonic() - started
+            connection.close()
+
+        message_notifier.reset()
+        message_notifier.latest_id(room.pk)
+        poller = threading.Thread(target=poll)
+        poller.start()
+        time.sleep(0.2)
+        second = client.post(self.path, {"text": "second"}, format="json").data["id"]
+        poller.join()
+
+        self.assertEqual(results["response"].status_code, 200)
+        self.assertEqual([item["id"] for item in results["response"].json()], [second])
+        self.assertGreaterEqual(results["elapsed"], 0.2)
+        self.assertLess(results["elapsed"], 5)
+
+
+class ReadReplicaRoutingTests(SimpleTestCase):
+    def route(self, request):
+        seen = {}
+
+        def get_response(request):
+            seen["db"] = router.db_for_read(Member)
+            return HttpResponse(status=201 if request.method == "POST" else 200)
+
+        with mock.patch("api.routers.replica_available", return_value=True):
+            response = ReadReplicaMiddleware(get_response)(request)
+        return seen["db"], response
+
+    def test_safe_requests_read_from_replica(self):
+        db, response = self.route(RequestFactory().get("/api/auth/me/"))
+        self.assertEqual(db, "replica")
+        self.assertEqual(router.db_for_write(Member), "default")
+
+    def test_writes_pin_client_to_primary(self):
+        db, response = self.route(RequestFactory().post("/api/chat/messages/"))
+        self.assertEqual(db, "default")
+        cookie = response.cookies[ReadReplicaMiddleware.cookie_name]
+        self.assertEqual(cookie["max-age"], settings.DATABASE_READ_STICKY_SECONDS)
+
+        request = RequestFactory().get("/api/chat/messages/")
+        request.COOKIES[ReadReplicaMiddleware.cookie_name] = "1"
+        db, response = self.route(request)
+        self.assertEqual(db, "default")
+
+
+class WarmupTests(SimpleTestCase):
+    def test_every_pool_thread_gets_a_warm_connection(self):
+        warmed = set()
+        with mock.patch(
+            "api.warmup.warm_database",
+            side_effect=lambda: warmed.add(threading.get_ident()),
+        ):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                warm_up_threads(executor, 4)
+        self.assertEqual(len(warmed), 4)
+
+
+@skipUnless(settings.API_LEAN_MIDDLEWARE, "lean API middleware profile disabled")
+class LeanMiddlewareTests(APITestCase):
+    def test_api_requests_skip_session_and_messages(self):
+        response = self.client.get("/api/hello/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, "session"))
+        self.assertFalse(hasattr(response.wsgi_request, "_messages"))
+
+    def test_admin_keeps_sessions_and_csrf(self):
+        response = self.client.get("/admin/login/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, "session"))
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class ChatAdminTests(TestCase):
+    path = "/admin/api/message/"
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "pass")
+        )
+        self.member = Member.objects.create(nickname="alice", password="!")
+        self.room = ChatRoom.objects.create(name="Global chat")
+        self.messages = Message.objects.bulk_create(
+            Message(room=self.room, author=self.member, text=f"message {index}")
+            for index in range(5)
+        )
+
+    def test_changelist_pages_by_id_without_counting(self):
+        with mock.patch.object(MessageAdmin, "list_per_page", 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.path)
+            cl = response.context["cl"]
+            self.assertEqual(
+                [message.id for message in cl.result_list],
+                [message.id for message in self.messages[:2:-1]],
+            )
+            self.assertEqual(cl.result_count, 5)
+            older = self.client.get(self.path + cl.older_url)
+        self.assertEqual(
+            [message.id for message in older.context["cl"].result_list],
+            [message.id for message in self.messages[2:0:-1]],
+        )
+        message_sql = [q["sql"] for q in queries if "api_message" in q["sql"]]
+        self.assertFalse(any("COUNT(" in sql or "OFFSET" in sql for sql in message_sql))
+
+    def test_search_uses_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/api/member/", {"q": "ali"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.member])
+        self.assertFalse(any(" LIKE " in q["sql"] for q in queries))
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(
+                room=self.room, author=self.member, text="Déploiement réussi"
+            )
+        response = self.client.get(self.path, {"q": "deploiement"})
+        self.assertEqual(list(response.context["cl"].result_list), [message])
@@ -0,0 +1,103 @@
+"""Token-bucket throttles for the endpoints that write or hash passwords.
+
+A view opts in with a ``throttle_scope``; ``API_THROTTLE_RATES`` then maps
+``"<scope>.member"`` and ``"<scope>.ip"`` to DRF-style rates such as
+``"30/min"``: a bucket of 30 requests that refills at 30 per minute. Buckets
+live in a memory-mapped table shared by every worker (``SharedBuckets``), so
+a client cannot multiply its allowance by landing on different workers.
+Reads are never throttled.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from .shm import SharedBuckets
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """``"30/min"`` -> (capacity 30, refill of 0.5 tokens per second)."""
+    count, period = rate.split("/")
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+class ThrottleBuckets:
+    def __init__(self, name="api_throttle_buckets"):
+        self.name = name
+        self._buckets = None
+
+    @property
+    def buckets(self):
+        # Sized from settings on first use, after they are configured.
+        if self._buckets is None:
+            self._buckets = SharedBuckets(self.name, settings.API_THROTTLE_TABLE_SIZE)
+        return self._buckets
+
+    def take(self, key, rate):
+        capacity, per_second = parse_rate(rate)
+        return self.buckets.take(key, capacity, per_second)
+
+    def clear(self):
+        self.buckets.clear()
+
+
+throttle_buckets = ThrottleBuckets()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    kind = None
+
+    def get_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.delay = 0.0
+        if not settings.API_THROTTLE_ENABLED or request.method in SAFE_METHODS:
+            return True
+        scope = getattr(view, "throttle_scope", None)
+        rate = settings.API_THROTTLE_RATES.get(f"{scope}.{self.kind}")
+        if rate is None:
+            return True
+        key = self.get_key(request)
+        if key is None:
+            return True
+        self.delay = throttle_buckets.take(f"{scope}.{self.kind}:{key}", rate)
+        return self.delay == 0.0
+
+    def wait(self):
+        return self.delay
+
+
+class MemberRateThrottle(TokenBucketThrottle):
+    """Per member; for anonymous requests, per nickname they act on (login)."""
+
+    kind = "member"
+
+    def get_key(self, request):
+        if request.user.is_authenticated:
+            return f"id:{request.user.pk}"
+        nickname = request.data.get("nickname") if hasattr(request.data, "get") else None
+        if isinstance(nickname, str) and nickname:
+            return f"nickname:{nickname}"
+        return None
+
+
+class IPRateThrottle(TokenBucketThrottle):
+    """Per client address, as nginx reports it in ``API_THROTTLE_IP_HEADER``."""
+
+    kind = "ip"
+
+    def get_key(self, request):
+        if not settings.API_THROTTLE_IP_HEADER:
+            return self.get_ident(request)
+        # Without the header the request did not come through nginx; its
+        # X-Forwarded-For is then whatever the client sent.
+        return request.headers.get(
+            settings.API_THROTTLE_IP_HEADER, request.META.get("REMOTE_ADDR")
+        )
@@ -1,12 +1,42 @@
 from django.urls import path
-from .views import HelloView, RegisterView, LoginView, MeView, LogoutView, ChatMessageListCreateView, ProfileView
+from .views import (
+    BatchView,
+    HelloView,
+    MetricsView,
+    RegisterView,
+    LoginView,
+    MeView,
+    LogoutView,
+    ChatMessageListCreateView,
+    ChatRoomListView,
+    ChatReadCursorView,
+    ChatUnreadView,
+    ChatSearchView,
+    ProfileView,
+)
 
 urlpatterns = [
     path("hello/", HelloView.as_view(), name="hello"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
+    path("batch/", BatchView.as_view(), name="batch"),
     path("auth/register/", RegisterView.as_view(), name="auth-register"),
     path("auth/login/", LoginView.as_view(), name="auth-login"),
     path("auth/me/", MeView.as_view(), name="auth-me"),
     path("auth/logout/", LogoutView.as_view(), name="auth-logout"),
     path("chat/messages/", ChatMessageListCreateView.as_view(), name="chat-messages"),
+    path("chat/rooms/", ChatRoomListView.as_view(), name="chat-rooms"),
+    path(
+        "chat/rooms/<int:room_id>/messages/",
+        ChatMessageListCreateView.as_view(),
+        name="chat-room-messages",
+    ),
+    path("chat/cursor/", ChatReadCursorView.as_view(), name="chat-cursor"),
+    path(
+        "chat/rooms/<int:room_id>/cursor/",
+        ChatReadCursorView.as_view(),
+        name="chat-room-cursor",
+    ),
+    path("chat/unread/", ChatUnreadView.as_view(), name="chat-unread"),
+    path("chat/search/", ChatSearchView.as_view(), name="chat-search"),
     path("profile/", ProfileView.as_view(), name="profile"),
 ]
@@ -1,11 +1,25 @@
-from django.utils import timezone
 import secrets
-from drf_spectacular.utils import extend_schema
+from urllib.parse import urlencode
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import permissions, status
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import AuthToken, ChatRoom, Message
+from .models import ChatRoom, Message
 from .serializers import (
+    BatchResponseSerializer,
+    BatchSerializer,
+    ChatRoomSerializer,
     HelloMessageSerializer,
     MemberRegistrationSerializer,
     MemberSerializer,
@@ -14,11 +28,30 @@ from .serializers import (
     MessageSerializer,
     MessageCreateSerializer,
     ProfileSerializer,
+    ReadCursorSerializer,
+)
+from .authentication import (
+    TokenAuthentication,
+    issue_token,
+    login_token,
+    token_cache,
 )
-from .authentication import TokenAuthentication
+from . import metrics
+from .archive import archive_index, archived_messages
+from .batch import batch_query_budget, dispatch, resolve_entries
+from .cursors import mark_read, unread_counts
+from .fastpath import message_rows, render_json
+from .hub import chat_hub
+from .idempotency import request_hash, request_key, respond_once
+from .notify import message_notifier
+from .recent import recent_messages
+from .rooms import room_registry
+from .search import search_messages
 
 
 class HelloView(APIView):
+    query_budget = 0
+
     @extend_schema(
         responses={200: HelloMessageSerializer}, description="Get a hello world message"
     )
@@ -28,7 +61,66 @@ class HelloView(APIView):
         return Response(serializer.data)
 
 
+class MetricsView(APIView):
+    # Scrapers authenticate with METRICS_TOKEN rather than a member.
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    query_budget = 0
+
+    @extend_schema(
+        responses={200: OpenApiTypes.STR},
+        description=(
+            "Request, SQL, token cache and password hasher metrics of all "
+            "workers, in the Prometheus text format"
+        ),
+    )
+    def get(self, request):
+        if not settings.METRICS_TOKEN:
+            raise PermissionDenied("Metrics are disabled until METRICS_TOKEN is set.")
+        header = request.headers.get("Authorization", "")
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not secrets.compare_digest(header.encode(), expected.encode()):
+            raise PermissionDenied("Invalid metrics token.")
+        return HttpResponse(
+            metrics.render(metrics.collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+class BatchView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    # The batch's own token UPDATE; each sub-request adds its view's budget.
+    query_budget = 1
+
+    @extend_schema(
+        request=BatchSerializer,
+        responses={200: BatchResponseSerializer},
+        description=(
+            "Run several API requests, in order, as the authenticated member "
+            "and return all their responses"
+        ),
+    )
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        entries = serializer.validated_data["requests"]
+        matches = resolve_entries(entries)
+        request._request.sql_query_budget = self.query_budget + batch_query_budget(
+            matches
+        )
+        content, wrote = dispatch(
+            request._request, entries, matches, (request.user, request.auth)
+        )
+        # A batch of reads does not pin the client's reads to the primary.
+        request._request.read_only = not wrote
+        return HttpResponse(content, content_type="application/json")
+
+
 class RegisterView(APIView):
+    throttle_scope = "register"
+    query_budget = 3
+
     @extend_schema(
         responses={201: AuthTokenResponseSerializer},
         description="Register a new member and return token",
@@ -37,9 +129,7 @@ class RegisterView(APIView):
         serializer = MemberRegistrationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         member = serializer.save()
-        token = AuthToken.objects.create(
-            member=member, key=secrets.token_hex(20)
-        )
+        token = issue_token(member)
         response_data = {
             "token": token.key,
             "member": MemberSerializer(member).data,
@@ -49,6 +139,10 @@ class RegisterView(APIView):
 
 
 class LoginView(APIView):
+    throttle_scope = "login"
+    # One more for rewriting a password hash made with outdated parameters.
+    query_budget = 4
+
     @extend_schema(
         responses={200: AuthTokenResponseSerializer},
         description="Log in an existing member and return token",
@@ -57,17 +151,7 @@ class LoginView(APIView):
         serializer = MemberLoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         member = serializer.validated_data["member"]
-        existing_token = (
-            AuthToken.objects.filter(member=member)
-            .order_by("-created_at")
-            .first()
-        )
-        if existing_token is not None:
-            token = existing_token
-        else:
-            token = AuthToken.objects.create(
-                member=member, key=secrets.token_hex(20)
-            )
+        token = login_token(member)
         response_data = {
             "token": token.key,
             "member": MemberSerializer(member).data,
@@ -76,8 +160,41 @@ class LoginView(APIView):
         return Response(response_serializer.data, status=status.HTTP_200_OK)
 
 
+def _member_validators(member):
+    """ETag and Last-Modified timestamp of a member's own representation."""
+    return (
+        quote_etag(f"member-{member.pk}-{member.updated_at.timestamp():.6f}"),
+        int(member.updated_at.timestamp()),
+    )
+
+
+def _conditional_response(request, etag, last_modified=None):
+    """A 304 response if the client's cached copy is current, else None.
+
+    Validators are computed from data already in memory, so a match costs
+    neither a query nor serialization.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is not None:
+        _set_validators(response, etag, last_modified)
+    return response
+
+
+def _set_validators(response, etag, last_modified=None):
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+    # Clients may keep the copy but must revalidate it before every use.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
 class MeView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 2
 
     @extend_schema(
         responses={200: MemberSerializer},
@@ -85,12 +202,17 @@ class MeView(APIView):
     )
     def get(self, request):
         member = request.user
+        etag, last_modified = _member_validators(member)
+        not_modified = _conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
         serializer = MemberSerializer(member)
-        return Response(serializer.data)
+        return _set_validators(Response(serializer.data), etag, last_modified)
 
 
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 3
 
     @extend_schema(
         responses={204: None},
@@ -103,24 +225,98 @@ class LogoutView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+# The largest integer SQLite stores; larger query values cannot be bound.
+MAX_ID = 2**63 - 1
+
+
+def _parse_id(params, name):
+    """Integer query parameter ``name``, or None if missing or not a number."""
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if not -MAX_ID - 1 <= number <= MAX_ID:
+        raise ValidationError({name: ["Must be a 64-bit integer."]})
+    return number
+
+
+def _cursor_headers(request, items, after_id, limit):
+    """Keyset cursors for the pages after and before ``items``."""
+    headers = {}
+    links = []
+    next_cursor = items[-1]["id"] if items else after_id
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+        query = urlencode({"after_id": next_cursor, "limit": limit})
+        links.append(f'<{request.build_absolute_uri(request.path)}?{query}>; rel="next"')
+    if items:
+        prev_cursor = items[0]["id"]
+        headers["X-Prev-Cursor"] = str(prev_cursor)
+        query = urlencode({"before_id": prev_cursor, "limit": limit})
+        links.append(f'<{request.build_absolute_uri(request.path)}?{query}>; rel="prev"')
+    if links:
+        headers["Link"] = ", ".join(links)
+    return headers
+
+
+def _chat_room(room_id):
+    """The room from the URL, or the global room for routes without one."""
+    if room_id is None:
+        return room_registry.global_room()
+    room = room_registry.get(room_id)
+    if room is None:
+        raise NotFound("Chat room not found.")
+    return room
+
+
 class ChatMessageListCreateView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = "chat_post"
+    # A group-commit leader also issues the BEGIN for its batch. Pages that
+    # reach into the archive look up the archived messages' authors. A post
+    # with an Idempotency-Key reads the key, then opens its own transaction to
+    # insert the key (replacing an expired one) along with the message.
+    query_budget = 8
+
+    def get_room(self, room_id):
+        return _chat_room(room_id)
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="before_id",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description="Return the newest messages with id less than this value",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="wait",
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description=(
+                    "Seconds to wait for a message newer than after_id before "
+                    "returning an empty list"
+                ),
+                required=False,
+            ),
+        ],
         responses={200: MessageSerializer},
-        description="List messages from the global chat room",
+        description=(
+            "List messages from a chat room (the global room for "
+            "/api/chat/messages/). Pages are ordered by id; "
+            "the X-Next-Cursor and X-Prev-Cursor headers carry the after_id and "
+            "before_id values for the adjacent pages."
+        ),
     )
-    def get(self, request):
-        room, created = ChatRoom.objects.get_or_create(name="Global chat")
-        queryset = Message.objects.filter(room=room)
-        after_id_param = request.query_params.get("after_id")
-        if after_id_param is not None:
-            try:
-                after_id = int(after_id_param)
-                queryset = queryset.filter(id__gt=after_id)
-            except ValueError:
-                pass
+    def get(self, request, room_id=None):
+        room = self.get_room(room_id)
+        after_id = _parse_id(request.query_params, "after_id")
+        before_id = _parse_id(request.query_params, "before_id")
         limit = 50
         limit_param = request.query_params.get("limit")
         if limit_param is not None:
@@ -132,30 +328,266 @@ class ChatMessageListCreateView(APIView):
                     limit = value
             except ValueError:
                 pass
-        queryset = queryset.order_by("created_at")[:limit]
-        serializer = MessageSerializer(queryset, many=True)
-        return Response(serializer.data)
+        wait = 0.0
+        if after_id is not None:
+            wait_param = request.query_params.get("wait")
+            if wait_param is not None:
+                try:
+                    wait = min(max(float(wait_param), 0.0), settings.CHAT_LONG_POLL_MAX_WAIT)
+                except ValueError:
+                    pass
+        if wait > 0:
+            latest_id = message_notifier.wait(after_id, wait, room.pk)
+        else:
+            latest_id = message_notifier.latest_id(room.pk)
+        # A page only changes when a message is added, edited or deleted, or
+        # when a member (and so an author nickname) changes.
+        etag = quote_etag(
+            f"messages-{room.pk}-{latest_id}-{message_notifier.revision()}-"
+            f"{token_cache.generation}-{after_id}-{before_id}-{limit}"
+        )
+        not_modified = _conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if after_id is not None and latest_id <= after_id:
+            return _set_validators(
+                Response([], headers=_cursor_headers(request, [], after_id, limit)),
+                etag,
+            )
+        if after_id is not None and before_id is None:
+            page = recent_messages.page(room.pk, after_id, latest_id, limit)
+            if page is not None:
+                ids, content = page
+                items = [{"id": message_id} for message_id in ids]
+                response = HttpResponse(
+                    content,
+                    content_type="application/json",
+                    headers=_cursor_headers(request, items, after_id, limit),
+                )
+                return _set_validators(response, etag)
+        queryset = Message.objects.filter(room=room)
+        # Rows at or below the archive boundary are served from the segment
+        # files, including any an interrupted archive run has not deleted yet.
+        boundary = archive_index.boundary(room.pk)
+        if boundary:
+            queryset = queryset.filter(id__gt=boundary)
+        if after_id is not None:
+            queryset = queryset.filter(id__gt=after_id)
+        if before_id is not None:
+            queryset = queryset.filter(id__lt=before_id)
+        if before_id is not None and after_id is None:
+            # Scrolling back: take the newest page below the cursor through the
+            # (room, id) index, then return it in ascending order.
+            data = message_rows(queryset.order_by("-id")[:limit])
+            data.reverse()
+            if boundary and len(data) < limit:
+                data[:0] = archived_messages(
+                    room.pk,
+                    before_id=data[0]["id"] if data else before_id,
+                    limit=limit - len(data),
+                    newest=True,
+                )
+        else:
+            data = []
+            if boundary > (after_id or 0):
+                data = archived_messages(room.pk, after_id, before_id, limit)
+            if len(data) < limit:
+                data += message_rows(queryset.order_by("id")[: limit - len(data)])
+        response = HttpResponse(
+            render_json(data),
+            content_type="application/json",
+            headers=_cursor_headers(request, data, after_id, limit),
+        )
+        return _set_validators(response, etag)
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="Idempotency-Key",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.HEADER,
+                description=(
+                    "Retries with the same key get the first response back "
+                    "instead of posting again"
+                ),
+                required=False,
+            ),
+        ],
         responses={201: MessageSerializer},
-        description="Create a new message in the global chat room",
+        description=(
+            "Create a new message in a chat room (the global room for "
+            "/api/chat/messages/)"
+        ),
     )
-    def post(self, request):
-        room, created = ChatRoom.objects.get_or_create(name="Global chat")
+    def post(self, request, room_id=None):
+        room = self.get_room(room_id)
         member = request.user
+        key = request_key(request)
         serializer = MessageCreateSerializer(
             data=request.data,
-            context={"member": member, "room": room},
+            # The idempotency key must commit together with its message.
+            context={"member": member, "room": room, "group_commit": key is None},
         )
         serializer.is_valid(raise_exception=True)
+        if key is not None:
+            return self.post_once(serializer, member, room, key)
         message = serializer.save()
         read_serializer = MessageSerializer(message)
+        chat_hub.publish(read_serializer.data)
         return Response(read_serializer.data, status=status.HTTP_201_CREATED)
 
+    def post_once(self, serializer, member, room, key):
+        saved = []
+
+        def create():
+            saved.append(MessageSerializer(serializer.save()).data)
+            return status.HTTP_201_CREATED, render_json(saved[0])
+
+        digest = request_hash(room.pk, serializer.validated_data["text"])
+        response, created = respond_once(member, key, digest, create)
+        # A message whose key lost a race was rolled back; its id will be
+        # reused, so it must not reach subscribers.
+        if created:
+            chat_hub.publish(saved[0])
+        return response
+
+
+class ChatRoomListView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = "chat_room"
+    query_budget = 4
+
+    @extend_schema(
+        responses={200: ChatRoomSerializer(many=True)},
+        description="List chat rooms",
+    )
+    def get(self, request):
+        serializer = ChatRoomSerializer(room_registry.all(), many=True)
+        return Response(serializer.data)
+
+    @extend_schema(
+        request=ChatRoomSerializer,
+        responses={201: ChatRoomSerializer},
+        description="Create a chat room",
+    )
+    def post(self, request):
+        serializer = ChatRoomSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ChatSearchView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 3
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="q",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Words to search for; results contain all of them",
+                required=True,
+            ),
+            OpenApiParameter(
+                name="room_id",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description="Only search this chat room",
+                required=False,
+            ),
+        ],
+        responses={200: MessageSerializer},
+        description=(
+            "Search messages, best matches first. Each result carries an HTML "
+            "snippet with the matches in <mark>; the Link header points to the "
+            "next page."
+        ),
+    )
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError({"q": ["This field is required."]})
+        room_id = _parse_id(request.query_params, "room_id")
+        if room_id is not None and room_registry.get(room_id) is None:
+            raise NotFound("Chat room not found.")
+        before_id = _parse_id(request.query_params, "before_id")
+        limit = min(max(_parse_id(request.query_params, "limit") or 20, 1), 50)
+        offset = max(_parse_id(request.query_params, "offset") or 0, 0)
+        offset = min(offset, settings.CHAT_SEARCH_MAX_CANDIDATES)
+        data, window = search_messages(query, room_id, before_id, limit, offset)
+        headers = {}
+        if len(data) == limit:
+            params = {"q": query, "before_id": window, "limit": limit}
+            if room_id is not None:
+                params["room_id"] = room_id
+            params["offset"] = offset + limit
+            url = f"{request.build_absolute_uri(request.path)}?{urlencode(params)}"
+            headers["Link"] = f'<{url}>; rel="next"'
+        return HttpResponse(
+            render_json(data), content_type="application/json", headers=headers
+        )
+
+
+class ChatReadCursorView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    # Includes the BEGIN and upsert of a written-through cursor
+    # (CHAT_READ_CURSOR_FLUSH_INTERVAL = 0).
+    query_budget = 5
+
+    @extend_schema(
+        request=ReadCursorSerializer,
+        responses={200: ReadCursorSerializer},
+        description=(
+            "Mark the messages of a chat room (the global room for "
+            "/api/chat/cursor/) up to last_read_id as read. The cursor never "
+            "moves backwards; updates are written in batches."
+        ),
+    )
+    def put(self, request, room_id=None):
+        room = _chat_room(room_id)
+        serializer = ReadCursorSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            last_read_id, unread_count = mark_read(
+                request.user.pk, room, serializer.validated_data["last_read_id"]
+            )
+        except ChatRoom.DoesNotExist:
+            raise NotFound("Chat room not found.")
+        data = {
+            "room_id": room.pk,
+            "last_read_id": last_read_id,
+            "unread_count": unread_count,
+        }
+        return Response(ReadCursorSerializer(data).data)
+
+
+class ChatUnreadView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 4
+
+    @extend_schema(
+        responses={200: ReadCursorSerializer(many=True)},
+        description="Read cursor and unread message count in every chat room",
+    )
+    def get(self, request):
+        data = [
+            {"room_id": room_id, "last_read_id": last_read_id, "unread_count": count}
+            for room_id, last_read_id, count in unread_counts(request.user.pk)
+        ]
+        return Response(ReadCursorSerializer(data, many=True).data)
+
 
 class ProfileView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = "profile"
+    query_budget = 4
 
     @extend_schema(
         responses={200: ProfileSerializer},
@@ -163,8 +595,12 @@ class ProfileView(APIView):
     )
     def get(self, request):
         member = request.user
+        etag, last_modified = _member_validators(member)
+        not_modified = _conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
         serializer = ProfileSerializer(member)
-        return Response(serializer.data)
+        return _set_validators(Response(serializer.data), etag, last_modified)
 
     @extend_schema(
         request=ProfileSerializer,
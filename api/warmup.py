@@ -0,0 +1,70 @@
+"""Pay first-request costs before a worker takes traffic.
+
+Called from the gunicorn hooks in ``gunicorn.conf.py``. Without it the first
+requests each worker serves also build the URL resolver, the serializers'
+field maps and model ``_meta`` caches, open the SQLite connection (running the
+PRAGMA ``init_command``) and start the password hasher pool.
+"""
+
+import inspect
+import threading
+
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework.serializers import BaseSerializer
+
+from . import serializers
+from .hashing import hasher_pool
+from .models import Message
+from .notify import message_notifier
+
+
+def warm_urls():
+    resolver = get_resolver()
+    # Populates the reverse and namespace maps that resolve() builds lazily.
+    resolver.reverse_dict
+    resolver.resolve("/api/hello/")
+
+
+def warm_serializers():
+    for _, serializer_class in inspect.getmembers(serializers, inspect.isclass):
+        if (
+            issubclass(serializer_class, BaseSerializer)
+            and serializer_class.__module__ == serializers.__name__
+        ):
+            serializer_class().fields
+
+
+def warm_database():
+    """Open this thread's connections and load the schema into each of them."""
+    for alias in connections:
+        connections[alias].ensure_connection()
+        Message.objects.using(alias).only("id").exists()
+
+
+def warm_up():
+    warm_urls()
+    warm_serializers()
+    warm_database()
+    message_notifier.latest_id()
+    hasher_pool.start()
+
+
+def warm_up_threads(executor, count, timeout=10):
+    """Open database connections in each of ``count`` executor threads.
+
+    Connections are per thread, so a threaded worker has to warm every thread
+    of its pool. The barrier keeps one thread from running several tasks.
+    """
+    barrier = threading.Barrier(count, timeout=timeout)
+
+    def warm():
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        warm_database()
+
+    futures = [executor.submit(warm) for _ in range(count)]
+    for future in futures:
+        future.result(timeout=timeout * 2)
@@ -0,0 +1,110 @@
+"""ASGI WebSocket endpoint that pushes new chat messages to clients.
+
+Clients authenticate with the same ``Token <key>`` scheme as the REST API,
+either in the ``Authorization`` header or, for browsers that cannot set
+headers on a WebSocket handshake, in a ``token`` query parameter. A ``room``
+query parameter picks the room (the global room by default). Every message
+created in that room is then sent as a JSON text frame::
+
+    {"type": "message", "message": {...same shape as the REST API...}}
+"""
+
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import TokenAuthentication
+from .hub import chat_hub
+from .rooms import room_registry
+
+CHAT_PATH = "/api/ws/chat/"
+
+# Application-defined close codes (RFC 6455 reserves 4000-4999).
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+# "Try again later": the client fell too far behind the message stream.
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def _query(scope):
+    return parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+
+def _token_key(scope):
+    authentication = TokenAuthentication()
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            parts = value.decode("latin-1").split()
+            if len(parts) == 2 and parts[0] == authentication.keyword:
+                return parts[1]
+            return None
+    values = _query(scope).get("token")
+    return values[0] if values else None
+
+
+def _room(scope):
+    values = _query(scope).get("room")
+    if not values:
+        return room_registry.global_room()
+    try:
+        return room_registry.get(int(values[0]))
+    except ValueError:
+        return None
+
+
+def _authenticate(key):
+    close_old_connections()
+    try:
+        member, token = TokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return None
+    return member
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    if scope["path"] != CHAT_PATH:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+    key = _token_key(scope)
+    member = await sync_to_async(_authenticate)(key) if key else None
+    if member is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+    room = await sync_to_async(_room)(scope)
+    if room is None:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+    await send({"type": "websocket.accept"})
+
+    subscription = chat_hub.subscribe(room_id=room.pk)
+    receiver = asyncio.ensure_future(receive())
+    sender = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, pending = await asyncio.wait(
+                {receiver, sender}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    return
+                # The channel is push-only; frames from the client are ignored.
+                receiver = asyncio.ensure_future(receive())
+            if sender in done:
+                data = sender.result()
+                if data is None:
+                    await send(
+                        {"type": "websocket.close", "code": CLOSE_TRY_AGAIN_LATER}
+                    )
+                    return
+                await send({"type": "websocket.send", "text": data})
+                sender = asyncio.ensure_future(subscription.get())
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        chat_hub.unsubscribe(subscription)
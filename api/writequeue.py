@@ -0,0 +1,90 @@
+"""Group commit for chat message inserts.
+
+With SQLite every committed transaction costs a journal sync, so one insert
+per transaction caps write throughput during bursts. When group commit is
+enabled, the first poster becomes the leader: it waits a few milliseconds for
+concurrent posters to queue up, inserts the whole batch with one
+``bulk_create`` in one transaction and hands every caller its own row. The
+next queued poster, if any, then leads the following batch.
+
+Batching happens between threads of one worker process (``gthread`` workers
+or an ASGI server); with ``sync`` workers every batch holds a single insert.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Message
+from .notify import message_notifier
+from .recent import recent_messages
+
+
+class _PendingInsert:
+    def __init__(self, message):
+        self.message = message
+        self.error = None
+        self.lead = False
+        self.event = threading.Event()
+
+
+class GroupCommitQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leader_active = False
+        self.batches = 0
+
+    def submit(self, **fields):
+        """Insert a ``Message`` built from ``fields`` and return it with its id."""
+        pending = _PendingInsert(Message(**fields))
+        with self._lock:
+            self._pending.append(pending)
+            if not self._leader_active:
+                self._leader_active = True
+                pending.lead = True
+        if not pending.lead:
+            pending.event.wait()
+        if pending.lead:
+            # Either the first poster or promoted by the previous leader; our
+            # own insert is at the head of the queue, so it is in this batch.
+            self._lead()
+        if pending.error is not None:
+            raise pending.error
+        return pending.message
+
+    def _lead(self):
+        time.sleep(settings.CHAT_GROUP_COMMIT_WINDOW_MS / 1000)
+        with self._lock:
+            batch = self._pending[: settings.CHAT_GROUP_COMMIT_MAX_BATCH]
+            del self._pending[: len(batch)]
+        try:
+            with transaction.atomic():
+                # Rows are inserted, and receive ids, in arrival order.
+                Message.objects.bulk_create([pending.message for pending in batch])
+        except Exception as exc:
+            for pending in batch:
+                pending.error = exc
+        else:
+            self.batches += 1
+            # bulk_create skips post_save, so announce the batch here.
+            for pending in batch:
+                recent_messages.append(pending.message)
+            latest = {pending.message.room_id: pending.message.pk for pending in batch}
+            for room_id, message_id in latest.items():
+                message_notifier.publish(message_id, room_id)
+        finally:
+            with self._lock:
+                if self._pending:
+                    successor = self._pending[0]
+                    successor.lead = True
+                    successor.event.set()
+                else:
+                    self._leader_active = False
+            for pending in batch:
+                pending.event.set()
+
+
+message_write_queue = GroupCommitQueue()
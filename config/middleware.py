@@ -0,0 +1,47 @@
+"""Browser-session middleware that stands aside for API requests.
+
+The API authenticates with header tokens only (``api.authentication``), so
+sessions, CSRF checks, ``request.user`` and flash messages are dead weight on
+``/api/`` paths: each request would still build a lazy user, parse cookies and
+run the CSRF view hook. These subclasses skip the wrapped middleware for API
+paths and behave exactly like the original everywhere else, so the admin keeps
+working. Subclassing (rather than wrapping) also keeps Django's admin system
+checks, which look for these middleware by class, satisfied.
+"""
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+def is_api_request(request):
+    return request.path_info.startswith(settings.API_PATH_PREFIX)
+
+
+class NonAPIMiddlewareMixin:
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class NonAPISessionMiddleware(NonAPIMiddlewareMixin, SessionMiddleware):
+    pass
+
+
+class NonAPICsrfViewMiddleware(NonAPIMiddlewareMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # The handler calls view hooks directly, bypassing __call__.
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class NonAPIAuthenticationMiddleware(NonAPIMiddlewareMixin, AuthenticationMiddleware):
+    pass
+
+
+class NonAPIMessageMiddleware(NonAPIMiddlewareMixin, MessageMiddleware):
+    pass
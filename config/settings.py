@@ -74,6 +74,13 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "api.authentication.TokenAuthentication",
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "api.throttling.MemberRateThrottle",
+        "api.throttling.IPRateThrottle",
+    ],
+    # nginx appends the client address to X-Forwarded-For. Only used by the
+    # IP throttles when API_THROTTLE_IP_HEADER is empty.
+    "NUM_PROXIES": int(os.environ.get("DJANGO_NUM_PROXIES", "1")),
 }
 
 # drf-spectacular configuration
@@ -84,15 +91,39 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
-MIDDLEWARE = [
-    "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
-]
+# Requests under this prefix are API calls authenticated by header tokens.
+API_PATH_PREFIX = "/api/"
+
+# With the lean API profile, sessions, CSRF, auth and messages middleware only
+# run for non-API paths such as the admin (see config/middleware.py).
+API_LEAN_MIDDLEWARE = os.environ.get("DJANGO_API_LEAN_MIDDLEWARE", "1") == "1"
+
+if API_LEAN_MIDDLEWARE:
+    MIDDLEWARE = [
+        "api.middleware.MetricsMiddleware",
+        "api.middleware.QueryBudgetMiddleware",
+        "api.middleware.ReadReplicaMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "config.middleware.NonAPISessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "config.middleware.NonAPICsrfViewMiddleware",
+        "config.middleware.NonAPIAuthenticationMiddleware",
+        "config.middleware.NonAPIMessageMiddleware",
+        "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    ]
+else:
+    MIDDLEWARE = [
+        "api.middleware.MetricsMiddleware",
+        "api.middleware.QueryBudgetMiddleware",
+        "api.middleware.ReadReplicaMiddleware",
+        "django.middleware.security.SecurityMiddleware",
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.middleware.common.CommonMiddleware",
+        "django.middleware.csrf.CsrfViewMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "django.contrib.messages.middleware.MessageMiddleware",
+        "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    ]
 
 ROOT_URLCONF = "config.urls"
 
@@ -112,18 +143,246 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite connection tuning, applied by Django to every new connection. WAL lets
+# readers and the writer proceed concurrently, busy_timeout makes writers queue
+# for the lock instead of failing, and IMMEDIATE transactions take the write
+# lock up front so a read-then-write transaction cannot deadlock on upgrade.
+SQLITE_PRAGMAS = {
+    # Lets archive_messages hand freed pages back to the filesystem. Only takes
+    # effect on new databases (so it must precede journal_mode, which writes
+    # the header), or on existing ones after a one-off VACUUM.
+    "auto_vacuum": os.environ.get("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Pages of WAL after which a commit runs a checkpoint itself. The
+    # checkpoint_wal command normally keeps the log well below this, so
+    # requests rarely pay for one.
+    "wal_autocheckpoint": int(os.environ.get("SQLITE_WAL_AUTOCHECKPOINT", "10000")),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative values are KiB: 64 MiB of page cache per connection.
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", "-65536")),
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "persistent" / "db" / "db.sqlite3",
+        "NAME": os.environ.get(
+            "DJANGO_DB_NAME", BASE_DIR / "persistent" / "db" / "db.sqlite3"
+        ),
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+            ),
+            "transaction_mode": os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+        },
+        # Persistent connections, checked before reuse after a request ends.
+        "CONN_MAX_AGE": int(os.environ.get("DJANGO_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read-only alias for safe-method requests (api/routers.py). For SQLite it opens
+# the same file through a mode=ro URI; journal_mode is left to the primary.
+if os.environ.get("DJANGO_READ_REPLICA", "1") == "1":
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ.get(
+            "DJANGO_READ_REPLICA_NAME",
+            f"file:{DATABASES['default']['NAME']}?mode=ro",
+        ),
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}"
+                for name, value in SQLITE_PRAGMAS.items()
+                if name not in ("journal_mode", "auto_vacuum")
+            )
+            + ";PRAGMA query_only=1",
+        },
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["api.routers.ReadWriteRouter"]
+
+# How long (seconds) a client that just wrote keeps reading from the primary.
+DATABASE_READ_STICKY_SECONDS = int(os.environ.get("DATABASE_READ_STICKY_SECONDS", "5"))
+
+
+# Shared state
+# Small mmap'd files shared by all gunicorn workers (see api/shm.py)
+
+SHARED_STATE_DIR = Path(
+    os.environ.get("DJANGO_SHARED_STATE_DIR", BASE_DIR / "persistent" / "run")
+)
+
+
+# Chat long-polling (api/notify.py)
+# Upper bound for the ``wait`` query parameter and how often waiters re-check.
+# Rooms with ids below ROOM_SLOTS have a latest-id counter of their own; those
+# above it share the overall one, so their pollers wake on posts to any room.
+
+CHAT_LONG_POLL_MAX_WAIT = float(os.environ.get("CHAT_LONG_POLL_MAX_WAIT", "25"))
+CHAT_LONG_POLL_INTERVAL = float(os.environ.get("CHAT_LONG_POLL_INTERVAL", "0.05"))
+CHAT_LONG_POLL_ROOM_SLOTS = int(os.environ.get("CHAT_LONG_POLL_ROOM_SLOTS", "4096"))
+
+
+# Chat WebSocket push channel (config/asgi.py)
+# Frames buffered per socket before a slow client is disconnected, and the most
+# messages posted through other workers that api/hub.py loads per query.
+
+CHAT_WEBSOCKET_QUEUE_SIZE = int(os.environ.get("CHAT_WEBSOCKET_QUEUE_SIZE", "100"))
+CHAT_HUB_LOAD_LIMIT = int(os.environ.get("CHAT_HUB_LOAD_LIMIT", "500"))
+
+
+# Chat group commit (api/writequeue.py)
+# Concurrent message posts within the window share one INSERT transaction.
+# Only useful with threaded workers; off by default.
+
+CHAT_GROUP_COMMIT_ENABLED = os.environ.get("CHAT_GROUP_COMMIT_ENABLED", "0") == "1"
+CHAT_GROUP_COMMIT_WINDOW_MS = float(os.environ.get("CHAT_GROUP_COMMIT_WINDOW_MS", "5"))
+CHAT_GROUP_COMMIT_MAX_BATCH = int(os.environ.get("CHAT_GROUP_COMMIT_MAX_BATCH", "100"))
+
+
+# Recent chat messages (api/recent.py)
+# The newest CHAT_RECENT_MESSAGES messages are kept rendered in a ring shared by
+# all workers and answer polls after a cursor inside it (0 disables the ring).
+# Messages longer than a slot (bytes, including a 20-byte header) are always
+# read from the database.
+
+CHAT_RECENT_MESSAGES = int(os.environ.get("CHAT_RECENT_MESSAGES", "4096"))
+CHAT_RECENT_SLOT_BYTES = int(os.environ.get("CHAT_RECENT_SLOT_BYTES", "1024"))
+
+
+# Chat idempotency keys (api/idempotency.py)
+# Responses to posts sent with an Idempotency-Key header are replayed to
+# retries for this many seconds; the sweep_idempotency_keys command deletes
+# older ones.
+
+CHAT_IDEMPOTENCY_KEY_TTL = int(os.environ.get("CHAT_IDEMPOTENCY_KEY_TTL", "86400"))
+
+
+# Chat read cursors (api/cursors.py)
+# Each worker collects cursor updates and writes them every this many seconds
+# in one transaction; 0 writes every update through.
+
+CHAT_READ_CURSOR_FLUSH_INTERVAL = float(
+    os.environ.get("CHAT_READ_CURSOR_FLUSH_INTERVAL", "2")
+)
+
+
+# Chat message search (api/search.py)
+# Searches rank only this many of the newest matching messages, which keeps
+# common words as fast as rare ones on a large history.
+
+CHAT_SEARCH_MAX_CANDIDATES = int(os.environ.get("CHAT_SEARCH_MAX_CANDIDATES", "1000"))
+
+
+# Chat message retention (api/archive.py)
+# archive_messages moves messages older than the retention period (days; 0
+# keeps everything in the database) into compressed segment files, at most
+# CHAT_ARCHIVE_SEGMENT_SIZE messages per file.
+
+CHAT_MESSAGE_RETENTION_DAYS = int(os.environ.get("CHAT_MESSAGE_RETENTION_DAYS", "90"))
+CHAT_ARCHIVE_ROOT = Path(os.environ.get("CHAT_ARCHIVE_ROOT", MEDIA_ROOT / "archive"))
+CHAT_ARCHIVE_SEGMENT_SIZE = int(os.environ.get("CHAT_ARCHIVE_SEGMENT_SIZE", "5000"))
+
+
+# Request throttling (api/throttling.py)
+# Token buckets per view throttle_scope, per member and per client IP, shared
+# by all workers. "N/period" allows bursts of N and refills N per period.
+# The client IP is read from IP_HEADER, which nginx sets to the address its
+# realip module takes from the trusted proxies' X-Forwarded-For (see
+# nginx/django-api.conf); an empty IP_HEADER falls back to DRF's
+# X-Forwarded-For handling with NUM_PROXIES.
+
+API_THROTTLE_ENABLED = os.environ.get("API_THROTTLE_ENABLED", "1") == "1"
+API_THROTTLE_IP_HEADER = os.environ.get("API_THROTTLE_IP_HEADER", "X-Real-IP")
+API_THROTTLE_TABLE_SIZE = int(os.environ.get("API_THROTTLE_TABLE_SIZE", "65536"))
+API_THROTTLE_RATES = {
+    "chat_post.member": os.environ.get("THROTTLE_CHAT_POST_MEMBER", "30/min"),
+    "chat_post.ip": os.environ.get("THROTTLE_CHAT_POST_IP", "300/min"),
+    "chat_room.member": os.environ.get("THROTTLE_CHAT_ROOM_MEMBER", "10/hour"),
+    "login.member": os.environ.get("THROTTLE_LOGIN_MEMBER", "10/min"),
+    "login.ip": os.environ.get("THROTTLE_LOGIN_IP", "30/min"),
+    "register.ip": os.environ.get("THROTTLE_REGISTER_IP", "10/hour"),
+    "profile.member": os.environ.get("THROTTLE_PROFILE_MEMBER", "10/min"),
+}
+
+
+# Batch requests (api/batch.py)
+# Most sub-requests one POST to /api/batch/ may carry.
+
+API_BATCH_MAX_REQUESTS = int(os.environ.get("API_BATCH_MAX_REQUESTS", "10"))
+
+
+# Token authentication cache (api/authentication.py)
+# Per-worker LRU of token -> member; 0 disables it. The TTL (seconds) bounds how
+# long changes made outside the application can go unnoticed.
+
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.environ.get("AUTH_TOKEN_CACHE_TTL", "60"))
+
+
+# Token expiry (api/authentication.py)
+# Tokens expire TTL seconds after login and IDLE_TTL seconds after last use (0
+# disables either limit). Use is recorded at most once per TOUCH_INTERVAL so
+# authenticated reads do not write on every request. Expired rows are deleted
+# by the sweep_expired_tokens command.
+
+AUTH_TOKEN_TTL = int(os.environ.get("AUTH_TOKEN_TTL", str(30 * 24 * 3600)))
+AUTH_TOKEN_IDLE_TTL = int(os.environ.get("AUTH_TOKEN_IDLE_TTL", str(7 * 24 * 3600)))
+AUTH_TOKEN_TOUCH_INTERVAL = int(os.environ.get("AUTH_TOKEN_TOUCH_INTERVAL", "300"))
+
+
+# Password hashing (api/hashing.py)
+# PBKDF2 runs in a per-worker process pool (0 workers hashes inline). At most
+# MAX_PENDING hashing operations may be in flight across all workers; beyond
+# that login, registration and password changes answer 503 with Retry-After.
+# By default that is one running and one queued operation per pool process of
+# every gunicorn worker (WEB_CONCURRENCY, which gunicorn.conf.py exports).
+
+PASSWORD_HASHER_WORKERS = int(os.environ.get("PASSWORD_HASHER_WORKERS", "1"))
+PASSWORD_HASHER_MAX_PENDING = int(
+    os.environ.get(
+        "PASSWORD_HASHER_MAX_PENDING",
+        str(
+            2
+            * int(os.environ.get("WEB_CONCURRENCY", "1"))
+            * max(PASSWORD_HASHER_WORKERS, 1)
+        ),
+    )
+)
+PASSWORD_HASHER_TIMEOUT = float(os.environ.get("PASSWORD_HASHER_TIMEOUT", "10"))
+
+
+# SQL budget instrumentation (api/middleware.py)
+# Requests over their view's ``query_budget`` (or the default below) or over the
+# time budget are logged to the "api.sql" logger. Headers expose the numbers.
+
+SQL_BUDGET_ENABLED = os.environ.get("SQL_BUDGET_ENABLED", "1") == "1"
+SQL_BUDGET_HEADERS = os.environ.get("SQL_BUDGET_HEADERS", "1" if DEBUG else "0") == "1"
+SQL_BUDGET_MAX_QUERIES = int(os.environ.get("SQL_BUDGET_MAX_QUERIES", "10"))
+SQL_BUDGET_MAX_TIME_MS = float(os.environ.get("SQL_BUDGET_MAX_TIME_MS", "250"))
+
+
+# Metrics (api/metrics.py)
+# Every worker records request metrics into its own file under SHARED_STATE_DIR
+# and /api/metrics/ serves their sum in the Prometheus text format. Scrapes
+# must send TOKEN as "Authorization: Bearer <token>"; while it is empty, the
+# endpoint refuses every request.
+# MAX_SERIES bounds the series one worker records; further ones are dropped.
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", "4096"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
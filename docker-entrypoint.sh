@@ -12,6 +12,9 @@ else
     echo "==> No existing database found, creating new one"
 fi
 
+# Shared worker state (latest message id etc.) describes the removed database
+rm -rf /app/persistent/run
+
 # Create persistent dirs
 /bin/mkdir -p /app/persistent/db
 /bin/mkdir -p /app/persistent/media
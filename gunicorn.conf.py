@@ -1,17 +1,54 @@
-"""Gunicorn configuration for Docker deployment"""
+"""Gunicorn configuration for Docker deployment
+
+Worker model and counts adapt to the CPUs available to the container and can
+be overridden with GUNICORN_* environment variables.
+"""
+
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+cpu_count = _cpu_count()
 
 # Server socket - bind to different port for nginx upstream
-bind = "127.0.0.1:8001"
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8001")
 
 # Worker processes
-workers = 2
-worker_class = "sync"
-worker_connections = 1000
+# gthread (the default) serves several requests per process, so long-polls and
+# slow password hashing no longer occupy a whole worker; "sync" keeps the old
+# one-request-per-process model. Django keeps a database connection per
+# thread, and the shared in-process state (token cache, hubs, queues) is
+# guarded by locks.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gthread":
+    workers = _env_int("GUNICORN_WORKERS", cpu_count + 1)
+    threads = _env_int("GUNICORN_THREADS", 8)
+else:
+    workers = _env_int("GUNICORN_WORKERS", cpu_count * 2 + 1)
+    threads = 1
+workers = max(1, min(workers, _env_int("GUNICORN_MAX_WORKERS", 8)))
+# Read by the settings to size limits shared by all workers.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Open client connections per gthread worker (including keep-alive ones)
+worker_connections = _env_int("GUNICORN_WORKER_CONNECTIONS", 1000)
 max_requests = 10000
 max_requests_jitter = 1000
 
 # Timeouts
-timeout = 300
+# Must exceed CHAT_LONG_POLL_MAX_WAIT: a sync worker holding a long-poll stops
+# heartbeating for its whole duration.
+timeout = _env_int("GUNICORN_TIMEOUT", 60)
 keepalive = 5
 graceful_timeout = 30
 
@@ -36,3 +73,42 @@ limit_request_field_size = 8190
 
 # Preload app for better performance
 preload_app = True
+
+
+def on_starting(server):
+    # Request metrics of a previous master's workers (api/metrics.py).
+    from api import metrics
+
+    metrics.reset()
+
+
+def post_fork(server, worker):
+    # Never share SQLite handles opened while preloading in the master.
+    from django.db import connections
+
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    # Runs after post_fork once the worker has set up its thread pool, so every
+    # thread can be given a warm connection before the first request arrives.
+    from api.warmup import warm_up, warm_up_threads
+
+    warm_up()
+    if getattr(worker, "tpool", None) is not None:
+        warm_up_threads(worker.tpool, worker.cfg.threads)
+    worker.log.info("Worker warmed up (%s, %d threads)", worker_class, threads)
+
+
+def worker_exit(server, worker):
+    # Write the read cursors this worker still holds (api/cursors.py).
+    from api.cursors import read_cursors
+
+    read_cursors.flush()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's request counters in the totals (api/metrics.py).
+    from api import metrics
+
+    metrics.collect_worker(worker.pid)